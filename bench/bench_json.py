@@ -0,0 +1,96 @@
+"""
+Benchmark of the JSON backends on a listing response.
+
+Builds the body of GET /weather/ for --rows rows with each provider, checks the bytes are
+identical and reports the encoding time. Results are written as JSON like bench_weather.py.
+
+    PYTHONPATH=weather python bench/bench_json.py --rows 100000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from flask import Flask
+
+from json_provider import JSONProvider, OrjsonJSONProvider, orjson
+from bench_weather import CITIES, DESCRIPTIONS, git_revision
+
+def listing(rows, rng):
+    # the dicts weather_row_to_dict builds for the listing
+    start = datetime(2024, 1, 1)
+    weathers = []
+    for id in range(1, rows + 1):
+        created_at = (start + timedelta(seconds=id * 37)).isoformat(' ', 'seconds')
+        weathers.append({
+            'id': id,
+            'city': rng.choice(CITIES),
+            'temperature': str(Decimal(rng.randint(-2000, 4500)) / 100),
+            'humidity': str(Decimal(rng.randint(500, 10000)) / 100),
+            'description': rng.choice(DESCRIPTIONS),
+            'created_at': created_at,
+            'updated_at': created_at
+        })
+    return {'weathers': weathers}
+
+def time_response(provider, obj, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = provider.response(obj).get_data()
+        timings.append(time.perf_counter() - start)
+    return body, timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the JSON backends on a listing response.')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='JSON results file, bench/results/json-<timestamp>.json by default')
+    args = parser.parse_args(argv)
+    if orjson is None:
+        sys.exit('orjson is not installed')
+
+    app = Flask(__name__)
+    obj = listing(args.rows, random.Random(42))
+    providers = {'stdlib': JSONProvider(app), 'orjson': OrjsonJSONProvider(app)}
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'rows': args.rows,
+            'repeat': args.repeat
+        },
+        'backends': {}
+    }
+    bodies = {}
+    for name, provider in providers.items():
+        bodies[name], timings = time_response(provider, obj, args.repeat)
+        results['backends'][name] = {
+            'bytes': len(bodies[name]),
+            'best_ms': round(min(timings) * 1000, 3),
+            'median_ms': round(statistics.median(timings) * 1000, 3)
+        }
+    if bodies['orjson'] != bodies['stdlib']:
+        sys.exit('orjson output differs from the stdlib output')
+    results['speedup'] = round(results['backends']['stdlib']['median_ms'] / results['backends']['orjson']['median_ms'], 2)
+
+    for name, result in results['backends'].items():
+        print(f"{name:<8}{result['median_ms']:>10} ms median{result['best_ms']:>10} ms best{result['bytes']:>12} bytes")
+    print(f"orjson is {results['speedup']}x faster, output identical")
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', f"json-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -8,4 +8,13 @@ fi
 python -m pytest tests/conftest.py
 python -m pytest tests/test_db.py
 python -m pytest tests/test_factory.py
-python -m pytest tests/test_weather.py
\ No newline at end of file
+python -m pytest tests/test_weather.py
+python -m pytest tests/test_cache.py
+python -m pytest tests/test_asgi.py
+python -m pytest tests/test_pools.py
+python -m pytest tests/test_replicas.py
+python -m pytest tests/test_ingest.py
+python -m pytest tests/test_metrics.py
+python -m pytest tests/test_profiling.py
+python -m pytest tests/test_logs.py
+python -m pytest tests/test_json_provider.py
\ No newline at end of file
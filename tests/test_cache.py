@@ -0,0 +1,159 @@
+from cache import SingleFlightCache, LocalCache, CachedResponse
+from fakeredis import FakeStrictRedis
+import gzip
+import pytest
+import time
+
+@pytest.fixture
+def fake_redis():
+    return FakeStrictRedis(decode_responses=True)
+
+@pytest.fixture
+def swr_cache(fake_redis):
+    return SingleFlightCache(fake_redis, soft_ttl=60, hard_ttl=3600, jitter=5, lock_wait=0.2, poll_interval=0.01)
+
+@pytest.fixture
+def local_cache(fake_redis):
+    return LocalCache(fake_redis, 'cache:invalidate', max_entries=2, max_bytes=10, ttl=60)
+
+    """
+    Test cases for SingleFlightCache
+    """
+def test_get_or_compute_miss_then_hit(swr_cache, fake_redis):
+    calls = []
+    compute = lambda generation: calls.append(1) or "value"
+    
+    assert swr_cache.get_or_compute('key', compute) == ("value", 'miss')
+    assert swr_cache.get_or_compute('key', compute) == ("value", 'hit')
+    assert len(calls) == 1
+    assert 3600 <= fake_redis.ttl('key') <= 3605
+    assert fake_redis.get('key:lock') is None
+    
+def test_invalidate_recomputes_once(swr_cache):
+    swr_cache.get_or_compute('key', lambda generation: "old")
+    swr_cache.invalidate('key')
+    
+    assert swr_cache.get_or_compute('key', lambda generation: "new") == ("new", 'miss')
+    assert swr_cache.get_or_compute('key', lambda generation: "newer") == ("new", 'hit')
+    
+def test_stale_served_while_locked(swr_cache, fake_redis):
+    swr_cache.get_or_compute('key', lambda generation: "old")
+    swr_cache.invalidate('key')
+    
+    # another worker is rebuilding
+    fake_redis.set('key:lock', 'other-worker')
+    assert swr_cache.get_or_compute('key', lambda generation: pytest.fail("must not recompute")) == ("old", 'stale')
+    
+def test_write_during_rebuild_keeps_value_stale(swr_cache):
+    def compute(generation):
+        # a write lands while the value is being rebuilt
+        swr_cache.invalidate('key')
+        return "before write"
+    
+    swr_cache.get_or_compute('key', compute)
+    assert swr_cache.get_or_compute('key', lambda generation: "after write") == ("after write", 'miss')
+    
+def test_cold_cache_waits_then_computes(swr_cache, fake_redis):
+    fake_redis.set('key:lock', 'other-worker')
+    
+    assert swr_cache.get_or_compute('key', lambda generation: "value") == ("value", 'miss')
+    # the lock holder is left to store the value
+    assert fake_redis.get('key') is None
+    
+def test_release_keeps_foreign_lock(swr_cache, fake_redis):
+    fake_redis.set('key:lock', 'other-worker')
+    swr_cache._release('key', 'expired-token')
+    
+    assert fake_redis.get('key:lock') == 'other-worker'
+    
+    """
+    Test cases for LocalCache
+    """
+def test_local_cache_lru_eviction(local_cache):
+    local_cache.set('a', b'1')
+    local_cache.set('b', b'2')
+    local_cache.get('a')
+    local_cache.set('c', b'3')
+    
+    assert local_cache.get('a') == b'1'
+    assert local_cache.get('b') is None
+    assert local_cache.get('c') == b'3'
+    
+def test_local_cache_max_bytes(local_cache):
+    local_cache.set('a', b'123456')
+    local_cache.set('b', b'123456')
+    local_cache.set('too big', b'12345678901')
+    
+    assert local_cache.get('a') is None
+    assert local_cache.get('b') == b'123456'
+    assert local_cache.get('too big') is None
+    
+def test_local_cache_ttl(fake_redis):
+    local_cache = LocalCache(fake_redis, 'cache:invalidate', max_entries=2, max_bytes=10, ttl=0)
+    local_cache.set('a', b'1')
+    
+    assert local_cache.get('a') is None
+    
+def test_local_cache_disabled(fake_redis):
+    local_cache = LocalCache(fake_redis, 'cache:invalidate', max_entries=2, max_bytes=10, ttl=60, enabled=False)
+    local_cache.set('a', b'1')
+    
+    assert local_cache.get('a') is None
+    
+def test_local_cache_set_after_invalidation(local_cache):
+    version = local_cache.version('a')
+    # the invalidation is handled while the value is read from redis
+    local_cache.delete('a')
+    local_cache.set('a', b'1', version)
+    
+    assert local_cache.get('a') is None
+    local_cache.set('a', b'2', local_cache.version('a'))
+    assert local_cache.get('a') == b'2'
+    
+    version = local_cache.version('a')
+    local_cache.clear()
+    local_cache.set('a', b'3', version)
+    assert local_cache.get('a') is None
+    
+def test_local_cache_invalidation_broadcast(fake_redis, local_cache):
+    other_worker = LocalCache(fake_redis, 'cache:invalidate', max_entries=2, max_bytes=10, ttl=60)
+    other_worker.subscribe()
+    deadline = time.monotonic() + 2
+    while not fake_redis.pubsub_numsub('cache:invalidate')[0][1] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    other_worker.set('a', b'1')
+    local_cache.set('a', b'1')
+    
+    local_cache.invalidate('a')
+    
+    assert local_cache.get('a') is None
+    while other_worker.get('a') is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert other_worker.get('a') is None
+    
+    """
+    Test cases for CachedResponse
+    """
+def test_cached_response_round_trip():
+    body = b'{"weathers":[]}\n' * 100
+    cached = CachedResponse.build(body)
+    restored = CachedResponse.from_bytes(cached.to_bytes())
+    
+    assert restored.body == body
+    assert restored.etag == cached.etag
+    assert restored.mimetype == 'application/json'
+    assert gzip.decompress(restored.gzip_body) == body
+    
+def test_cached_response_small_body_not_compressed():
+    cached = CachedResponse.build(b'{"weathers":[]}\n')
+    restored = CachedResponse.from_bytes(cached.to_bytes())
+    
+    assert restored.gzip_body is None
+    assert restored.body == b'{"weathers":[]}\n'
+    
+def test_lock_released_on_binary_client():
+    swr_cache = SingleFlightCache(FakeStrictRedis(), soft_ttl=60, hard_ttl=3600)
+    swr_cache.get_or_compute('key', lambda generation: b"old")
+    swr_cache.invalidate('key')
+    
+    assert swr_cache.get_or_compute('key', lambda generation: b"new") == (b"new", 'miss')
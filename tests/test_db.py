@@ -1,7 +1,11 @@
-from db import db,db_add_weather, db_get_all_weathers, db_get_all_weathers_paging, db_get_weather, db_update_weather, db_delete_weather, weather
+from db import db,db_add_weather, db_add_weathers, db_get_weather_stats, db_rebuild_weather_rollup, db_downsample_weathers, db_expire_weathers, db_expire_weather_rollup, db_add_weather_partitions, db_get_latest_weather, db_get_latest_weathers, db_rebuild_latest_weather, latest_weather, weather_rollup, db_get_all_weathers, weather_row_to_dict, db_iter_weathers, db_query_weathers, db_get_all_weathers_paging, db_get_all_weathers_by_cursor, db_count_weathers, db_get_weather, db_update_weather, db_delete_weather, db_update_weathers, db_delete_weathers, weather
 from app import create_app
-from exceptions import KeyNotExistException
-from datetime import datetime
+from cache import redis
+from flask import json
+from exceptions import KeyNotExistException, PreconditionFailedException
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import func
 import pytest
 
 @pytest.fixture
@@ -57,6 +61,24 @@ def test_db_add_weather_invalid_temperature(test_client):
 
     assert new_weather is None
     
+    """
+    Test cases for db_add_weathers function
+    """
+def test_db_add_weathers(test_client):
+    # Test case: Adding weathers across several batches in one transaction
+    weathers = [{"city": f"City {i}", "temperature": 20.5, "humidity": 50.5, "description": "Cloudy"} for i in range(5)]
+    created = db_add_weathers(weathers, 2)
+    assert len(created) == 5
+    assert [row.id for row in db_get_all_weathers()] == created
+    
+def test_db_add_weathers_rollback(test_client):
+    # Test case: A failing batch rolls back the batches inserted before it
+    weathers = [{"city": "New York", "temperature": 20.5, "humidity": 50.5, "description": "Cloudy"},
+                {"city": None, "temperature": 20.5, "humidity": 50.5, "description": "Cloudy"}]
+    result = db_add_weathers(weathers, 1)
+    assert isinstance(result, Exception)
+    assert len(db_get_all_weathers()) == 0
+    
     """
     Test cases for db_get_all_weathers function
     """
@@ -68,6 +90,46 @@ def test_db_get_all_weathers(test_client):
     weathers = db_get_all_weathers()
     assert len(weathers) == 3
     
+def test_db_iter_weathers(test_client):
+    # Test case: Iterating all weathers in batches smaller than the table
+    db_add_weather("New York", 20.5, 50.5, "Cloudy")
+    db_add_weather("Tokyo", 25.5, 60.5, "Sunny")
+    db_add_weather("London", 15.5, 40.5, "Rainy")
+    weathers = list(db_iter_weathers(2))
+    assert [w.city for w in weathers] == ["New York", "Tokyo", "London"]
+    
+def test_weather_row_to_dict(test_client):
+    # Test case: Rows serialize to the same JSON as the ORM objects
+    db_add_weather("New York", 20.5, 50.5, "Cloudy")
+    db_add_weather("Tokyo", -3, 100, "Snowy")
+    w = db_add_weather("London", "15.25", 40, "Rainy")
+    w.created_at = datetime(2024, 8, 18, 12, 0, 5, 999999)
+    db.session.commit()
+    rows = db_get_all_weathers()
+    weathers = weather.query.order_by(weather.id).all()
+    assert [json.dumps(weather_row_to_dict(row)) for row in rows] == [json.dumps(w.to_dict()) for w in weathers]
+    
+    """
+    Test cases for db_query_weathers function
+    """
+def test_db_query_weathers(test_client):
+    # Test case: Filtering by city and temperature range, sorted descending
+    db_add_weather("Tokyo", 20.5, 50.5, "Cloudy")
+    db_add_weather("Tokyo", 25.5, 60.5, "Sunny")
+    db_add_weather("Tokyo", 35.5, 70.5, "Hot")
+    db_add_weather("London", 25.5, 40.5, "Rainy")
+    weathers = db_query_weathers({'city': "Tokyo", 'min_temperature': 21, 'max_temperature': 40}, [('temperature', True)])
+    assert [w.description for w in weathers] == ["Hot", "Sunny"]
+    
+def test_db_query_weathers_time_range(test_client):
+    # Test case: Filtering on created_at with a limit
+    for day in (1, 2, 3):
+        w = db_add_weather("Tokyo", 20.5, 50.5, f"Day {day}")
+        w.created_at = datetime(2024, 8, day)
+    db.session.commit()
+    weathers = db_query_weathers({'from': datetime(2024, 8, 2)}, limit=1)
+    assert [w.description for w in weathers] == ["Day 2"]
+    
     """
     Test cases for db_get_all_weathers_paging function
     """
@@ -81,6 +143,33 @@ def test_db_get_all_weathers_paging(test_client):
     assert paginated_weathers.pages == 2
     assert len(paginated_weathers.items) == 2
     
+    """
+    Test cases for db_get_all_weathers_by_cursor function
+    """
+def test_db_get_all_weathers_by_cursor(test_client):
+    # Test case: Seeking pages by id until the end of the table
+    for city in ["New York", "Tokyo", "London"]:
+        db_add_weather(city, 20.5, 50.5, "Cloudy")
+    first_page, has_more = db_get_all_weathers_by_cursor(2)
+    assert [w.city for w in first_page] == ["New York", "Tokyo"]
+    assert has_more is True
+    second_page, has_more = db_get_all_weathers_by_cursor(2, after=first_page[-1].id)
+    assert [w.city for w in second_page] == ["London"]
+    assert has_more is False
+    assert db_count_weathers() == 3
+
+def test_db_get_all_weathers_by_cursor_created_at(test_client):
+    # Test case: Seeking by (created_at, id) keeps rows sharing a timestamp
+    for city in ["New York", "Tokyo", "London"]:
+        w = db_add_weather(city, 20.5, 50.5, "Cloudy")
+        w.created_at = datetime(2024, 8, 18, 12, 0, 5)
+    db.session.commit()
+    first_page, _ = db_get_all_weathers_by_cursor(1, 'created_at')
+    last = first_page[-1]
+    rest, has_more = db_get_all_weathers_by_cursor(5, 'created_at', (last.created_at, last.id))
+    assert [w.city for w in rest] == ["Tokyo", "London"]
+    assert has_more is False
+
     """
     Test cases for db_get_weather function
     """
@@ -104,7 +193,7 @@ def test_db_update_weather(test_client):
     # Test case: Updating a weather with valid fields
     weather = db_add_weather("New York", 20.5, 50.5, "Cloudy")
     weather_id = weather.id
-    updated_weather = db_update_weather(weather_id, city="Tokyo", temperature=25.5, humidity=60.5, description="Sunny")
+    updated_weather = db_update_weather(weather_id, {"city": "Tokyo", "temperature": 25.5, "humidity": 60.5, "description": "Sunny"})
     assert updated_weather is not None
     assert updated_weather.city == "Tokyo"
     assert updated_weather.temperature == 25.5
@@ -116,13 +205,31 @@ def test_db_update_weather_invalid_key(test_client):
     weather = db_add_weather("New York", 20.5, 50.5, "Cloudy")
     weather_id = weather.id
 
-    updated_weather = db_update_weather(weather_id, city="Tokyo", temperature=25.5, humidity=60.5, description="Sunny", rainfall=0)  # Invalid key 'rainfall'
+    updated_weather = db_update_weather(weather_id, {"city": "Tokyo", "temperature": 25.5, "humidity": 60.5, "description": "Sunny", "rainfall": 0})  # Invalid key 'rainfall'
     assert isinstance(updated_weather, KeyNotExistException), "Expected result to be an instance of KeyNotExistException"
     assert str(updated_weather) == "Invalid key: rainfall", "Expected exception message to match 'Invalid key: rainfall'"
     
+def test_db_update_weather_expected_updated_at(test_client):
+    # Test case: Updating only the version read before
+    weather = db_add_weather("New York", 20.5, 50.5, "Cloudy")
+    weather_id, updated_at = weather.id, weather.updated_at
+    
+    updated_weather = db_update_weather(weather_id, {"description": "Sunny"}, [updated_at])
+    assert updated_weather.description == "Sunny"
+    assert updated_weather.updated_at != updated_at
+    assert isinstance(db_update_weather(weather_id, {"description": "Rainy"}, [updated_at]), PreconditionFailedException)
+    assert db_get_weather(weather_id).description == "Sunny"
+    
+def test_db_update_weather_without_returning(test_client, monkeypatch):
+    # Test case: Databases without UPDATE ... RETURNING, such as MySQL, fetch the row afterwards
+    monkeypatch.setattr(db.session.get_bind().dialect, 'update_returning', False)
+    weather_id = db_add_weather("New York", 20.5, 50.5, "Cloudy").id
+    assert db_update_weather(weather_id, {"temperature": 25.5}).temperature == Decimal('25.50')
+    assert db_update_weather(100, {"temperature": 25.5}) is None
+    
 def test_db_update_weather_invalid_id(test_client):
     # Test case: Updating a weather with invalid id
-    updated_weather = db_update_weather(100, city="Tokyo", temperature=25.5, humidity=60.5, description="Sunny") 
+    updated_weather = db_update_weather(100, {"city": "Tokyo", "temperature": 25.5, "humidity": 60.5, "description": "Sunny"}) 
     assert updated_weather is None
     
     """
@@ -173,4 +280,198 @@ def test_weather_to_dict():
     result_dict = w.to_dict()
     
     # Assertion: Compare the returned dictionary to the expected dictionary
-    assert result_dict == expected_dict, "The to_dict method returned an unexpected dictionary."
\ No newline at end of file
+    assert result_dict == expected_dict, "The to_dict method returned an unexpected dictionary."
+
+    """
+    Test cases for db_get_weather_stats function
+    """
+def test_db_get_weather_stats(test_client):
+    # Test case: Aggregating per city in the database
+    db_add_weather("Tokyo", 20, 50, "Cloudy")
+    db_add_weather("Tokyo", 30, 70, "Sunny")
+    db_add_weather("London", 15, 40, "Rainy")
+    stats = db_get_weather_stats({})
+    assert [s['city'] for s in stats] == ["London", "Tokyo"]
+    assert stats[1]['count'] == 2
+    assert stats[1]['min_temperature'] == Decimal('20.00')
+    assert stats[1]['max_temperature'] == Decimal('30.00')
+    assert stats[1]['avg_temperature'] == Decimal('25.00')
+    assert stats[1]['avg_humidity'] == Decimal('60.00')
+    
+def test_db_get_weather_stats_bucket(test_client):
+    # Test case: Counting per day
+    for day, hour in ((1, 10), (1, 20), (2, 10)):
+        w = db_add_weather("Tokyo", 20, 50, "Cloudy")
+        w.created_at = datetime(2024, 8, day, hour)
+    db.session.commit()
+    stats = db_get_weather_stats({'city': "Tokyo"}, 'day')
+    assert [(s['bucket'], s['count']) for s in stats] == [("2024-08-01 00:00:00", 2), ("2024-08-02 00:00:00", 1)]
+    
+def test_db_weather_rollup_maintained(test_client, monkeypatch):
+    # Test case: Rollup follows adds, updates and deletes
+    monkeypatch.setattr('db.STATS_ROLLUP_ENABLED', True)
+    w1 = db_add_weather("Tokyo", 20, 50, "Cloudy")
+    w2 = db_add_weather("Tokyo", 30, 70, "Sunny")
+    db_add_weathers([{"city": "Tokyo", "temperature": 40, "humidity": 90, "description": "Hot"}], 10)
+    assert db.session.query(weather_rollup).one().count == 3
+    
+    db_update_weather(w2.id, {"temperature": 10})
+    db_delete_weather(w1.id)
+    stats = db_get_weather_stats({'city': "Tokyo"})
+    assert stats[0]['count'] == 2
+    assert stats[0]['min_temperature'] == Decimal('10.00')
+    assert stats[0]['max_temperature'] == Decimal('40.00')
+    assert stats[0]['avg_temperature'] == Decimal('25.00')
+    
+    # same result as the raw aggregates
+    monkeypatch.setattr('db.STATS_ROLLUP_ENABLED', False)
+    assert db_get_weather_stats({'city': "Tokyo"}) == stats
+    
+def test_db_rebuild_weather_rollup(test_client, monkeypatch):
+    # Test case: Backfilling the rollup from raw rows
+    db_add_weather("Tokyo", 20, 50, "Cloudy")
+    db_add_weather("London", 15, 40, "Rainy")
+    assert db.session.query(weather_rollup).count() == 0
+    
+    assert db_rebuild_weather_rollup() is True
+    monkeypatch.setattr('db.STATS_ROLLUP_ENABLED', True)
+    assert [s['count'] for s in db_get_weather_stats({})] == [1, 1]
+
+def test_db_rebuild_weather_rollup_keeps_expired_days(test_client):
+    # Test case: Aggregates of readings expired by retention survive a rebuild
+    add_old_weathers()
+    db_downsample_weathers(datetime(2024, 8, 3))
+    db_expire_weathers(datetime(2024, 8, 3), 10)
+    
+    assert db_rebuild_weather_rollup() is True
+    rows = db.session.query(weather_rollup).order_by(weather_rollup.bucket_start).all()
+    assert [(r.city, r.bucket_start, r.count) for r in rows] == [
+        ("Tokyo", datetime(2024, 8, 1, 10), 2), ("Tokyo", datetime(2024, 8, 1, 20), 1),
+        ("London", datetime(2024, 8, 2, 10), 1), ("Tokyo", datetime(2024, 8, 3, 10), 1)]
+
+    """
+    Test cases for downsampling and retention
+    """
+def add_old_weathers():
+    for city, day, hour, temperature in (("Tokyo", 1, 10, 20), ("Tokyo", 1, 10, 30), ("Tokyo", 1, 20, 40), ("London", 2, 10, 15), ("Tokyo", 3, 10, 25)):
+        db_add_weathers([{"city": city, "temperature": temperature, "humidity": 50, "description": "Cloudy",
+                          "created_at": datetime(2024, 8, day, hour)}], 10)
+
+def test_db_downsample_weathers(test_client):
+    # Test case: Whole days before the cutoff are aggregated per hour, raw rows are kept
+    add_old_weathers()
+    assert db_downsample_weathers(datetime(2024, 8, 3, 12)) == 2
+    rows = db.session.query(weather_rollup).order_by(weather_rollup.bucket_start).all()
+    assert [(r.city, r.bucket_start, r.count) for r in rows] == [
+        ("Tokyo", datetime(2024, 8, 1, 10), 2), ("Tokyo", datetime(2024, 8, 1, 20), 1), ("London", datetime(2024, 8, 2, 10), 1)]
+    assert db_count_weathers() == 5
+    
+def test_db_downsample_weathers_day(test_client, monkeypatch):
+    # Test case: Daily aggregates, also collapsing hourly rows of expired readings
+    add_old_weathers()
+    db_downsample_weathers(datetime(2024, 8, 3), 'hour')
+    db_expire_weathers(datetime(2024, 8, 3), 10)
+    assert db_downsample_weathers(datetime(2024, 8, 4), 'day') == 3
+    rows = db.session.query(weather_rollup).order_by(weather_rollup.bucket_start).all()
+    assert [(r.city, r.bucket_start, r.count) for r in rows] == [
+        ("Tokyo", datetime(2024, 8, 1), 3), ("London", datetime(2024, 8, 2), 1), ("Tokyo", datetime(2024, 8, 3), 1)]
+    
+    # same stats as before the compaction
+    monkeypatch.setattr('db.STATS_ROLLUP_ENABLED', True)
+    stats = db_get_weather_stats({'city': "Tokyo"})
+    assert stats[0]['count'] == 4
+    assert stats[0]['min_temperature'] == Decimal('20.00')
+    assert stats[0]['max_temperature'] == Decimal('40.00')
+    assert stats[0]['avg_temperature'] == Decimal('28.75')
+    
+def test_db_expire_weathers(test_client):
+    # Test case: Raw rows of whole days before the cutoff are deleted in batches
+    add_old_weathers()
+    ids = [w.id for w in db_get_all_weathers()]
+    batches = []
+    assert db_expire_weathers(datetime(2024, 8, 3, 12), 2, on_deleted=batches.append) == ([], 4)
+    assert batches == [ids[:2], ids[2:4]]
+    assert [w.created_at for w in db_get_all_weathers()] == [datetime(2024, 8, 3, 10)]
+    
+def test_db_expire_weather_rollup(test_client):
+    # Test case: Aggregates before the cutoff are deleted
+    add_old_weathers()
+    db_downsample_weathers(datetime(2024, 8, 4))
+    assert db_expire_weather_rollup(datetime(2024, 8, 2)) == 2
+    assert db.session.query(weather_rollup).count() == 2
+    
+def test_db_add_weather_partitions_unpartitioned(test_client):
+    # Test case: Only MySQL tables are partitioned
+    assert db_add_weather_partitions(date(2025, 1, 1)) is None
+    
+def test_retention_command(test_client):
+    # Test case: Old readings are downsampled then expired
+    add_old_weathers()
+    db_add_weather("Tokyo", 20, 50, "Cloudy")
+    redis.set('weather:1', '{}')
+    result = test_client.application.test_cli_runner().invoke(args=['weather', 'retention', '--raw-days', '30'])
+    assert result.exit_code == 0
+    assert "0 partitions dropped, 5 weathers deleted" in result.output
+    assert redis.get('weather:1') is None
+    assert db_count_weathers() == 1
+    assert db.session.query(func.sum(weather_rollup.count)).scalar() == 5
+    
+    """
+    Test cases for the latest weather per city
+    """
+def test_db_latest_weather_maintained(test_client):
+    # Test case: Latest reading follows adds, updates and deletes
+    w1 = db_add_weather("Tokyo", 20, 50, "Cloudy")
+    w2 = db_add_weather("Tokyo", 30, 70, "Sunny")
+    db_add_weather("London", 15, 40, "Rainy")
+    assert db_get_latest_weather("Tokyo").id == w2.id
+    assert [w.city for w in db_get_latest_weathers()] == ["London", "Tokyo"]
+    
+    # an older reading written later doesn't replace the latest one
+    db_add_weathers([{"city": "Tokyo", "temperature": 40, "humidity": 90, "description": "Hot", "created_at": datetime(2024, 8, 1)}], 10)
+    assert db_get_latest_weather("Tokyo").id == w2.id
+    
+    db_update_weather(w2.id, {"temperature": 10})
+    assert db_get_latest_weather("Tokyo").temperature == Decimal('10.00')
+    db_delete_weather(w2.id)
+    assert db_get_latest_weather("Tokyo").id == w1.id
+    db_update_weather(w1.id, {"city": "Osaka"})
+    assert db_get_latest_weather("Osaka").id == w1.id
+    assert db_get_latest_weather("Tokyo").created_at == datetime(2024, 8, 1)
+    
+def test_db_latest_weather_expired(test_client):
+    # Test case: A city whose latest reading expired is dropped
+    add_old_weathers()
+    db_add_weather("Tokyo", 20, 50, "Cloudy")
+    db_expire_weathers(datetime(2024, 8, 4), 10)
+    assert [w.city for w in db_get_latest_weathers()] == ["Tokyo"]
+    
+def test_db_rebuild_latest_weather(test_client):
+    # Test case: Backfilling latest_weather from raw rows
+    add_old_weathers()
+    db.session.query(latest_weather).delete()
+    assert db_rebuild_latest_weather() is True
+    assert [(w.city, w.created_at) for w in db_get_latest_weathers()] == [("London", datetime(2024, 8, 2, 10)), ("Tokyo", datetime(2024, 8, 3, 10))]
+    
+    """
+    Test cases for bulk updates and deletes
+    """
+def test_db_update_weathers(test_client, monkeypatch):
+    # Test case: One UPDATE by filter, rollup and latest weather follow
+    monkeypatch.setattr('db.STATS_ROLLUP_ENABLED', True)
+    add_old_weathers()
+    updated, ids = db_update_weathers({'city': "Kyoto"}, filters={'city': "Tokyo", 'to': datetime(2024, 8, 1, 23)})
+    assert updated == 3
+    assert len(ids) == 3
+    assert [s['count'] for s in db_get_weather_stats({'city': "Kyoto"})] == [3]
+    assert [s['count'] for s in db_get_weather_stats({'city': "Tokyo"})] == [1]
+    assert db_get_latest_weather("Kyoto").created_at == datetime(2024, 8, 1, 20)
+    
+def test_db_delete_weathers(test_client):
+    # Test case: One DELETE by ids, unknown ids are ignored
+    id1 = db_add_weather("Tokyo", 20, 50, "Cloudy").id
+    id2 = db_add_weather("London", 15, 40, "Rainy").id
+    assert db_delete_weathers(ids=[id1, 999]) == (1, [id1])
+    assert db_delete_weathers(ids=[999]) == (0, [])
+    assert [w.id for w in db_get_all_weathers()] == [id2]
+    assert [w.city for w in db_get_latest_weathers()] == ["London"]
@@ -11,3 +11,8 @@ def test_app_health(client):
     response = client.get('/health')
     assert response.status_code == 200
     assert response.json == {'status': 'healthy'}
+
+def test_rebuild_rollup_command(app, init_db):
+    result = app.test_cli_runner().invoke(args=['weather', 'rebuild-rollup'])
+    assert result.exit_code == 0
+    assert "weather rollup rebuilt" in result.output
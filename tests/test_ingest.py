@@ -0,0 +1,91 @@
+import pytest
+from cache import redis
+from db import db_get_all_weathers
+from ingest import IngestConsumer
+from commands import weathers_changed
+from config import INGEST_STREAM, INGEST_DEAD_LETTER_STREAM
+
+sample_weather = {
+    "city": "Taipei",
+    "temperature": 30.5,
+    "humidity": 80.5,
+    "description": "Sunny"
+}
+
+@pytest.fixture
+def write_behind(monkeypatch):
+    monkeypatch.setattr('weather.WRITE_BEHIND_ENABLED', True)
+
+def consumer(**kwargs):
+    return IngestConsumer(redis, 'test-consumer', block_ms=None, **kwargs)
+
+def test_ingest_and_consume(client, init_db, write_behind):
+    response = client.post('/weather/', json=sample_weather)
+    assert response.status_code == 202
+    assert response.json['token']
+    assert db_get_all_weathers() == []
+    
+    ingest_consumer = consumer()
+    ingest_consumer.ensure_group()
+    assert ingest_consumer.process_batch() == 1
+    assert redis.xlen(INGEST_STREAM) == 0
+    
+    weathers = client.get('/weather/').json['weathers']
+    assert [w['city'] for w in weathers] == ['Taipei']
+    
+def test_ingest_clears_negative_cache(client, init_db, write_behind):
+    assert client.get('/weather/1').status_code == 404
+    assert redis.get('weather:1') == 'not_found'
+    client.post('/weather/', json=sample_weather)
+    
+    ingest_consumer = consumer(on_written=weathers_changed)
+    ingest_consumer.ensure_group()
+    assert ingest_consumer.process_batch() == 1
+    
+    assert redis.get('weather:1') is None
+    assert client.get('/weather/1').json['weather'][0]['city'] == 'Taipei'
+    
+def test_ingest_invalid_weather(client, init_db, write_behind):
+    response = client.post('/weather/', json=dict(sample_weather, temperature='hot'))
+    assert response.status_code == 400
+    assert response.json['invalid'] == ['temperature']
+    assert redis.xlen(INGEST_STREAM) == 0
+
+def test_ingest_backpressure(client, init_db, write_behind, monkeypatch):
+    monkeypatch.setattr('ingest.INGEST_MAX_PENDING', 1)
+    assert client.post('/weather/', json=sample_weather).status_code == 202
+    
+    response = client.post('/weather/', json=sample_weather)
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+def test_ingest_retry_and_dead_letter(client, init_db, write_behind, monkeypatch):
+    client.post('/weather/', json=sample_weather)
+    monkeypatch.setattr('ingest.db_add_weathers', lambda weathers, batch_size: Exception('db down'))
+    ingest_consumer = consumer(max_retries=2, claim_idle_ms=0)
+    ingest_consumer.ensure_group()
+    
+    # the first delivery and two retries fail, the entry stays pending
+    for _ in range(3):
+        assert ingest_consumer.process_batch() == 0
+        assert redis.xlen(INGEST_STREAM) == 1
+    
+    # out of retries, moved to the dead-letter stream
+    assert ingest_consumer.process_batch() == 0
+    assert redis.xlen(INGEST_STREAM) == 0
+    [(_, fields)] = redis.xrange(INGEST_DEAD_LETTER_STREAM)
+    assert fields['error'] == 'failed after 2 retries'
+
+def test_ingest_undecodable_entry(client, init_db):
+    redis.xadd(INGEST_STREAM, {'weather': 'not json'})
+    ingest_consumer = consumer()
+    ingest_consumer.ensure_group()
+    
+    assert ingest_consumer.process_batch() == 0
+    assert redis.xlen(INGEST_DEAD_LETTER_STREAM) == 1
+
+def test_consume_ingest_command(app, init_db):
+    redis.xadd(INGEST_STREAM, {'weather': '{"city": "Tainan", "temperature": 28, "humidity": 70, "description": "Cloudy", "created_at": "2024-01-01T10:00:00"}'})
+    result = app.test_cli_runner().invoke(args=['weather', 'consume-ingest', '--once'])
+    assert result.exit_code == 0
+    assert "1 weathers written" in result.output
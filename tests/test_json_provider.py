@@ -0,0 +1,57 @@
+import pytest
+from datetime import datetime, date
+from decimal import Decimal
+from flasgger import LazyString
+from json_provider import JSONProvider, OrjsonJSONProvider, json_provider_class
+
+samples = [
+    {'weathers': [{'id': 1, 'city': 'Taipei', 'temperature': Decimal('20.50'), 'humidity': '50.50', 'created_at': '2024-08-18 12:00:05'}]},
+    {'b': [1, 2.5, True, None], 'a': {}, 'c': []},
+    {'city': 'Zürich', 'description': '晴'},
+    {'small': 1e-05, 'tiny': 1.5e-07, 'large': 1e+16, 'max': 1.7976931348623157e+308, 'ok': 0.0001},
+    {'nan': float('nan'), 'inf': float('inf')},
+    {'created': datetime(2024, 8, 18, 12, 0, 5), 'day': date(2024, 8, 18)},
+    {'big': 2 ** 70},
+    {1: 'int key'},
+    {'lazy': LazyString(lambda: 'swagger')},
+    'weather "quoted" \\ \n',
+]
+
+@pytest.fixture
+def providers(app):
+    return JSONProvider(app), OrjsonJSONProvider(app)
+
+@pytest.mark.parametrize('obj', samples)
+def test_orjson_output_matches_stdlib(providers, obj):
+    stdlib, fast = providers
+    assert fast.dumps(obj, separators=(',', ':')) == stdlib.dumps(obj, separators=(',', ':'))
+    assert fast.dumps(obj) == stdlib.dumps(obj)
+
+def test_orjson_response_matches_stdlib(providers):
+    stdlib, fast = providers
+    assert fast.response(samples[0]).get_data() == stdlib.response(samples[0]).get_data()
+
+def test_orjson_loads(providers):
+    _, fast = providers
+    assert fast.loads(b'{"city":"Taipei","temperature":20.5}') == {'city': 'Taipei', 'temperature': 20.5}
+    # the stdlib accepts what orjson rejects
+    assert fast.loads('{"big": 1180591620717411303424, "t": NaN}')['big'] == 2 ** 70
+
+def test_json_provider_class():
+    assert json_provider_class('stdlib') is JSONProvider
+    assert json_provider_class('auto') is OrjsonJSONProvider
+
+def test_app_uses_json_backend(app):
+    assert isinstance(app.json, OrjsonJSONProvider)
+
+def test_streamed_listing_uses_orjson(client, init_db, monkeypatch):
+    import orjson
+    client.post('/weather/', json={"city": "Taipei", "temperature": 30.5, "humidity": 80.5, "description": "Sunny"})
+    calls = []
+    dumps = orjson.dumps
+    monkeypatch.setattr(orjson, 'dumps', lambda *args, **kwargs: calls.append(args[0]) or dumps(*args, **kwargs))
+    
+    response = client.get('/weather/', headers={'Accept': 'application/x-ndjson'})
+    
+    assert response.get_data(as_text=True).startswith('{"city":"Taipei",')
+    assert [weather['city'] for weather in calls] == ['Taipei']
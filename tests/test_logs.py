@@ -0,0 +1,68 @@
+import json
+import logging
+import queue
+from flask.logging import default_handler
+from logs import JsonFormatter, RequestIdFilter, SamplingFilter, DroppingQueueHandler
+
+def make_record(level=logging.INFO, msg='Hit cache in getting weather 1'):
+    return logging.LogRecord('app', level, __file__, 1, msg, None, None)
+
+def test_json_formatter():
+    record = make_record()
+    record.request_id = 'abc'
+    entry = json.loads(JsonFormatter().format(record))
+    
+    assert entry['level'] == 'INFO'
+    assert entry['message'] == 'Hit cache in getting weather 1'
+    assert entry['request_id'] == 'abc'
+
+def test_sampling_filter():
+    sampling = SamplingFilter({'INFO': 0})
+    assert not sampling.filter(make_record(logging.INFO))
+    assert sampling.filter(make_record(logging.WARNING))
+    assert SamplingFilter({'INFO': 1}).filter(make_record(logging.INFO))
+
+def test_queue_handler_drops_when_full():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.handle(make_record())
+    handler.handle(make_record())
+    
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+
+def test_queued_exception_is_a_field():
+    handler = DroppingQueueHandler(queue.Queue())
+    logger = logging.getLogger('test_logs.exception')
+    logger.addHandler(handler)
+    try:
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception('Error in %s', 'dividing')
+    finally:
+        logger.removeHandler(handler)
+    
+    entry = json.loads(JsonFormatter().format(handler.queue.get_nowait()))
+    assert entry['message'] == 'Error in dividing'
+    assert entry['exception'].startswith('Traceback') and 'ZeroDivisionError' in entry['exception']
+    
+def test_no_console_handler(app):
+    # every record goes through the queue, none is written on the request thread
+    assert default_handler not in app.logger.handlers
+    assert [type(handler) for handler in app.logger.handlers] == [DroppingQueueHandler]
+
+def test_request_id(app, client, init_db):
+    handler = DroppingQueueHandler(queue.Queue())
+    handler.addFilter(RequestIdFilter())
+    app.logger.addHandler(handler)
+    try:
+        response = client.get('/weather/1', headers={'X-Request-ID': 'upstream-id'})
+    finally:
+        app.logger.removeHandler(handler)
+    
+    assert response.headers['X-Request-ID'] == 'upstream-id'
+    records = [handler.queue.get() for _ in range(handler.queue.qsize())]
+    assert records and all(record.request_id == 'upstream-id' for record in records)
+    
+    # a request without one gets a fresh id
+    assert len(client.get('/health').headers['X-Request-ID']) == 32
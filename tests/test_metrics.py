@@ -0,0 +1,56 @@
+from prometheus_client import REGISTRY, Counter, Gauge, multiprocess, values
+from metrics import render_metrics
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_metrics_endpoint(client):
+    client.get('/health')
+    response = client.get('/metrics')
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert b'weather_http_requests_total{method="GET",route="/health",status="200"}' in response.data
+
+def test_request_metrics(client, init_db):
+    requests = sample('weather_http_requests_total', method='GET', route='/weather/<int:id>', status='404')
+    latency_count = sample('weather_http_request_duration_seconds_count', method='GET', route='/weather/<int:id>')
+    db_queries = sample('weather_db_queries_per_request_sum', route='/weather/<int:id>')
+    
+    client.get('/weather/1')
+    
+    assert sample('weather_http_requests_total', method='GET', route='/weather/<int:id>', status='404') == requests + 1
+    assert sample('weather_http_request_duration_seconds_count', method='GET', route='/weather/<int:id>') == latency_count + 1
+    assert sample('weather_db_queries_per_request_sum', route='/weather/<int:id>') == db_queries + 1
+
+def test_cache_metrics(client, init_db):
+    misses = sample('weather_cache_requests_total', cache='weather', result='miss')
+    hits = sample('weather_cache_requests_total', cache='weather', result='hit')
+    redis_gets = sample('weather_redis_command_duration_seconds_count', command='GET')
+    
+    # a miss, then the negative entry is a hit
+    client.get('/weather/1')
+    client.get('/weather/1')
+    
+    assert sample('weather_cache_requests_total', cache='weather', result='miss') == misses + 1
+    assert sample('weather_cache_requests_total', cache='weather', result='hit') == hits + 1
+    assert sample('weather_redis_command_duration_seconds_count', command='GET') == redis_gets + 2
+
+def test_multiprocess_metrics(tmp_path, monkeypatch):
+    # two gunicorn workers, each writing its samples to the shared directory
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    assert render_metrics() == b''
+    for pid, requests, connections in ((101, 2, 3), (102, 3, 4)):
+        monkeypatch.setattr(values, 'ValueClass', values.MultiProcessValue(lambda pid=pid: pid))
+        Counter('weather_worker_requests_total', 'HTTP requests', ['route'], registry=None).labels('/health').inc(requests)
+        Gauge('weather_worker_connections', 'Open connections', multiprocess_mode='livesum', registry=None).set(connections)
+    
+    output = render_metrics()
+    assert b'weather_worker_requests_total{route="/health"} 5.0' in output
+    assert b'weather_worker_connections 7.0' in output
+    
+    # what gunicorn.conf.py does when a worker exits: its counters are kept, its live gauges dropped
+    multiprocess.mark_process_dead(101)
+    output = render_metrics()
+    assert b'weather_worker_requests_total{route="/health"} 5.0' in output
+    assert b'weather_worker_connections 4.0' in output
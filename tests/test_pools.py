@@ -0,0 +1,49 @@
+from pools import InstrumentedQueuePool, InstrumentedBlockingConnectionPool, db_pool_stats, redis_pool_stats
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+from fakeredis import FakeRedisConnection, FakeServer
+from redis import Redis
+import pytest
+
+def test_db_pool_stats(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/pool.db', poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05)
+    connection = engine.connect()
+    stats = db_pool_stats(engine)
+    
+    assert stats['class'] == 'InstrumentedQueuePool'
+    assert stats['size'] == 1
+    assert stats['checked_out'] == 1
+    assert stats['acquired'] == 1
+    
+    # the only connection is checked out, the next checkout times out
+    with pytest.raises(TimeoutError):
+        engine.connect()
+    stats = db_pool_stats(engine)
+    assert stats['timeouts'] == 1
+    assert stats['waiting'] == 0
+    assert stats['wait_seconds_max'] >= 0.05
+    
+    connection.close()
+    assert db_pool_stats(engine)['checked_out'] == 0
+    
+    """
+    Test cases for InstrumentedBlockingConnectionPool
+    """
+def test_redis_pool_stats():
+    pool = InstrumentedBlockingConnectionPool(connection_class=FakeRedisConnection, server=FakeServer(), max_connections=2)
+    client = Redis(connection_pool=pool)
+    client.set('key', 'value')
+    stats = redis_pool_stats(client)
+    
+    assert stats['class'] == 'InstrumentedBlockingConnectionPool'
+    assert stats['max_connections'] == 2
+    assert stats['created'] == 1
+    assert stats['checked_out'] == 0
+    assert stats['acquired'] == 1
+    
+def test_pools_endpoint(client):
+    response = client.get('/health/pools')
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert set(data) == {'db', 'redis', 'redis_raw', 'replicas'}
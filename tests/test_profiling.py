@@ -0,0 +1,56 @@
+import logging
+import pytest
+from app import create_app
+from db import db
+from profiling import server_timing
+
+@pytest.fixture
+def profiled_client(monkeypatch):
+    monkeypatch.setattr('profiling.PROFILING_ENABLED', True)
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'
+    })
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.drop_all()
+
+def test_server_timing():
+    assert server_timing({'db': 0.0012, 'total': 0.005}, {'db': '2 queries'}) == 'db;dur=1.200;desc="2 queries", total;dur=5.000'
+
+def test_no_server_timing_by_default(client):
+    assert 'Server-Timing' not in client.get('/health').headers
+
+def test_server_timing_header(profiled_client, caplog):
+    profiled_client.post('/weather/', json={"city": "Taipei", "temperature": 30.5, "humidity": 80.5, "description": "Sunny"})
+    with caplog.at_level(logging.INFO):
+        response = profiled_client.get('/weather/')
+    
+    metrics = [metric.split(';')[0] for metric in response.headers['Server-Timing'].split(', ')]
+    assert {'fetch', 'to_dict', 'json', 'db', 'redis', 'total'} <= set(metrics)
+    assert 'desc="1 queries"' in response.headers['Server-Timing']
+    assert any(record.getMessage().startswith('Request timing {') for record in caplog.records)
+
+def test_profile_header(profiled_client, caplog):
+    with caplog.at_level(logging.INFO):
+        profiled_client.get('/weather/', headers={'X-Profile': '1'})
+    
+    [timing] = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Request timing')]
+    assert '"profile": ' in timing
+    assert 'cumulative' in timing
+
+def test_profile_token(profiled_client, caplog, monkeypatch):
+    monkeypatch.setattr('profiling.PROFILE_TOKEN', 'secret')
+    with caplog.at_level(logging.INFO):
+        profiled_client.get('/weather/', headers={'X-Profile': 'guess'})
+    assert not any('"profile": ' in record.getMessage() for record in caplog.records)
+
+def test_slow_query_log(client, init_db, caplog, monkeypatch):
+    monkeypatch.setattr('profiling.SLOW_QUERY_THRESHOLD_MS', 0.000001)
+    with caplog.at_level(logging.WARNING):
+        client.get('/weather/1')
+    
+    [slow_query] = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Slow query')]
+    assert 'FROM weather' in slow_query
+    assert '[GET /weather/1]' in slow_query
@@ -0,0 +1,68 @@
+import pytest
+from app import create_app, db
+from db import weather
+from replicas import replica_router, LAST_WRITE_COOKIE
+from sqlalchemy import insert
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(replica_router, '_states', {})
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/primary.db',
+        'REPLICA_DATABASE_URIS': [f'sqlite:///{tmp_path}/replica.db']
+    })
+    with app.app_context():
+        for engine in [db.engine, *app.extensions['replicas'].values()]:
+            db.metadata.create_all(engine)
+        # the replica holds a row the primary doesn't, so responses tell where they were read
+        with app.extensions['replicas']['replica0'].begin() as connection:
+            connection.execute(insert(weather), [{'city': 'Replica', 'temperature': 1, 'humidity': 1, 'description': 'Replica'}])
+    with app.test_client() as client:
+        yield client
+
+def paged_cities(client):
+    response = client.get('/weather/1/10')
+    return [weather['city'] for weather in response.get_json()['weathers']]
+
+def test_get_reads_from_replica(client):
+    assert paged_cities(client) == ['Replica']
+    assert replica_router.stats()['replica0']['healthy']
+
+def test_read_your_writes(client):
+    response = client.post('/weather/', json={'city': 'Primary', 'temperature': 2, 'humidity': 2, 'description': 'Primary'})
+    assert response.status_code == 200
+    assert LAST_WRITE_COOKIE in response.headers['Set-Cookie']
+    
+    # the client wrote a moment ago, it reads from the primary
+    assert paged_cities(client) == ['Primary']
+    
+    client.delete_cookie(LAST_WRITE_COOKIE)
+    assert paged_cities(client) == ['Replica']
+
+def test_lagging_replica_falls_back_to_primary(client, monkeypatch):
+    monkeypatch.setattr('replicas.replication_lag', lambda connection: replica_router.max_lag + 1)
+    assert paged_cities(client) == []
+    assert replica_router.stats()['replica0'] == {'healthy': False, 'latency_ms': pytest.approx(0, abs=1000), 'lag_seconds': replica_router.max_lag + 1, 'error': 'replication lag'}
+    
+    # the replica is probed again after the check interval
+    monkeypatch.setattr('replicas.replication_lag', lambda connection: 0)
+    assert paged_cities(client) == []
+    monkeypatch.setattr(replica_router, 'check_interval', 0)
+    assert paged_cities(client) == ['Replica']
+
+def test_unreachable_replica_falls_back_to_primary(tmp_path, monkeypatch):
+    monkeypatch.setattr(replica_router, '_states', {})
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path}/primary.db',
+        'REPLICA_DATABASE_URIS': [f'sqlite:///{tmp_path}/missing/replica.db']
+    })
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    
+    response = client.get('/weather/1/10')
+    assert response.status_code == 200
+    assert response.get_json()['weathers'] == []
+    assert replica_router.stats()['replica0']['healthy'] is False
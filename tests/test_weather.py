@@ -1,7 +1,15 @@
+import gzip
+import json
 import pytest
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from app import create_app, db
 from exceptions import KeyNotExistException
 import fakeredis
+from cache import redis
+from db import db_get_weather
+from weather import invalidate_weathers_cache
 
 from sqlalchemy_utils import database_exists, create_database, drop_database
 
@@ -151,4 +159,537 @@ def test_delete_weather_not_found(client):
     data = response.get_json()
     
     assert response.status_code == 404
-    assert data['message'] == "No weather Found"
\ No newline at end of file
+    assert data['message'] == "No weather Found"
+    
+    """
+    GET /weathers/cursor
+    """
+def test_get_all_weathers_by_cursor(client):
+    for city in ["Tokyo", "London", "Paris"]:
+        client.post('/weather/', json={"city": city, "temperature": 20.5, "humidity": 50.5, "description": "Cloudy"})
+    
+    response = client.get('/weather/cursor?limit=2&total=true')
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert len(data['weathers']) == 2
+    assert data['next_cursor'] is not None
+    assert data['total'] == 3
+    
+    response = client.get(f"/weather/cursor?limit=2&cursor={data['next_cursor']}")
+    next_data = response.get_json()
+    
+    assert response.status_code == 200
+    assert [w['city'] for w in next_data['weathers']] == ["Paris"]
+    assert next_data['next_cursor'] is None
+    assert 'total' not in next_data
+    
+def test_get_all_weathers_by_cursor_created_at(client):
+    response = client.get('/weather/cursor?limit=1&order=created_at')
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert [w['city'] for w in data['weathers']] == ["Tokyo"]
+    
+    response = client.get(f"/weather/cursor?limit=5&order=created_at&cursor={data['next_cursor']}")
+    data = response.get_json()
+    assert [w['city'] for w in data['weathers']] == ["London", "Paris"]
+    
+def test_get_all_weathers_by_cursor_invalid(client):
+    response = client.get('/weather/cursor?cursor=not-a-cursor')
+    assert response.status_code == 400
+    assert response.get_json()['message'] == "Invalid cursor"
+    
+    # cursor issued for another sort order
+    id_cursor = client.get('/weather/cursor?limit=1').get_json()['next_cursor']
+    response = client.get(f'/weather/cursor?order=created_at&cursor={id_cursor}')
+    assert response.status_code == 400
+    
+    response = client.get('/weather/cursor?order=city')
+    assert response.status_code == 400
+    
+    """
+    GET /weathers/?stream=
+    """
+def test_get_all_weathers_stream_ndjson(client):
+    response = client.get('/weather/?stream=ndjson')
+    lines = response.get_data(as_text=True).splitlines()
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['city'] for line in lines] == ["Tokyo", "London", "Paris"]
+    
+def test_get_all_weathers_stream_json(client):
+    response = client.get('/weather/?stream=json')
+    data = json.loads(response.get_data(as_text=True))
+    
+    assert response.status_code == 200
+    assert data['weathers'] == client.get('/weather/').get_json()['weathers']
+    
+def test_get_all_weathers_stream_accept_header(client):
+    response = client.get('/weather/', headers={'Accept': 'application/x-ndjson'})
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    
+    """
+    POST /weathers/bulk
+    """
+def test_create_weathers_bulk(client):
+    sample_weathers = [
+        {"city": "Berlin", "temperature": 18.5, "humidity": 55.0, "description": "Cloudy"},
+        {"city": "Madrid", "temperature": 30.0, "humidity": 20.0, "description": "Sunny"},
+        {"city": "Rome", "temperature": 28.0, "description": "Sunny"},
+        {"city": "Oslo", "temperature": "cold", "humidity": 80.0, "description": "Snow"}
+    ]
+    response = client.post('/weather/bulk', json=sample_weathers)
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert data['created'] == 2
+    assert data['errors'] == [
+        {'index': 2, 'message': 'weather creation failed!', 'required': ['humidity']},
+        {'index': 3, 'message': 'weather creation failed!', 'invalid': ['temperature']}
+    ]
+    cities = [w['city'] for w in client.get('/weather/').get_json()['weathers']]
+    assert "Berlin" in cities and "Madrid" in cities
+    
+def test_create_weathers_bulk_column_limits(client):
+    sample_weathers = [
+        {"city": None, "temperature": 18.5, "humidity": 55.0, "description": "Cloudy"},
+        {"city": "Cuenca", "temperature": 18.5, "humidity": 55.0, "description": 7},
+        {"city": "C" * 101, "temperature": 18.5, "humidity": 55.0, "description": "Cloudy"},
+        {"city": "Cuenca", "temperature": "1e10", "humidity": 1000, "description": "Cloudy"},
+        {"city": "Cuenca", "temperature": 999.995, "humidity": None, "description": "Cloudy"},
+        {"city": "Cuenca", "temperature": -999.99, "humidity": "99.5", "description": "D" * 255}
+    ]
+    response = client.post('/weather/bulk', json=sample_weathers)
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert data['created'] == 1
+    assert [(error['index'], error['invalid']) for error in data['errors']] == [
+        (0, ['city']), (1, ['description']), (2, ['city']), (3, ['temperature', 'humidity']), (4, ['temperature', 'humidity'])]
+    
+def test_create_weathers_bulk_ndjson(client):
+    body = '{"city": "Lisbon", "temperature": 22, "humidity": 65, "description": "Windy"}\n\nnot json\n'
+    response = client.post('/weather/bulk', data=body, content_type='application/x-ndjson')
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert data['created'] == 1
+    assert data['errors'] == [{'index': 1, 'message': 'Invalid JSON'}]
+    
+def test_create_weathers_bulk_clears_negative_cache(client):
+    response = client.post('/weather/', json={"city": "Valparaiso", "temperature": 15, "humidity": 80, "description": "Foggy"})
+    next_id = response.get_json()['weather'][0]['id'] + 1
+    assert client.get(f'/weather/{next_id}').status_code == 404
+    assert redis.get(f'weather:{next_id}') == 'not_found'
+    
+    client.post('/weather/bulk', json=[{"city": "Valparaiso", "temperature": 16, "humidity": 75, "description": "Foggy"}])
+    
+    assert redis.get(f'weather:{next_id}') is None
+    assert client.get(f'/weather/{next_id}').get_json()['weather'][0]['temperature'] == "16.00"
+    
+def test_create_weathers_bulk_not_array(client):
+    response = client.post('/weather/bulk', json={"city": "Lisbon"})
+    
+    assert response.status_code == 400
+    
+    """
+    GET /weathers/<int:id> cache
+    """
+def test_get_weather_read_through_cache(client):
+    weather_id = client.post('/weather/', json={"city": "Cairo", "temperature": 35.0, "humidity": 10.0, "description": "Hot"}).get_json()['weather'][0]['id']
+    response = client.get(f'/weather/{weather_id}')
+    
+    assert response.status_code == 200
+    assert redis.get(f'weather:{weather_id}') is not None
+    
+    # served from cache with the same body
+    assert client.get(f'/weather/{weather_id}').get_json() == response.get_json()
+    
+def test_get_weather_write_through_cache(client):
+    weather_id = client.post('/weather/', json={"city": "Cairo", "temperature": 35.0, "humidity": 10.0, "description": "Hot"}).get_json()['weather'][0]['id']
+    client.get(f'/weather/{weather_id}')
+    client.patch(f'/weather/{weather_id}', json={"description": "Dusty"})
+    data = client.get(f'/weather/{weather_id}').get_json()
+    
+    assert data['weather'][0]['description'] == "Dusty"
+    
+    client.delete(f'/weather/{weather_id}')
+    response = client.get(f'/weather/{weather_id}')
+    
+    assert response.status_code == 404
+    
+def test_get_weather_negative_cache(client):
+    response = client.get('/weather/1000')
+    
+    assert response.status_code == 404
+    assert redis.get('weather:1000') == 'not_found'
+    assert redis.ttl('weather:1000') > 0
+    
+    response = client.get('/weather/1000')
+    assert response.status_code == 404
+    assert response.get_json()['message'] == "No weather Found in id: 1000"
+    
+def test_get_weather_fill_loses_to_concurrent_write(client, monkeypatch):
+    weather_id = client.post('/weather/', json={"city": "Lima", "temperature": 19.0, "humidity": 80.0, "description": "Misty"}).get_json()['weather'][0]['id']
+    redis.delete(f'weather:{weather_id}')
+    
+    def read_then_update(id):
+        row = db_get_weather(id)
+        # an update commits and writes its entry through while the miss is in flight
+        invalidate_weathers_cache()
+        redis.set(f'weather:{id}', 'written')
+        return row
+    monkeypatch.setattr('weather.db_get_weather', read_then_update)
+    
+    assert client.get(f'/weather/{weather_id}').status_code == 200
+    assert redis.get(f'weather:{weather_id}') == 'written'
+    
+def test_get_weather_negative_fill_loses_to_concurrent_create(client, monkeypatch):
+    def read_then_create(id):
+        # the row is created, and its key dropped, right after the miss read nothing
+        invalidate_weathers_cache()
+        redis.delete(f'weather:{id}')
+        return None
+    monkeypatch.setattr('weather.db_get_weather', read_then_create)
+    
+    assert client.get('/weather/1001').status_code == 404
+    assert redis.get('weather:1001') is None
+    
+    """
+    GET /weathers/ local cache
+    """
+def test_get_all_weathers_local_cache(client, monkeypatch):
+    from cache import local_cache
+    monkeypatch.setattr(local_cache, 'enabled', True)
+    local_cache.clear()
+    first = client.get('/weather/')
+    
+    # served from worker memory without reaching redis
+    redis.flushall()
+    second = client.get('/weather/')
+    assert second.get_data() == first.get_data()
+    
+    # a write drops the local copy
+    client.post('/weather/', json={"city": "Lima", "temperature": 19.0, "humidity": 80.0, "description": "Foggy"})
+    cities = [w['city'] for w in client.get('/weather/').get_json()['weathers']]
+    assert "Lima" in cities
+    local_cache.clear()
+    
+    """
+    GET /weathers/ pre-serialized cache
+    """
+def test_get_all_weathers_cached_bytes(client):
+    miss = client.get('/weather/')
+    hit = client.get('/weather/')
+    
+    assert hit.status_code == 200
+    assert hit.get_data() == miss.get_data()
+    assert hit.headers['Content-Type'] == 'application/json'
+    assert hit.headers['ETag'] == miss.headers['ETag']
+    
+def test_get_all_weathers_gzip(client):
+    client.post('/weather/bulk', json=[{"city": f"City {i}", "temperature": 20.0, "humidity": 50.0, "description": "Cloudy"} for i in range(20)])
+    plain = client.get('/weather/')
+    response = client.get('/weather/', headers={'Accept-Encoding': 'gzip'})
+    
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+    
+    # each content-coding has its own strong ETag, both revalidate
+    assert response.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    assert client.get('/weather/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']}).status_code == 304
+    redis.raw.delete('all_weathers')
+    assert client.get('/weather/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/weather/', headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+    
+    """
+    Conditional GET /weathers/
+    """
+def test_get_all_weathers_not_modified(client):
+    response = client.get('/weather/')
+    etag = response.headers['ETag']
+    
+    assert 'Last-Modified' in response.headers
+    
+    response = client.get('/weather/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    
+    client.post('/weather/', json={"city": "Quito", "temperature": 14.0, "humidity": 70.0, "description": "Cloudy"})
+    response = client.get('/weather/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    
+def test_get_all_weathers_not_modified_skips_db(client, monkeypatch):
+    etag = client.get('/weather/').headers['ETag']
+    monkeypatch.setattr('weather.db_get_all_weathers', lambda: pytest.fail("must not query the db"))
+    redis.raw.delete('all_weathers')
+    
+    response = client.get('/weather/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    
+def test_get_all_weathers_if_modified_since(client):
+    last_modified = client.get('/weather/').headers['Last-Modified']
+    
+    response = client.get('/weather/', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+    
+def test_get_weather_last_modified_is_utc(client, monkeypatch):
+    # updated_at is server local time, Last-Modified is the same instant in UTC
+    monkeypatch.setenv('TZ', 'Asia/Taipei')
+    time.tzset()
+    try:
+        weather_id = client.post('/weather/', json={"city": "Quito", "temperature": 14.0, "humidity": 70.0, "description": "Cloudy"}).get_json()['weather'][0]['id']
+        last_modified = parsedate_to_datetime(client.get(f'/weather/{weather_id}').headers['Last-Modified'])
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    
+    assert abs((datetime.now(timezone.utc) - last_modified).total_seconds()) < 60
+    
+    """
+    Conditional GET /weathers/<int:id>
+    """
+def test_get_weather_not_modified(client):
+    weather_id = client.post('/weather/', json={"city": "Quito", "temperature": 14.0, "humidity": 70.0, "description": "Cloudy"}).get_json()['weather'][0]['id']
+    miss = client.get(f'/weather/{weather_id}')
+    hit = client.get(f'/weather/{weather_id}')
+    
+    assert miss.headers['ETag'] == hit.headers['ETag']
+    assert miss.headers['Last-Modified'] == hit.headers['Last-Modified']
+    
+    response = client.get(f'/weather/{weather_id}', headers={'If-None-Match': hit.headers['ETag']})
+    assert response.status_code == 304
+    response = client.get(f'/weather/{weather_id}', headers={'If-None-Match': f"W/{hit.headers['ETag']}"})
+    assert response.status_code == 304
+    
+    updated = client.patch(f'/weather/{weather_id}', json={"description": "Drizzle"})
+    assert updated.headers['ETag'] != hit.headers['ETag']
+    
+    response = client.get(f'/weather/{weather_id}', headers={'If-None-Match': hit.headers['ETag']})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == updated.headers['ETag']
+    
+def test_update_weather_if_match(client):
+    weather_id = client.post('/weather/', json={"city": "Lima", "temperature": 17.0, "humidity": 85.0, "description": "Fog"}).get_json()['weather'][0]['id']
+    etag = client.get(f'/weather/{weather_id}').headers['ETag']
+    
+    updated = client.patch(f'/weather/{weather_id}', json={"description": "Mist"}, headers={'If-Match': etag})
+    assert updated.status_code == 200
+    assert updated.get_json()['weather'][0]['description'] == "Mist"
+    
+    # a second writer holding the same version loses instead of overwriting
+    response = client.patch(f'/weather/{weather_id}', json={"description": "Haze"}, headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert client.get(f'/weather/{weather_id}').get_json()['weather'][0]['description'] == "Mist"
+    
+    assert client.patch(f'/weather/{weather_id}', json={"description": "Haze"}, headers={'If-Match': '"garbage"'}).status_code == 412
+    assert client.patch(f'/weather/{weather_id}', json={"description": "Haze"}, headers={'If-Match': updated.headers['ETag']}).status_code == 200
+    assert client.patch(f'/weather/{weather_id}', json={"description": "Smog"}, headers={'If-Match': '*'}).status_code == 200
+    assert client.patch('/weather/999999', json={"description": "Smog"}, headers={'If-Match': etag}).status_code == 412
+    
+    # body keys are column values only
+    response = client.patch(f'/weather/{weather_id}', json={"expected_updated_at": "x", "id": 5})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == "Invalid key: expected_updated_at"
+    
+    """
+    GET /weathers/ filters
+    """
+def test_get_all_weathers_filtered(client):
+    client.post('/weather/bulk', json=[
+        {"city": "Seoul", "temperature": 10.0, "humidity": 30.0, "description": "Cold"},
+        {"city": "Seoul", "temperature": 28.0, "humidity": 80.0, "description": "Humid"},
+        {"city": "Seoul", "temperature": 22.0, "humidity": 50.0, "description": "Mild"}
+    ])
+    response = client.get('/weather/?city=Seoul&min_temperature=15&sort=-temperature')
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert [w['description'] for w in data['weathers']] == ["Humid", "Mild"]
+    
+    response = client.get('/weather/?city=Seoul&max_humidity=50&limit=1&sort=humidity')
+    assert [w['description'] for w in response.get_json()['weathers']] == ["Cold"]
+    
+def test_get_all_weathers_filtered_aware_datetime(client, monkeypatch):
+    # an offset in from/to is converted to the server local time created_at is stored in
+    monkeypatch.setenv('TZ', 'Asia/Taipei')
+    time.tzset()
+    try:
+        client.post('/weather/', json={"city": "Busan", "temperature": 18.0, "humidity": 60.0, "description": "Breezy"})
+        to = (datetime.now(timezone.utc) + timedelta(minutes=1)).isoformat()
+        response = client.get('/weather/', query_string={'city': 'Busan', 'to': to})
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    
+    assert [w['description'] for w in response.get_json()['weathers']] == ["Breezy"]
+    
+def test_get_all_weathers_filtered_cache(client):
+    url = '/weather/?city=Seoul&sort=-temperature'
+    first = client.get(url)
+    
+    assert client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    
+    # a write moves the query to a new cache key
+    client.post('/weather/', json={"city": "Seoul", "temperature": 40.0, "humidity": 20.0, "description": "Heatwave"})
+    data = client.get(url).get_json()
+    assert data['weathers'][0]['description'] == "Heatwave"
+    
+def test_get_all_weathers_invalid_filters(client):
+    assert client.get('/weather/?from=yesterday').status_code == 400
+    assert client.get('/weather/?min_temperature=warm').status_code == 400
+    assert client.get('/weather/?sort=-description').status_code == 400
+    assert client.get('/weather/?limit=0').status_code == 400
+    assert client.get('/weather/?sort=-description').get_json()['message'] == "Invalid sort: -description"
+    
+def test_get_all_weathers_stream_filtered(client):
+    response = client.get('/weather/?stream=ndjson&city=Seoul&sort=temperature')
+    lines = response.get_data(as_text=True).splitlines()
+    
+    assert [json.loads(line)['description'] for line in lines] == ["Cold", "Mild", "Humid", "Heatwave"]
+    
+def test_get_all_weathers_stream_limit(client):
+    response = client.get('/weather/?stream=ndjson&city=Seoul&sort=temperature&limit=2')
+    lines = response.get_data(as_text=True).splitlines()
+    
+    assert [json.loads(line)['description'] for line in lines] == ["Cold", "Mild"]
+    
+    """
+    GET /weathers/stats
+    """
+def test_get_weather_stats(client):
+    response = client.get('/weather/stats?city=Seoul')
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert data['stats'][0]['city'] == "Seoul"
+    assert data['stats'][0]['count'] == 4
+    assert data['stats'][0]['max_temperature'] == "40.00"
+    
+    # cached until the next write
+    assert client.get('/weather/stats?city=Seoul', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    client.post('/weather/', json={"city": "Seoul", "temperature": 41.0, "humidity": 20.0, "description": "Heatwave"})
+    assert client.get('/weather/stats?city=Seoul').get_json()['stats'][0]['count'] == 5
+    
+def test_get_weather_stats_bucket(client):
+    response = client.get('/weather/stats?city=Seoul&bucket=hour')
+    
+    assert response.status_code == 200
+    assert 'bucket' in response.get_json()['stats'][0]
+    assert client.get('/weather/stats?bucket=week').status_code == 400
+    
+    """
+    GET /weathers/latest
+    """
+def test_get_latest_weathers(client):
+    response = client.get('/weather/latest')
+    cities = [w['city'] for w in response.get_json()['weather']]
+    
+    assert response.status_code == 200
+    assert "Seoul" in cities
+    assert cities == sorted(set(cities))
+    
+def test_get_latest_weather(client):
+    client.post('/weather/', json={"city": "Seoul", "temperature": 12.0, "humidity": 80.0, "description": "Drizzle"})
+    response = client.get('/weather/latest/Seoul')
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert data['weather'][0]['description'] == "Drizzle"
+    assert client.get('/weather/latest/Seoul', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    
+    # follows updates and deletes of the latest reading
+    weather_id = data['weather'][0]['id']
+    client.patch(f'/weather/{weather_id}', json={"description": "Rain"})
+    assert client.get('/weather/latest/Seoul').get_json()['weather'][0]['description'] == "Rain"
+    client.delete(f'/weather/{weather_id}')
+    assert client.get('/weather/latest/Seoul').get_json()['weather'][0]['id'] != weather_id
+    
+def test_get_latest_weather_not_found(client):
+    response = client.get('/weather/latest/Atlantis')
+    
+    assert response.status_code == 404
+    assert response.get_json()['message'] == "No weather Found in city: Atlantis"
+    
+    """
+    GET /weathers/batch
+    """
+def test_get_weathers_batch(client):
+    ids = [client.post('/weather/', json={"city": "Lima", "temperature": t, "humidity": 80.0, "description": "Fog"}).get_json()['weather'][0]['id']
+           for t in (18.0, 19.0)]
+    response = client.get(f'/weather/batch?ids={ids[1]},999999,{ids[0]},{ids[1]}')
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert [w and w['temperature'] for w in data['weather']] == ["19.00", None, "18.00", "19.00"]
+    assert data['missing'] == [999999]
+    
+    # the misses filled the per-id cache, negative entries included
+    assert redis.get(f'weather:{ids[0]}') is not None
+    assert redis.get('weather:999999') == 'not_found'
+    assert client.get(f'/weather/batch?ids={ids[1]},999999,{ids[0]},{ids[1]}').get_json() == data
+    
+def test_get_weathers_batch_post(client):
+    response = client.post('/weather/batch', json={'ids': [999998, "999999"]})
+    
+    assert response.status_code == 200
+    assert response.get_json()['weather'] == [None, None]
+    
+def test_get_weathers_batch_invalid(client, monkeypatch):
+    assert client.get('/weather/batch').status_code == 400
+    assert client.get('/weather/batch?ids=1,x').get_json()['message'] == "Invalid id: x"
+    assert client.post('/weather/batch', json=[1, 2]).status_code == 400
+    assert client.post('/weather/batch', json={'ids': [True]}).status_code == 400
+    monkeypatch.setattr('weather.BATCH_MAX_IDS', 2)
+    assert client.get('/weather/batch?ids=1,2,3').status_code == 400
+    
+    """
+    PATCH and DELETE /weathers/bulk
+    """
+def test_update_weathers_bulk(client):
+    ids = [client.post('/weather/', json={"city": "Cusco", "temperature": t, "humidity": 60.0, "description": "Clear"}).get_json()['weather'][0]['id']
+           for t in (10.0, 11.0, 12.0)]
+    client.get(f'/weather/{ids[0]}')
+    
+    response = client.patch('/weather/bulk', json={'filter': {'city': "Cusco", 'max_temperature': 11}, 'set': {'description': "Frost", 'temperature': "9.5"}})
+    
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == 2
+    # the per-id cache entry was dropped
+    assert client.get(f'/weather/{ids[0]}').get_json()['weather'][0]['description'] == "Frost"
+    descriptions = [w['description'] for w in client.get('/weather/?city=Cusco&sort=id').get_json()['weathers']]
+    assert descriptions == ["Frost", "Frost", "Clear"]
+    
+    response = client.patch('/weather/bulk', json={'ids': ids[1:], 'set': {'city': "Arequipa"}})
+    assert response.get_json()['updated'] == 2
+    assert client.get('/weather/latest/Cusco').get_json()['weather'][0]['id'] == ids[0]
+    assert client.get('/weather/latest/Arequipa').get_json()['weather'][0]['id'] == ids[2]
+    
+def test_update_weathers_bulk_invalid(client):
+    assert client.patch('/weather/bulk', json={'set': {'description': "Frost"}}).status_code == 400
+    assert client.patch('/weather/bulk', json={'ids': [1], 'filter': {'city': "Quito"}, 'set': {'description': "Frost"}}).status_code == 400
+    assert client.patch('/weather/bulk', json={'filter': {}, 'set': {'description': "Frost"}}).status_code == 400
+    assert client.patch('/weather/bulk', json={'filter': {'country': "Peru"}, 'set': {'description': "Frost"}}).get_json()['message'] == "Invalid filter: country"
+    assert client.patch('/weather/bulk', json={'ids': [1], 'set': {'id': 5}}).get_json()['message'] == "Invalid key: id"
+    assert client.patch('/weather/bulk', json={'ids': [1], 'set': {'temperature': "hot"}}).status_code == 400
+    assert client.patch('/weather/bulk', json={'ids': [1], 'set': {'description': None}}).status_code == 400
+    
+def test_delete_weathers_bulk(client):
+    ids = [client.post('/weather/', json={"city": "Oslo", "temperature": t, "humidity": 60.0, "description": "Snow"}).get_json()['weather'][0]['id']
+           for t in (-5.0, -3.0)]
+    client.get(f'/weather/{ids[0]}')
+    
+    response = client.delete('/weather/bulk', json={'filter': {'city': "Oslo"}})
+    
+    assert response.status_code == 200
+    assert response.get_json()['deleted'] == 2
+    assert client.get(f'/weather/{ids[0]}').status_code == 404
+    assert client.get('/weather/latest/Oslo').status_code == 404
+    assert client.delete('/weather/bulk', json={'ids': ids}).get_json()['deleted'] == 0
+    assert client.delete('/weather/bulk', json={'ids': "1,2"}).status_code == 400
@@ -1,16 +1,23 @@
 from flask import Flask, request
+from flask.logging import default_handler
 from flask_sqlalchemy import SQLAlchemy
-from flasgger import Swagger, LazyString, LazyJSONEncoder
+from flasgger import Swagger
 from db import db
-from config import MYSQL_HOST, MYSQL_PASSWORD, MYSQL_PORT, MYSQL_USER, DATABASE_NAME
+from config import MYSQL_HOST, MYSQL_PASSWORD, MYSQL_PORT, MYSQL_USER, DATABASE_NAME, LOG_LEVEL
 from weather import weather_bp
-from cache import redis
-import logging
-from logging.handlers import RotatingFileHandler
-from logging import Formatter
+from commands import weather_cli
+from cache import redis, local_cache
+from pools import InstrumentedQueuePool, db_engine_options, db_pool_stats, redis_pool_stats
+from replicas import replica_router, replica_uris
+from metrics import init_metrics
+from profiling import init_profiling
+from logs import queue_handler, init_request_ids
+from json_provider import json_provider_class
 
 def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
+    # responses and cache entries are encoded by the configured JSON backend
+    app.json = json_provider_class()(app)
     app.config.from_pyfile('config.py', silent=True)
     isTesting = False
     
@@ -22,12 +29,28 @@ def create_app(test_config=None):
     configure_extensions(app, isTesting)
     configure_apispec(app)
     configure_blueprints(app)
+    configure_commands(app)
+    configure_metrics(app)
+    configure_profiling(app)
     
     # Add health check endpoint
     @app.route('/health')
     def health():
         return {'status': 'healthy'}
     
+    # connection pool statistics, to size the pools against real traffic
+    @app.route('/health/pools')
+    def pools():
+        return {
+            'db': db_pool_stats(db.engine),
+            'redis': redis_pool_stats(redis._redis),
+            'redis_raw': redis_pool_stats(redis.raw._redis),
+            'replicas': {
+                key: dict(db_pool_stats(app.extensions['replicas'][key]), **state)
+                for key, state in replica_router.stats().items()
+            }
+        }
+    
     @app.errorhandler(404)
     def page_not_found(e):
         return {'message': 'Resource not found'}, 404
@@ -40,7 +63,11 @@ def configure_extensions(app, isTesting=False, test_redis=None):
     if not isTesting:
         conn_string = f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{DATABASE_NAME}'
         app.config['SQLALCHEMY_DATABASE_URI'] = conn_string
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', dict(db_engine_options(), poolclass=InstrumentedQueuePool))
+        app.config.setdefault('REPLICA_DATABASE_URIS', replica_uris())
     db.init_app(app)
+    # route reads of GET requests to the replicas
+    replica_router.init_app(app)
     
     # initialize redis
     redis.init_redis(isTesting)
@@ -50,9 +77,12 @@ def configure_extensions(app, isTesting=False, test_redis=None):
     except Exception as e:
         app.logger.error(f"Error connecting to redis: {e}")
     
+    # listen for invalidations of the in-process cache
+    if not isTesting:
+        local_cache.subscribe()
+    
 def configure_apispec(app):
-    # configure swagger for api spec
-    app.json_encoder = LazyJSONEncoder
+    # configure swagger for api spec, its lazy strings are encoded by the JSON provider
     template = dict(
         swagger='2.0',
         info=dict(
@@ -66,16 +96,28 @@ def configure_apispec(app):
 def configure_blueprints(app):
     app.register_blueprint(weather_bp)
     
-def configure_logger(app):
-    handler = RotatingFileHandler('weather.log', maxBytes=10000, backupCount=1)
-    handler.setLevel(logging.INFO)
+def configure_commands(app):
+    app.cli.add_command(weather_cli)
     
-    # Add a formatter to include the timestamp in logs
-    formatter = Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
+def configure_metrics(app):
+    # request, cache, db and redis metrics, served on /metrics
+    init_metrics(app)
+    
+def configure_profiling(app):
+    # Server-Timing breakdown and on-demand cProfile, when PROFILING_ENABLED
+    init_profiling(app)
+    
+def configure_logger(app):
+    # records go through a queue, the file is written by a listener thread off the request path
+    handler = queue_handler()
+    # flask's stderr handler would still format and write every record on the request thread
+    app.logger.removeHandler(default_handler)
+    if handler not in app.logger.handlers:
+        app.logger.addHandler(handler)
+    app.logger.setLevel(LOG_LEVEL)
     
-    app.logger.addHandler(handler)
-    app.logger.setLevel(logging.INFO)
+    # request ids are logged with every record and returned in X-Request-ID
+    init_request_ids(app)
 
 if __name__ == '__main__':
     app = create_app()
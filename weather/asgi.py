@@ -0,0 +1,254 @@
+import asyncio
+import io
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+from redis.exceptions import WatchError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app import create_app
+from cache import redis, local_cache, CachedResponse
+from config import ASGI_WSGI_THREADS
+from db import weather
+from pools import db_engine_options
+from metrics import count_cache
+from weather import all_weathers_cache, weather_cache_key, weather_cache_entries, cached_weather_response, weather_response, weather_not_found_response, not_modified, not_modified_response
+
+# async drivers of the sync database URIs
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite'
+}
+
+WEATHER_PATH = re.compile(r'^/weather/(\d+)$')
+
+def create_asgi_app(test_config=None):
+    # ASGI entry point, e.g. uvicorn --factory asgi:create_asgi_app
+    return AsyncWeatherApp(create_app(test_config))
+
+class AsyncWeatherApp:
+    """
+    Serves the hot reads of weather_bp with aiomysql and redis.asyncio, so waiting on
+    MySQL or Redis does not pin a worker. Everything else, including cache rebuilds of
+    the all weathers listing, goes to the Flask app running in a thread pool.
+    """
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi_app = ThreadPoolWsgiToAsgi(flask_app, ASGI_WSGI_THREADS)
+        self.engine = None
+        self.session_factory = None
+        self.redis = None
+        self.raw_redis = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            response = await self.dispatch(scope)
+            if response is not None:
+                await send_response(send, response)
+                return
+        await self.wsgi_app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def startup(self):
+        if self.engine is not None:
+            return
+        uri = async_database_uri(self.flask_app.config['SQLALCHEMY_DATABASE_URI'])
+        options = db_engine_options() if uri.drivername == 'mysql+aiomysql' else {}
+        self.engine = create_async_engine(uri, **options)
+        self.session_factory = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.redis = redis.async_client()
+        self.raw_redis = redis.raw.async_client()
+
+    async def shutdown(self):
+        if self.engine is None:
+            return
+        await self.engine.dispose()
+        await self.redis.aclose()
+        await self.raw_redis.aclose()
+        self.engine = None
+
+    async def dispatch(self, scope):
+        # returns None when the request has to be served by the Flask app
+        if scope['path'] == '/weather/' and not scope['query_string']:
+            handler, args = self.get_all_weathers, ()
+        elif WEATHER_PATH.match(scope['path']):
+            handler, args = self.get_weather, (int(WEATHER_PATH.match(scope['path']).group(1)),)
+        else:
+            return None
+
+        self.startup()
+        with self.flask_app.request_context(build_environ(scope)):
+            # the before and after request hooks of the Flask views: metrics, request ids, Server-Timing
+            rv = self.flask_app.preprocess_request()
+            if rv is None:
+                rv = await handler(*args)
+                if rv is None:
+                    return None
+            return self.flask_app.process_response(self.flask_app.make_response(rv))
+
+    async def get_all_weathers(self):
+        if request.accept_mimetypes.best == 'application/x-ndjson':
+            return None
+        cached_response = local_cache.get('all_weathers')
+        if cached_response is None:
+            local_version = local_cache.version('all_weathers')
+            values = await self.raw_redis.mget(*all_weathers_cache.read_keys('all_weathers'))
+            cached_weathers = all_weathers_cache.fresh_value(*values)
+            if cached_weathers is None:
+                # stale or missing, rebuilt by the single-flight path of the Flask view
+                return None
+            self.flask_app.logger.info("Hit cache in getting all weathers (async)")
+            count_cache('all_weathers', 'hit')
+            cached_response = CachedResponse.from_bytes(cached_weathers)
+            local_cache.set('all_weathers', cached_response, local_version)
+        if not_modified(cached_response.response_etag(), cached_response.last_modified):
+            return not_modified_response(cached_response.response_etag(), cached_response.last_modified)
+        return cached_response.to_response(), 200
+
+    async def get_weather(self, id):
+        cached_weather = await self.redis.get(weather_cache_key(id))
+        if cached_weather is not None:
+            self.flask_app.logger.info(f"Hit cache in getting weather {id} (async)")
+            count_cache('weather', 'hit')
+            return cached_weather_response(id, cached_weather)
+
+        self.flask_app.logger.info(f"Miss cache in getting weather {id} (async)")
+        count_cache('weather', 'miss')
+        generation = await self.redis.get(all_weathers_cache.generation_key('all_weathers'))
+        async with self.session_factory() as session:
+            w = await session.get(weather, id)
+        await self.store_if_current(generation, weather_cache_entries([id], [w] if w else []))
+        if w:
+            return weather_response(w)
+        return weather_not_found_response(id)
+
+    async def store_if_current(self, generation, entries):
+        # SingleFlightCache.store_if_current on redis.asyncio, a fill never lands over or after a write
+        if generation is None:
+            return False
+        key = all_weathers_cache.generation_key('all_weathers')
+        async with self.redis.pipeline() as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.get(key) != generation:
+                    return False
+                pipe.multi()
+                for name, (value, ttl) in entries.items():
+                    pipe.set(name, value, ex=ttl, nx=True)
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+class ThreadPoolWsgiToAsgi:
+    """
+    Runs the WSGI app on a thread pool of its own, asgiref's WsgiToAsgi goes through
+    thread-sensitive sync_to_async, i.e. a single thread serving one request at a time.
+    The response is sent chunk by chunk, so streamed listings are not buffered.
+    """
+    def __init__(self, wsgi_application, max_workers):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        body = io.BytesIO()
+        while True:
+            message = await receive()
+            if message['type'] != 'http.request':
+                # the client went away before sending the whole body
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        environ = build_environ(scope, body)
+        environ['wsgi.multithread'] = True
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.run_wsgi_app, environ, loop, send)
+
+    def run_wsgi_app(self, environ, loop, send):
+        def sync_send(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response_start = {}
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response_start.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start.update(status=int(status.split(' ', 1)[0]),
+                                  headers=[(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers])
+
+        def send_start():
+            if not response_start.get('sent'):
+                sync_send({'type': 'http.response.start', 'status': response_start['status'], 'headers': response_start['headers']})
+                response_start['sent'] = True
+
+        chunks = self.wsgi_application(environ, start_response)
+        try:
+            for chunk in chunks:
+                send_start()
+                sync_send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_start()
+            sync_send({'type': 'http.response.body'})
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+def async_database_uri(uri):
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+def build_environ(scope, body=None):
+    # minimal WSGI environ of an ASGI http scope, enough for a Flask request context
+    server = scope.get('server') or ('localhost', 80)
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body if body is not None else io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin1'), value.decode('latin1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+async def send_response(send, response):
+    headers = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.headers.items()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response.get_data()})
@@ -1,20 +1,348 @@
-from redis import Redis
+from redis import Redis as RedisClient
+from redis.asyncio import Redis as AsyncRedisClient
+from redis.exceptions import RedisError, WatchError
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import Response, json, request
+import gzip
+import hashlib
+import logging
+import random
+import threading
+import time
+import uuid
 
-from config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
+from pools import InstrumentedBlockingConnectionPool
+from metrics import instrument_redis
+from config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT, REDIS_SOCKET_TIMEOUT, REDIS_SOCKET_CONNECT_TIMEOUT, CACHE_GZIP_MIN_SIZE, CACHE_GZIP_LEVEL, L1_CACHE_ENABLED, L1_CACHE_MAX_ENTRIES, L1_CACHE_MAX_BYTES, L1_CACHE_TTL, CACHE_INVALIDATION_CHANNEL
+
+logger = logging.getLogger(__name__)
 
 class Redis:
-    def __init__(self):
+    def __init__(self, decode_responses=True):
         self._redis = None
+        self._fake_server = None
+        self.decode_responses = decode_responses
+        # binary view of the same server, for values such as compressed response bodies
+        self.raw = Redis(decode_responses=False) if decode_responses else None
         
     def init_redis(self, is_testing=False):
         if is_testing:
-            from fakeredis import FakeStrictRedis
-            self._redis = FakeStrictRedis(decode_responses=True)
+            from fakeredis import FakeServer, FakeStrictRedis
+            server = FakeServer()
+            self._fake_server = self.raw._fake_server = server
+            self._redis = instrument_redis(FakeStrictRedis(server=server, decode_responses=True))
+            self.raw._redis = instrument_redis(FakeStrictRedis(server=server, decode_responses=False))
         else:
-            self._redis = Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
+            # one blocking pool per worker and decoding mode, shared by every thread
+            self._redis = instrument_redis(RedisClient(connection_pool=redis_connection_pool(decode_responses=True)))
+            self.raw._redis = instrument_redis(RedisClient(connection_pool=redis_connection_pool(decode_responses=False)))
+            
+    def async_client(self):
+        # redis.asyncio client of the same server, for the ASGI app
+        if self._fake_server is not None:
+            from fakeredis import FakeAsyncRedis
+            return FakeAsyncRedis(server=self._fake_server, decode_responses=self.decode_responses)
+        return AsyncRedisClient(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=self.decode_responses,
+                                max_connections=REDIS_MAX_CONNECTIONS, socket_timeout=REDIS_SOCKET_TIMEOUT,
+                                socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT)
             
             
     def __getattr__(self, name):
         return getattr(self._redis, name)
 
-redis = Redis()
\ No newline at end of file
+def redis_connection_pool(decode_responses):
+    return InstrumentedBlockingConnectionPool(
+        host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=decode_responses,
+        max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT)
+
+redis = Redis()
+
+class LocalCache:
+    """
+    Per-worker LRU/TTL cache of serialized response bodies, bounded by entries and bytes.
+
+    Invalidations are broadcast over Redis pub/sub so every worker drops its copy, the TTL
+    bounds staleness if a message is lost.
+    """
+    def __init__(self, redis, channel, max_entries, max_bytes, ttl, enabled=True):
+        self._redis = redis
+        self.channel = channel
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._size = 0
+        # invalidations seen per key, and clears of the whole cache
+        self._invalidations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def version(self, key):
+        # taken before reading the value from redis, see set
+        with self._lock:
+            return self._epoch, self._invalidations.get(key, 0)
+
+    def set(self, key, value, version=None):
+        # a value read before an invalidation of key that arrived since `version` is not stored
+        if not self.enabled or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if version is not None and version != (self._epoch, self._invalidations.get(key, 0)):
+                return
+            self._pop(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._size += len(value)
+            # evict least recently used entries until both bounds hold
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._invalidations[key] = self._invalidations.get(key, 0) + 1
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._size = 0
+
+    def invalidate(self, key):
+        # drop the local copy right away, other workers drop theirs on the broadcast
+        if not self.enabled:
+            return
+        self.delete(key)
+        self._redis.publish(self.channel, key)
+
+    def subscribe(self):
+        if not self.enabled or self._listener is not None:
+            return
+        self._listener = threading.Thread(target=self._listen, name='local-cache-invalidation', daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # invalidations published while unsubscribed are lost, start over
+                self.clear()
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.delete(message['data'])
+            except RedisError as e:
+                logger.error(f"Error in listening to cache invalidations: {e}")
+                time.sleep(1)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+class CachedResponse:
+    """
+    Final response body, serialized once per invalidation together with its gzip variant and ETag.
+    """
+    def __init__(self, body, etag, mimetype='application/json', gzip_body=None, last_modified=None):
+        self.body = body
+        self.etag = etag
+        self.mimetype = mimetype
+        self.gzip_body = gzip_body
+        self.last_modified = last_modified
+
+    @classmethod
+    def build(cls, body, mimetype='application/json', etag=None, last_modified=None):
+        if etag is None:
+            etag = hashlib.sha1(body).hexdigest()
+        gzip_body = None
+        if len(body) >= CACHE_GZIP_MIN_SIZE:
+            gzip_body = gzip.compress(body, compresslevel=CACHE_GZIP_LEVEL, mtime=0)
+        return cls(body, etag, mimetype, gzip_body, last_modified)
+
+    def to_bytes(self):
+        header = json.dumps({
+            'etag': self.etag,
+            'mimetype': self.mimetype,
+            'length': len(self.body),
+            'last_modified': self.last_modified.timestamp() if self.last_modified else None
+        }, separators=(',', ':'))
+        return header.encode() + b'\n' + self.body + (self.gzip_body or b'')
+
+    @classmethod
+    def from_bytes(cls, blob):
+        header, payload = blob.split(b'\n', 1)
+        header = json.loads(header)
+        body, gzip_body = payload[:header['length']], payload[header['length']:]
+        last_modified = None
+        if header.get('last_modified') is not None:
+            last_modified = datetime.fromtimestamp(header['last_modified'], timezone.utc)
+        return cls(body, header['etag'], header['mimetype'], gzip_body or None, last_modified)
+
+    def serves_gzip(self):
+        return self.gzip_body is not None and 'gzip' in request.accept_encodings
+
+    def response_etag(self):
+        # strong validators differ per content-coding
+        return gzip_etag(self.etag) if self.serves_gzip() else self.etag
+
+    def to_response(self):
+        if self.serves_gzip():
+            response = Response(self.gzip_body, mimetype=self.mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(self.body, mimetype=self.mimetype)
+        if self.gzip_body is not None:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(self.response_etag())
+        if self.last_modified is not None:
+            response.last_modified = self.last_modified
+        return response
+
+    def __len__(self):
+        return len(self.body) + len(self.gzip_body or b'')
+
+def gzip_etag(etag):
+    return f'{etag}-gzip'
+
+local_cache = LocalCache(redis, CACHE_INVALIDATION_CHANNEL, L1_CACHE_MAX_ENTRIES, L1_CACHE_MAX_BYTES, L1_CACHE_TTL, L1_CACHE_ENABLED)
+
+class SingleFlightCache:
+    """
+    Stale-while-revalidate cache for expensive values such as all_weathers.
+
+    A value is fresh while its generation matches the key generation and its soft TTL
+    has not expired. Only the worker holding the Redis lock recomputes a stale value,
+    every other worker keeps serving the stale one until the hard TTL drops it.
+    """
+    def __init__(self, redis, soft_ttl, hard_ttl, jitter=0, lock_ttl=10, lock_wait=2.0, poll_interval=0.05):
+        self._redis = redis
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.jitter = jitter
+        self.lock_ttl = lock_ttl
+        self.lock_wait = lock_wait
+        self.poll_interval = poll_interval
+
+    def get_or_compute(self, key, compute):
+        # returns (value, status) where status is one of hit, stale or miss,
+        # compute is called with the generation the value is built for
+        value, fresh, generation = self._redis.mget(*self.read_keys(key))
+        if generation is None:
+            generation, _ = self.version(key)
+        if self.fresh_value(value, fresh, generation) is not None:
+            return value, 'hit'
+        generation = int(generation)
+
+        token = self._acquire(key)
+        if token:
+            try:
+                value = compute(generation)
+                self._store(key, value, generation)
+            finally:
+                self._release(key, token)
+            return value, 'miss'
+
+        if value is not None:
+            return value, 'stale'
+
+        # nothing to serve yet: wait for the worker holding the lock to store the value
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            value = self._redis.get(key)
+            if value is not None:
+                return value, 'stale'
+        return compute(generation), 'miss'
+
+    def read_keys(self, key):
+        # keys to MGET in one round trip, also used by the async reader of the ASGI app
+        return key, f'{key}:fresh', self.generation_key(key)
+
+    def generation_key(self, key):
+        return f'{key}:gen'
+
+    def store_if_current(self, key, generation, entries):
+        # SET NX the {name: (value, ttl)} entries read from the db alongside `key`, only while key
+        # is still at the generation read before the query: writers bump it before touching them
+        with self._redis.pipeline() as pipe:
+            try:
+                pipe.watch(self.generation_key(key))
+                current = pipe.get(self.generation_key(key))
+                if current is None or int(current) != generation:
+                    return False
+                pipe.multi()
+                for name, (value, ttl) in entries.items():
+                    pipe.set(name, value, ex=ttl, nx=True)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def fresh_value(self, value, fresh, generation):
+        if value is not None and fresh is not None and generation is not None and int(fresh) == int(generation):
+            return value
+        return None
+
+    def version(self, key):
+        # (generation, last modified timestamp) of the value, without fetching the value itself
+        generation, modified = self._redis.mget(f'{key}:gen', f'{key}:modified')
+        if generation is None:
+            # start from the clock so a flushed redis never hands out a generation seen before
+            now = time.time()
+            pipe = self._redis.pipeline()
+            pipe.set(f'{key}:gen', int(now * 1000), nx=True)
+            pipe.set(f'{key}:modified', now, nx=True)
+            pipe.mget(f'{key}:gen', f'{key}:modified')
+            generation, modified = pipe.execute()[-1]
+        return int(generation), float(modified or 0)
+
+    def invalidate(self, key):
+        # bump the generation, the current value stays servable as stale
+        now = time.time()
+        pipe = self._redis.pipeline()
+        pipe.set(f'{key}:gen', int(now * 1000), nx=True)
+        pipe.incr(f'{key}:gen')
+        pipe.set(f'{key}:modified', now)
+        pipe.execute()
+
+    def _store(self, key, value, generation):
+        pipe = self._redis.pipeline()
+        pipe.set(key, value, ex=self.hard_ttl + random.randint(0, self.jitter))
+        pipe.set(f'{key}:fresh', generation, ex=self.soft_ttl + random.randint(0, self.jitter))
+        pipe.execute()
+
+    def _acquire(self, key):
+        token = uuid.uuid4().hex
+        if self._redis.set(f'{key}:lock', token, nx=True, ex=self.lock_ttl):
+            return token
+        return None
+
+    def _release(self, key, token):
+        # only delete the lock if it is still ours, it may have expired and been taken over
+        with self._redis.pipeline() as pipe:
+            try:
+                pipe.watch(f'{key}:lock')
+                if pipe.get(f'{key}:lock') in (token, token.encode()):
+                    pipe.multi()
+                    pipe.delete(f'{key}:lock')
+                    pipe.execute()
+            except WatchError:
+                pass
@@ -0,0 +1,101 @@
+import click
+from flask.cli import AppGroup
+from datetime import date, datetime, timedelta
+from db import db_rebuild_weather_rollup, db_rebuild_latest_weather, db_downsample_weathers, db_expire_weathers, db_expire_weather_rollup, db_add_weather_partitions, next_month
+from cache import redis
+from ingest import IngestConsumer, consumer_name
+from weather import invalidate_weathers_cache, uncache_weathers
+from config import INGEST_BATCH_SIZE, RETENTION_RAW_DAYS, RETENTION_ROLLUP_DAYS, RETENTION_DELETE_BATCH_SIZE, DOWNSAMPLE_BUCKET, PARTITION_MONTHS_AHEAD, STATS_ROLLUP_ENABLED
+
+weather_cli = AppGroup('weather', help='Weather maintenance commands.')
+
+@weather_cli.command('rebuild-rollup')
+def rebuild_rollup():
+    """Rebuild the hourly weather_rollup table from the raw weather rows."""
+    result = db_rebuild_weather_rollup()
+    if isinstance(result, Exception):
+        raise click.ClickException(f"Rebuilding weather rollup failed: {result}")
+    click.echo("weather rollup rebuilt")
+
+@weather_cli.command('rebuild-latest')
+def rebuild_latest():
+    """Rebuild the latest_weather table from the raw weather rows."""
+    result = db_rebuild_latest_weather()
+    if isinstance(result, Exception):
+        raise click.ClickException(f"Rebuilding latest weather failed: {result}")
+    click.echo("latest weather rebuilt")
+
+def weathers_changed(ids):
+    # the generation is bumped first, so a read fill racing the write is dropped
+    invalidate_weathers_cache()
+    # e.g. the not-found entries cached for new ids
+    uncache_weathers(ids)
+
+@weather_cli.command('consume-ingest')
+@click.option('--batch-size', default=INGEST_BATCH_SIZE, show_default=True, help='Readings per multi-row INSERT.')
+@click.option('--once', is_flag=True, help='Write one batch and exit.')
+def consume_ingest(batch_size, once):
+    """Write the readings queued by POST /weather/ in write-behind mode."""
+    consumer = IngestConsumer(redis, consumer_name(), on_written=weathers_changed, batch_size=batch_size)
+    if once:
+        consumer.ensure_group()
+        click.echo(f"{consumer.process_batch()} weathers written")
+        return
+    consumer.run()
+
+
+@weather_cli.command('downsample')
+@click.option('--older-than', default=RETENTION_RAW_DAYS, show_default=True, help='Days of readings left out.')
+@click.option('--bucket', type=click.Choice(['hour', 'day']), default=DOWNSAMPLE_BUCKET, show_default=True, help='Aggregate resolution.')
+def downsample(older_than, bucket):
+    """Compact the readings older than --older-than days into weather_rollup."""
+    result = db_downsample_weathers(datetime.now() - timedelta(days=older_than), bucket)
+    if isinstance(result, Exception):
+        raise click.ClickException(f"Downsampling weathers failed: {result}")
+    click.echo(f"{result} days downsampled to {'hourly' if bucket == 'hour' else 'daily'} aggregates")
+
+@weather_cli.command('retention')
+@click.option('--raw-days', default=RETENTION_RAW_DAYS, show_default=True, help='Days of raw readings kept.')
+@click.option('--rollup-days', default=RETENTION_ROLLUP_DAYS, show_default=True, help='Days of aggregates kept, 0 keeps them all.')
+@click.option('--bucket', type=click.Choice(['hour', 'day']), default=DOWNSAMPLE_BUCKET, show_default=True, help='Resolution the expired readings are kept at.')
+@click.option('--batch-size', default=RETENTION_DELETE_BATCH_SIZE, show_default=True, help='Rows per DELETE.')
+def retention(raw_days, rollup_days, bucket, batch_size):
+    """
+    Expire the readings older than --raw-days, downsampling them into weather_rollup first.
+
+    Stats keep covering expired readings through the rollup only, i.e. with STATS_ROLLUP_ENABLED.
+    Readings written later for an expired day replace its aggregates.
+    """
+    before = datetime.now() - timedelta(days=raw_days)
+    result = db_downsample_weathers(before, bucket)
+    if isinstance(result, Exception):
+        raise click.ClickException(f"Downsampling weathers failed: {result}")
+    # per-id entries of dropped partitions are left to expire after WEATHER_CACHE_TTL
+    result = db_expire_weathers(before, batch_size, on_deleted=weathers_changed)
+    if isinstance(result, Exception):
+        raise click.ClickException(f"Expiring weathers failed: {result}")
+    dropped, deleted = result
+    invalidate_weathers_cache()
+    click.echo(f"{len(dropped)} partitions dropped, {deleted} weathers deleted")
+    if not STATS_ROLLUP_ENABLED:
+        click.echo("STATS_ROLLUP_ENABLED is off, stats won't include the downsampled readings")
+    if rollup_days:
+        result = db_expire_weather_rollup(datetime.now() - timedelta(days=rollup_days))
+        if isinstance(result, Exception):
+            raise click.ClickException(f"Expiring weather rollup failed: {result}")
+        click.echo(f"{result} rollup rows deleted")
+
+@weather_cli.command('partitions')
+@click.option('--months-ahead', default=PARTITION_MONTHS_AHEAD, show_default=True, help='Future months to create partitions for.')
+def partitions(months_ahead):
+    """Create the monthly partitions of the weather table ahead of time (MySQL)."""
+    until = date.today().replace(day=1)
+    for _ in range(months_ahead):
+        until = next_month(until)
+    result = db_add_weather_partitions(until)
+    if isinstance(result, Exception):
+        raise click.ClickException(f"Adding weather partitions failed: {result}")
+    if result is None:
+        click.echo("weather is not partitioned")
+        return
+    click.echo(f"{len(result)} partitions added")
@@ -14,8 +14,105 @@ MYSQL_PORT = os.getenv('MYSQL_PORT', 3306)
 MYSQL_USER = os.getenv('MYSQL_USER', 'root')
 MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', 'root')
 DATABASE_NAME = os.getenv('DATABASE_NAME', 'weather')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 10))
 
 # redis
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = os.getenv('REDIS_PORT', 6379)
-REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
\ No newline at end of file
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 5))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv('REDIS_SOCKET_CONNECT_TIMEOUT', 5))
+
+# cache
+WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', 300))
+WEATHER_NEGATIVE_CACHE_TTL = int(os.getenv('WEATHER_NEGATIVE_CACHE_TTL', 30))
+ALL_WEATHERS_SOFT_TTL = int(os.getenv('ALL_WEATHERS_SOFT_TTL', 60))
+ALL_WEATHERS_HARD_TTL = int(os.getenv('ALL_WEATHERS_HARD_TTL', 3600))
+CACHE_TTL_JITTER = int(os.getenv('CACHE_TTL_JITTER', 10))
+CACHE_LOCK_TTL = int(os.getenv('CACHE_LOCK_TTL', 10))
+CACHE_LOCK_WAIT = float(os.getenv('CACHE_LOCK_WAIT', 2.0))
+CACHE_GZIP_MIN_SIZE = int(os.getenv('CACHE_GZIP_MIN_SIZE', 1024))
+CACHE_GZIP_LEVEL = int(os.getenv('CACHE_GZIP_LEVEL', 6))
+FILTERED_WEATHERS_CACHE_TTL = int(os.getenv('FILTERED_WEATHERS_CACHE_TTL', 60))
+
+# in-process cache in front of redis
+L1_CACHE_ENABLED = os.getenv('L1_CACHE_ENABLED', 'false').lower() == 'true'
+L1_CACHE_MAX_ENTRIES = int(os.getenv('L1_CACHE_MAX_ENTRIES', 128))
+L1_CACHE_MAX_BYTES = int(os.getenv('L1_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+L1_CACHE_TTL = int(os.getenv('L1_CACHE_TTL', 5))
+CACHE_INVALIDATION_CHANNEL = os.getenv('CACHE_INVALIDATION_CHANNEL', 'cache:invalidate')
+
+# paging
+CURSOR_PAGE_DEFAULT_LIMIT = int(os.getenv('CURSOR_PAGE_DEFAULT_LIMIT', 20))
+CURSOR_PAGE_MAX_LIMIT = int(os.getenv('CURSOR_PAGE_MAX_LIMIT', 1000))
+WEATHER_COUNT_CACHE_TTL = int(os.getenv('WEATHER_COUNT_CACHE_TTL', 60))
+
+# streaming
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 1000))
+
+# bulk
+BULK_INSERT_BATCH_SIZE = int(os.getenv('BULK_INSERT_BATCH_SIZE', 500))
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 10000))
+BATCH_MAX_IDS = int(os.getenv('BATCH_MAX_IDS', 100))
+
+# stats
+STATS_ROLLUP_ENABLED = os.getenv('STATS_ROLLUP_ENABLED', 'false').lower() == 'true'
+STATS_CACHE_TTL = int(os.getenv('STATS_CACHE_TTL', 300))
+
+# read replicas, comma separated host or host:port
+MYSQL_REPLICA_HOSTS = [host.strip() for host in os.getenv('MYSQL_REPLICA_HOSTS', '').split(',') if host.strip()]
+REPLICA_SELECTION = os.getenv('REPLICA_SELECTION', 'round_robin')  # round_robin or least_latency
+REPLICA_MAX_LAG = int(os.getenv('REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = int(os.getenv('REPLICA_CHECK_INTERVAL', 10))
+READ_YOUR_WRITES_WINDOW = int(os.getenv('READ_YOUR_WRITES_WINDOW', 5))
+
+# write-behind ingestion, POST /weather/ queues readings on a redis stream for `flask weather consume-ingest`
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+INGEST_STREAM = os.getenv('INGEST_STREAM', 'weather:ingest')
+INGEST_DEAD_LETTER_STREAM = os.getenv('INGEST_DEAD_LETTER_STREAM', 'weather:ingest:dead')
+INGEST_GROUP = os.getenv('INGEST_GROUP', 'weather-writers')
+INGEST_MAX_PENDING = int(os.getenv('INGEST_MAX_PENDING', 100000))
+INGEST_RETRY_AFTER = int(os.getenv('INGEST_RETRY_AFTER', 5))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 500))
+INGEST_BLOCK_MS = int(os.getenv('INGEST_BLOCK_MS', 1000))
+INGEST_MAX_RETRIES = int(os.getenv('INGEST_MAX_RETRIES', 5))
+INGEST_CLAIM_IDLE_MS = int(os.getenv('INGEST_CLAIM_IDLE_MS', 30000))
+
+# profiling, opt-in per request time breakdown in a Server-Timing header and the log
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_HEADER = os.getenv('PROFILE_HEADER', 'X-Profile')
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', None)  # when set, the profile header must carry it
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.0))
+PROFILE_TOP_FUNCTIONS = int(os.getenv('PROFILE_TOP_FUNCTIONS', 25))
+SLOW_QUERY_THRESHOLD_MS = int(os.getenv('SLOW_QUERY_THRESHOLD_MS', 500))  # 0 disables the slow query log
+
+# logging, records are queued by the request threads and written by a listener thread
+LOG_FILE = os.getenv('LOG_FILE', 'weather.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json or text
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 50 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# share of records kept per level, e.g. "DEBUG=0,INFO=0.1"; unlisted levels are all kept
+LOG_SAMPLE_RATES = {level.strip().upper(): float(rate) for level, rate in
+                    (item.split('=', 1) for item in os.getenv('LOG_SAMPLE_RATES', '').split(',') if item.strip())}
+
+# json encoding of responses and cache entries: auto (orjson when installed), orjson or stdlib
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+
+# retention and downsampling, see `flask weather retention` and `flask weather downsample`
+RETENTION_RAW_DAYS = int(os.getenv('RETENTION_RAW_DAYS', 90))
+RETENTION_ROLLUP_DAYS = int(os.getenv('RETENTION_ROLLUP_DAYS', 0))  # 0 keeps the aggregates forever
+RETENTION_DELETE_BATCH_SIZE = int(os.getenv('RETENTION_DELETE_BATCH_SIZE', 5000))
+DOWNSAMPLE_BUCKET = os.getenv('DOWNSAMPLE_BUCKET', 'hour')  # hour or day
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 3))
+
+# asgi, threads running the Flask app for the requests the async fast paths hand over
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', DB_POOL_SIZE + DB_MAX_OVERFLOW))
\ No newline at end of file
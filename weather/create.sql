@@ -1,13 +1,52 @@
 DROP TABLE IF EXISTS weather;
+DROP TABLE IF EXISTS weather_rollup;
+DROP TABLE IF EXISTS latest_weather;
 
+-- monthly RANGE partitions on created_at: `flask weather partitions` adds the upcoming months and
+-- `flask weather retention` drops expired ones. Every unique key must contain the partitioning
+-- column, hence the (id, created_at) primary key; lookups by id use its leftmost prefix.
 CREATE TABLE IF NOT EXISTS weather (
-  id integer PRIMARY KEY AUTO_INCREMENT,
+  id integer NOT NULL AUTO_INCREMENT,
   city VARCHAR(100) CHARACTER SET utf8 COLLATE utf8_unicode_ci NOT NULL,
   temperature DECIMAL(5, 2) NOT NULL,
   humidity DECIMAL(5, 2) NOT NULL,
   description VARCHAR(255) CHARACTER SET utf8 COLLATE utf8_unicode_ci NOT NULL,
   created_at datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
-  updated_at datetime on update CURRENT_TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+  updated_at datetime(6) on update CURRENT_TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  PRIMARY KEY (id, created_at),
+  INDEX idx_weather_created_at_id (created_at, id),
+  INDEX idx_weather_city_created_at (city, created_at)
+)
+PARTITION BY RANGE (TO_DAYS(created_at)) (
+  PARTITION p202408 VALUES LESS THAN (TO_DAYS('2024-09-01')),
+  PARTITION p202409 VALUES LESS THAN (TO_DAYS('2024-10-01')),
+  PARTITION p202410 VALUES LESS THAN (TO_DAYS('2024-11-01')),
+  PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- hourly aggregates per city, maintained by the app when STATS_ROLLUP_ENABLED
+CREATE TABLE IF NOT EXISTS weather_rollup (
+  city VARCHAR(100) CHARACTER SET utf8 COLLATE utf8_unicode_ci NOT NULL,
+  bucket_start datetime NOT NULL,
+  count integer NOT NULL,
+  sum_temperature DECIMAL(15, 2) NOT NULL,
+  min_temperature DECIMAL(5, 2) NOT NULL,
+  max_temperature DECIMAL(5, 2) NOT NULL,
+  sum_humidity DECIMAL(15, 2) NOT NULL,
+  min_humidity DECIMAL(5, 2) NOT NULL,
+  max_humidity DECIMAL(5, 2) NOT NULL,
+  PRIMARY KEY (city, bucket_start)
+);
+
+-- latest reading per city, maintained by the app on every write
+CREATE TABLE IF NOT EXISTS latest_weather (
+  city VARCHAR(100) CHARACTER SET utf8 COLLATE utf8_unicode_ci NOT NULL PRIMARY KEY,
+  weather_id integer NOT NULL,
+  temperature DECIMAL(5, 2) NOT NULL,
+  humidity DECIMAL(5, 2) NOT NULL,
+  description VARCHAR(255) CHARACTER SET utf8 COLLATE utf8_unicode_ci NOT NULL,
+  created_at datetime NOT NULL,
+  updated_at datetime(6) NOT NULL
 );
 
 INSERT INTO weather (
@@ -46,4 +85,21 @@ VALUES (
   'clear sky',
   '2024-08-18 12:00:05',
   '2024-08-18 12:00:05' 
-); 
\ No newline at end of file
+);
+
+-- backfill the rollup with the seed readings
+INSERT INTO weather_rollup
+SELECT city, DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00'), COUNT(*),
+       SUM(temperature), MIN(temperature), MAX(temperature),
+       SUM(humidity), MIN(humidity), MAX(humidity)
+FROM weather
+GROUP BY city, DATE_FORMAT(created_at, '%Y-%m-%d %H:00:00');
+
+-- backfill the latest reading of every city
+INSERT INTO latest_weather
+SELECT city, id, temperature, humidity, description, created_at, updated_at
+FROM (
+  SELECT weather.*, ROW_NUMBER() OVER (PARTITION BY city ORDER BY created_at DESC, id DESC) AS row_rank
+  FROM weather
+) ranked
+WHERE row_rank = 1;
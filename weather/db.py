@@ -1,14 +1,29 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Numeric
+from flask_sqlalchemy.session import Session
+from flask_sqlalchemy.pagination import SelectPagination
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Numeric, Index, and_, or_, func, select, insert, update, delete, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import mysql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.exc import SQLAlchemyError
-from datetime import datetime
-from exceptions import KeyNotExistException
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from exceptions import KeyNotExistException, PreconditionFailedException
+from config import STATS_ROLLUP_ENABLED
+from replicas import replica_router
 from flask import current_app as app
 
+class RoutingSession(Session):
+    # reads of GET requests go to a replica, flushes and DML statements to the primary
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, 'is_dml', False):
+            engine = replica_router.engine_for_reads()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 Base = declarative_base()
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 
 class weather(Base):
     __tablename__ = 'weather'
@@ -19,7 +34,15 @@ class weather(Base):
     humidity = Column(Numeric(5,2), nullable=False)
     description = Column(String(255), nullable=False)
     created_at = Column(DateTime, default=datetime.now)
-    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # microseconds so the ETag derived from updated_at changes on every update
+    updated_at = Column(DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql'), default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        # seek index for keyset pagination ordered by created_at
+        Index('idx_weather_created_at_id', 'created_at', 'id'),
+        # readings of one city over a time range
+        Index('idx_weather_city_created_at', 'city', 'created_at'),
+    )
 
     def to_dict(self):
         return {
@@ -31,11 +54,73 @@ class weather(Base):
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
             'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S')
         }
+
+# lean read path: listings select plain rows of the weather columns, skipping ORM instances,
+# the identity map and attribute instrumentation
+weather_rows = select(*weather.__table__.c)
+
+def weather_row_to_dict(row):
+    # same JSON as weather.to_dict(): Decimals are encoded as their str() by the JSON provider
+    # anyway, and isoformat matches '%Y-%m-%d %H:%M:%S' for naive datetimes at a fraction of the cost
+    id, city, temperature, humidity, description, created_at, updated_at = row
+    return {
+        'id': id,
+        'city': city,
+        'temperature': str(temperature),
+        'humidity': str(humidity),
+        'description': description,
+        'created_at': created_at.isoformat(' ', 'seconds'),
+        'updated_at': updated_at.isoformat(' ', 'seconds')
+    }
+
+class RowPagination(SelectPagination):
+    # SelectPagination returns scalars, i.e. the first column of each row only
+    def _query_items(self):
+        select = self._query_args['select'].limit(self.per_page).offset(self._query_offset)
+        return self._query_args['session'].execute(select).all()
+
+class weather_rollup(Base):
+    # hourly aggregates per city, maintained on every write when STATS_ROLLUP_ENABLED
+    __tablename__ = 'weather_rollup'
+    
+    city = Column(String(100), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False)
+    sum_temperature = Column(Numeric(15,2), nullable=False)
+    min_temperature = Column(Numeric(5,2), nullable=False)
+    max_temperature = Column(Numeric(5,2), nullable=False)
+    sum_humidity = Column(Numeric(15,2), nullable=False)
+    min_humidity = Column(Numeric(5,2), nullable=False)
+    max_humidity = Column(Numeric(5,2), nullable=False)
+    
+class latest_weather(Base):
+    # latest reading per city, a copy of its weather row kept up to date on every write so
+    # "current weather of a city" is a primary key lookup
+    __tablename__ = 'latest_weather'
+    
+    city = Column(String(100), primary_key=True)
+    weather_id = Column(Integer, nullable=False)
+    temperature = Column(Numeric(5,2), nullable=False)
+    humidity = Column(Numeric(5,2), nullable=False)
+    description = Column(String(255), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql'), nullable=False)
+    
+    @property
+    def id(self):
+        return self.weather_id
+    
+    def to_dict(self):
+        return weather.to_dict(self)
     
 def db_add_weather(city, temperature, humidity, description):
     try:
         new_weather = weather(city=city, temperature=temperature, humidity=humidity, description=description)
         db.session.add(new_weather)
+        db.session.flush()
+        latest_add_weathers([new_weather])
+        if STATS_ROLLUP_ENABLED:
+            rollup_add_weather(new_weather)
         db.session.commit()
         return new_weather
     except SQLAlchemyError as e:
@@ -43,28 +128,169 @@ def db_add_weather(city, temperature, humidity, description):
         app.logger.error(f"Error in adding weather to db: {e}")
         return None
 
+def db_add_weathers(weathers, batch_size):
+    # executemany INSERT per batch, all batches committed in a single transaction, returns the new ids
+    try:
+        first_bucket = hour_bucket(datetime.now())
+        returning = db.session.get_bind().dialect.insert_executemany_returning
+        if not returning:
+            # without RETURNING the new ids are the ones above the current max, which may
+            # include rows of concurrent writers; callers only use them to drop cache entries
+            last_id = db.session.scalar(select(func.max(weather.id))) or 0
+        ids = []
+        for start in range(0, len(weathers), batch_size):
+            if returning:
+                ids.extend(db.session.scalars(insert(weather).returning(weather.id), weathers[start:start + batch_size]))
+            else:
+                db.session.execute(insert(weather), weathers[start:start + batch_size])
+        if not returning:
+            ids = db.session.scalars(select(weather.id).where(weather.id > last_id).order_by(weather.id)).all()
+        # seek the newest row of every city
+        latest_add_weathers(filter(None, (newest_weather(city) for city in {w['city'] for w in weathers})))
+        if STATS_ROLLUP_ENABLED:
+            # rows without created_at were stamped between the first and the last bucket
+            buckets = {first_bucket, hour_bucket(datetime.now())}
+            refresh = set()
+            for w in weathers:
+                if w.get('created_at'):
+                    refresh.add((w['city'], hour_bucket(w['created_at'])))
+                else:
+                    refresh.update((w['city'], bucket_start) for bucket_start in buckets)
+            for city, bucket_start in refresh:
+                rollup_refresh_bucket(city, bucket_start)
+        db.session.commit()
+        return ids
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Error in bulk adding weathers to db: {e}")
+        return e
+
 def db_get_all_weathers():
-    return weather.query.all()
+    return db.session.execute(weather_rows).all()
+
+def db_iter_weathers(batch_size, filters=None, sort=None, limit=None):
+    # server-side cursor: rows are fetched batch_size at a time
+    query = weather_rows.where(*weather_filter_clauses(filters or {})).order_by(*weather_order_by(sort))
+    if limit is not None:
+        query = query.limit(limit)
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    for row in result:
+        yield row
+
+def db_query_weathers(filters, sort=None, limit=None):
+    query = weather_rows.where(*weather_filter_clauses(filters)).order_by(*weather_order_by(sort))
+    if limit is not None:
+        query = query.limit(limit)
+    return db.session.execute(query).all()
+
+# columns a listing can be sorted by
+SORTABLE_COLUMNS = ('id', 'city', 'temperature', 'humidity', 'created_at', 'updated_at')
+
+# columns a PATCH can set, updated_at follows every update and the others are fixed
+UPDATABLE_COLUMNS = ('city', 'temperature', 'humidity', 'description')
+
+# column limits of a reading, checked per item so one bad item doesn't fail a whole bulk INSERT
+STRING_LENGTHS = {column.name: column.type.length for column in weather.__table__.c if isinstance(column.type, String)}
+# (scale, exclusive bound of the absolute value) of the DECIMAL columns
+DECIMAL_LIMITS = {column.name: (column.type.scale, Decimal(10) ** (column.type.precision - column.type.scale))
+                  for column in weather.__table__.c if isinstance(column.type, Numeric)}
+
+def weather_filter_clauses(filters):
+    # filters is a dict of already parsed values, keyed by query parameter
+    clauses = []
+    if 'city' in filters:
+        clauses.append(weather.city == filters['city'])
+    if 'from' in filters:
+        clauses.append(weather.created_at >= filters['from'])
+    if 'to' in filters:
+        clauses.append(weather.created_at <= filters['to'])
+    for column in ('temperature', 'humidity'):
+        if f'min_{column}' in filters:
+            clauses.append(getattr(weather, column) >= filters[f'min_{column}'])
+        if f'max_{column}' in filters:
+            clauses.append(getattr(weather, column) <= filters[f'max_{column}'])
+    return clauses
+
+def weather_order_by(sort):
+    # sort is a list of (column, descending) pairs, id breaks ties
+    order_by = []
+    for column, descending in sort or []:
+        order_by.append(getattr(weather, column).desc() if descending else getattr(weather, column))
+    if not any(column == 'id' for column, _ in sort or []):
+        order_by.append(weather.id)
+    return order_by
 
 def db_get_all_weathers_paging(page, limit):
-    return weather.query.paginate(page=page, per_page=limit, error_out=False)
+    return RowPagination(select=weather_rows, session=db.session(), page=page, per_page=limit, max_per_page=None, error_out=False)
+
+def db_get_all_weathers_by_cursor(limit, order_by='id', after=None):
+    # keyset pagination: seek past the last row of the previous page instead of OFFSET
+    query = weather_rows
+    if order_by == 'created_at':
+        if after is not None:
+            created_at, last_id = after
+            query = query.where(and_(weather.created_at >= created_at,
+                                     or_(weather.created_at > created_at, weather.id > last_id)))
+        query = query.order_by(weather.created_at, weather.id)
+    else:
+        if after is not None:
+            query = query.where(weather.id > after)
+        query = query.order_by(weather.id)
+    # fetch one extra row to know if there is a next page
+    weathers = db.session.execute(query.limit(limit + 1)).all()
+    return weathers[:limit], len(weathers) > limit
+
+def db_count_weathers():
+    return db.session.query(func.count(weather.id)).scalar()
 
 def db_get_weather(id):
     return weather.query.get(id)
 
-def db_update_weather(id, **kwargs):
+def db_get_weathers(ids):
+    # one IN query, rows come back in no particular order
+    return db.session.query(weather).filter(weather.id.in_(ids)).all()
+
+def db_update_weather(id, values, expected_updated_at=None):
+    # one UPDATE ... WHERE id, with RETURNING where the database has it and a fetch of the row
+    # otherwise. expected_updated_at lists the updated_at values the caller read (If-Match),
+    # the row is only updated if it still has one of them, so concurrent updates aren't lost
+    for key in values:
+        if key not in UPDATABLE_COLUMNS:
+            app.logger.error(f"Invalid key in update weather: {key}")
+            return KeyNotExistException(key)
     try:
-        w = weather.query.get(id)
-        if w:
-            for key, value in kwargs.items():
-                if hasattr(w, key):
-                    setattr(w, key, value)
-                else:
-                    app.logger.error(f"Invalid key in update weather: {key}")
-                    return KeyNotExistException(key)
-            db.session.commit()
-            return w
-        return None
+        old_city = None
+        if 'city' in values:
+            # the row leaves its city, whose latest reading and rollup have to be refreshed
+            old_city = db.session.scalar(select(weather.city).where(weather.id == id).with_for_update())
+        statement = update(weather).where(weather.id == id).values(**values).execution_options(synchronize_session=False)
+        if expected_updated_at is not None:
+            statement = statement.where(weather.updated_at.in_(expected_updated_at))
+        if db.session.get_bind().dialect.update_returning:
+            row = db.session.execute(statement.returning(*weather.__table__.c)).first()
+        else:
+            row = None
+            if db.session.execute(statement).rowcount:
+                row = db.session.execute(weather_rows.where(weather.id == id)).first()
+        if row is None:
+            db.session.rollback()
+            if expected_updated_at is not None and db.session.scalar(select(weather.id).where(weather.id == id)) is not None:
+                return PreconditionFailedException(id)
+            return None
+        
+        if old_city is not None and old_city != row.city:
+            for city in (old_city, row.city):
+                latest_refresh_city(city)
+        else:
+            # only a copy of the row itself can be out of date
+            db.session.execute(update(latest_weather).where(latest_weather.city == row.city, latest_weather.weather_id == id)
+                               .values(**{key: value for key, value in latest_values(row).items() if key != 'city'}))
+        if STATS_ROLLUP_ENABLED and values.keys() & {'city', 'temperature', 'humidity'}:
+            for city in {old_city or row.city, row.city}:
+                rollup_refresh_bucket(city, hour_bucket(row.created_at))
+        db.session.commit()
+        # detached instance, for to_dict and the validators of the response
+        return weather(**row._mapping)
     except SQLAlchemyError as e:
         db.session.rollback()
         app.logger.error(f"Error in updating weather in db: {e}")
@@ -73,8 +299,419 @@ def db_update_weather(id, **kwargs):
 def db_delete_weather(id):
     w = weather.query.get(id)
     if w:
+        city, bucket_start = w.city, hour_bucket(w.created_at)
         db.session.delete(w)
+        db.session.flush()
+        latest_refresh_city(city)
+        if STATS_ROLLUP_ENABLED:
+            rollup_refresh_bucket(city, bucket_start)
         db.session.commit()
         return True
     app.logger.info(f"Delete weather with id {id} not found")
-    return False
\ No newline at end of file
+    return False
+
+def db_update_weathers(values, ids=None, filters=None):
+    # one UPDATE ... WHERE for the weathers of the ids or matching the filters, returns
+    # (updated count, updated ids) so the caller can drop their cache entries
+    try:
+        clauses = weather_selection_clauses(ids, filters)
+        targets = lock_weathers(clauses)
+        if not targets:
+            return 0, []
+        # updated_at is set by its onupdate default, as for single updates
+        updated = db.session.execute(update(weather).where(*clauses).values(**values)
+                                     .execution_options(synchronize_session=False)).rowcount
+        refresh_after_bulk_write(targets, values.get('city'))
+        db.session.commit()
+        return updated, [id for id, _, _ in targets]
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Error in bulk updating weathers in db: {e}")
+        return e
+
+def db_delete_weathers(ids=None, filters=None):
+    # one DELETE ... WHERE, returns (deleted count, deleted ids)
+    try:
+        clauses = weather_selection_clauses(ids, filters)
+        targets = lock_weathers(clauses)
+        if not targets:
+            return 0, []
+        deleted = db.session.execute(delete(weather).where(*clauses)
+                                     .execution_options(synchronize_session=False)).rowcount
+        refresh_after_bulk_write(targets)
+        db.session.commit()
+        return deleted, [id for id, _, _ in targets]
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Error in bulk deleting weathers in db: {e}")
+        return e
+
+def weather_selection_clauses(ids, filters):
+    if ids is not None:
+        return [weather.id.in_(ids)]
+    return weather_filter_clauses(filters)
+
+def lock_weathers(clauses):
+    # (id, city, created_at) of the target rows, locked so the UPDATE/DELETE hits the same set
+    return db.session.execute(select(weather.id, weather.city, weather.created_at)
+                              .where(*clauses).with_for_update()).all()
+
+def refresh_after_bulk_write(targets, new_city=None):
+    # latest_weather and rollup rows of the cities the targets were in or moved to
+    cities = {city for _, city, _ in targets} | ({new_city} if new_city is not None else set())
+    for city in cities:
+        latest_refresh_city(city)
+    if STATS_ROLLUP_ENABLED:
+        buckets = {(city, hour_bucket(created_at)) for _, city, created_at in targets}
+        if new_city is not None:
+            buckets |= {(new_city, bucket_start) for _, bucket_start in buckets}
+        for city, bucket_start in buckets:
+            rollup_refresh_bucket(city, bucket_start)
+
+def db_get_latest_weathers():
+    return db.session.query(latest_weather).order_by(latest_weather.city).all()
+
+def db_get_latest_weather(city):
+    return db.session.get(latest_weather, city)
+
+def db_get_weather_stats(filters, bucket=None):
+    # min/max/avg per city, and per time bucket when asked, computed by the database
+    rollup_filters = set(filters) <= {'city', 'from', 'to'}
+    if STATS_ROLLUP_ENABLED and rollup_filters:
+        rows = query_rollup_stats(filters, bucket)
+    else:
+        rows = query_raw_stats(filters, bucket)
+    stats = []
+    for row in rows:
+        stat = {'city': row.city}
+        if bucket:
+            stat['bucket'] = row.bucket
+        stat.update({
+            'count': row.count,
+            'min_temperature': round_stat(row.min_temperature),
+            'max_temperature': round_stat(row.max_temperature),
+            'avg_temperature': round_stat(row.avg_temperature),
+            'min_humidity': round_stat(row.min_humidity),
+            'max_humidity': round_stat(row.max_humidity),
+            'avg_humidity': round_stat(row.avg_humidity)
+        })
+        stats.append(stat)
+    return stats
+
+def query_raw_stats(filters, bucket):
+    group_by = [weather.city]
+    if bucket:
+        group_by.append(time_bucket(weather.created_at, bucket).label('bucket'))
+    return db.session.query(
+        *group_by,
+        func.count(weather.id).label('count'),
+        func.min(weather.temperature).label('min_temperature'),
+        func.max(weather.temperature).label('max_temperature'),
+        func.avg(weather.temperature).label('avg_temperature'),
+        func.min(weather.humidity).label('min_humidity'),
+        func.max(weather.humidity).label('max_humidity'),
+        func.avg(weather.humidity).label('avg_humidity')
+    ).filter(*weather_filter_clauses(filters)).group_by(*group_by).order_by(*group_by).all()
+
+def query_rollup_stats(filters, bucket):
+    # the rollup has an hourly resolution, from/to are applied to whole hours
+    clauses = []
+    if 'city' in filters:
+        clauses.append(weather_rollup.city == filters['city'])
+    if 'from' in filters:
+        clauses.append(weather_rollup.bucket_start >= hour_bucket(filters['from']))
+    if 'to' in filters:
+        clauses.append(weather_rollup.bucket_start <= filters['to'])
+    group_by = [weather_rollup.city]
+    if bucket:
+        group_by.append(time_bucket(weather_rollup.bucket_start, bucket).label('bucket'))
+    count = func.sum(weather_rollup.count)
+    return db.session.query(
+        *group_by,
+        count.label('count'),
+        func.min(weather_rollup.min_temperature).label('min_temperature'),
+        func.max(weather_rollup.max_temperature).label('max_temperature'),
+        (func.sum(weather_rollup.sum_temperature) / count).label('avg_temperature'),
+        func.min(weather_rollup.min_humidity).label('min_humidity'),
+        func.max(weather_rollup.max_humidity).label('max_humidity'),
+        (func.sum(weather_rollup.sum_humidity) / count).label('avg_humidity')
+    ).filter(*clauses).group_by(*group_by).order_by(*group_by).all()
+
+def db_rebuild_weather_rollup():
+    # backfill the rollup from raw rows, e.g. right after enabling STATS_ROLLUP_ENABLED; rows of
+    # the days before the oldest raw reading hold expired readings and are kept
+    try:
+        oldest = db.session.scalar(select(func.min(weather.created_at)))
+        if oldest is None:
+            return True
+        db.session.query(weather_rollup).filter(weather_rollup.bucket_start >= day_bucket(oldest)).delete()
+        buckets = db.session.query(weather.city, weather.created_at).all()
+        for city, bucket_start in {(city, hour_bucket(created_at)) for city, created_at in buckets}:
+            rollup_refresh_bucket(city, bucket_start)
+        db.session.commit()
+        return True
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Error in rebuilding weather rollup: {e}")
+        return e
+
+def db_downsample_weathers(before, bucket='hour'):
+    # compact the readings of the whole days before `before` into weather_rollup, one row per
+    # city and hour or per city and day; the raw rows are left to db_expire_weathers
+    try:
+        before = day_bucket(before)
+        raw_days = {parse_bucket(day) for (day,) in db.session.query(time_bucket(weather.created_at, 'day'))
+                    .filter(weather.created_at < before).distinct()}
+        days = set(raw_days)
+        if bucket == 'day':
+            # days whose raw rows already expired are collapsed from their hourly rollup rows
+            days.update(parse_bucket(day) for (day,) in db.session.query(time_bucket(weather_rollup.bucket_start, 'day'))
+                        .filter(weather_rollup.bucket_start < before).distinct())
+        for day in sorted(days):
+            if day in raw_days:
+                rows = raw_day_aggregates(day, bucket)
+            else:
+                rows = rollup_day_aggregates(day)
+            # one transaction per day keeps locks and undo log small on large tables
+            db.session.query(weather_rollup).filter(weather_rollup.bucket_start >= day,
+                                                    weather_rollup.bucket_start < day + timedelta(days=1)).delete()
+            db.session.add_all(weather_rollup(city=row[0], bucket_start=row[1], count=row[2],
+                                              sum_temperature=row[3], min_temperature=row[4], max_temperature=row[5],
+                                              sum_humidity=row[6], min_humidity=row[7], max_humidity=row[8]) for row in rows)
+            db.session.commit()
+        return len(days)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Error in downsampling weathers: {e}")
+        return e
+
+def raw_day_aggregates(day, bucket):
+    # the raw rows of a day are complete until they expire, so the day is rebuilt from them
+    bucket_start = time_bucket(weather.created_at, bucket)
+    rows = db.session.query(
+        weather.city, bucket_start, func.count(weather.id),
+        func.sum(weather.temperature), func.min(weather.temperature), func.max(weather.temperature),
+        func.sum(weather.humidity), func.min(weather.humidity), func.max(weather.humidity)
+    ).filter(weather.created_at >= day,
+             weather.created_at < day + timedelta(days=1)).group_by(weather.city, bucket_start).all()
+    return [(row[0], parse_bucket(row[1]), *row[2:]) for row in rows]
+
+def rollup_day_aggregates(day):
+    rows = db.session.query(
+        weather_rollup.city, func.sum(weather_rollup.count),
+        func.sum(weather_rollup.sum_temperature), func.min(weather_rollup.min_temperature), func.max(weather_rollup.max_temperature),
+        func.sum(weather_rollup.sum_humidity), func.min(weather_rollup.min_humidity), func.max(weather_rollup.max_humidity)
+    ).filter(weather_rollup.bucket_start >= day,
+             weather_rollup.bucket_start < day + timedelta(days=1)).group_by(weather_rollup.city).all()
+    return [(row[0], day, *row[1:]) for row in rows]
+
+def db_expire_weathers(before, batch_size, on_deleted=None):
+    # delete the raw rows of the whole days before `before`, returns (dropped partitions, deleted rows);
+    # on_deleted gets the ids of every deleted batch, the rows of a dropped partition are not read
+    try:
+        before = day_bucket(before)
+        dropped = []
+        if db.session.get_bind().dialect.name == 'mysql':
+            # a partition entirely before the cutoff is dropped at once, without a row by row delete
+            dropped = [name for name, bound in weather_partitions() if bound is not None and bound <= before.date()]
+            if dropped:
+                db.session.execute(text(f"ALTER TABLE weather DROP PARTITION {', '.join(dropped)}"))
+        deleted = 0
+        while True:
+            # short batches, MySQL can't DELETE with a LIMIT subquery so the ids are fetched first
+            ids = db.session.scalars(select(weather.id).where(weather.created_at < before).limit(batch_size)).all()
+            if not ids:
+                break
+            deleted += db.session.execute(delete(weather).where(weather.id.in_(ids))).rowcount
+            db.session.commit()
+            if on_deleted is not None:
+                on_deleted(ids)
+        # a city whose latest reading expired has no reading left
+        db.session.query(latest_weather).filter(latest_weather.created_at < before).delete()
+        db.session.commit()
+        return dropped, deleted
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Error in expiring weathers: {e}")
+        return e
+
+def db_expire_weather_rollup(before):
+    try:
+        deleted = db.session.query(weather_rollup).filter(weather_rollup.bucket_start < day_bucket(before)).delete()
+        db.session.commit()
+        return deleted
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Error in expiring weather rollup: {e}")
+        return e
+
+def db_add_weather_partitions(until):
+    # split the catch-all pmax partition so every month up to `until` gets its own partition,
+    # returns the names of the new partitions or None when weather is not partitioned
+    try:
+        if db.session.get_bind().dialect.name != 'mysql':
+            return None
+        partitions = weather_partitions()
+        if not partitions or partitions[-1][1] is not None:
+            return None
+        bound = partitions[-2][1] if len(partitions) > 1 else month_start(date.today())
+        added = []
+        while bound <= until:
+            # pYYYYMM holds the readings of that month
+            added.append((f'p{bound:%Y%m}', next_month(bound)))
+            bound = next_month(bound)
+        if added:
+            definitions = ', '.join(f"PARTITION {name} VALUES LESS THAN (TO_DAYS('{upper}'))" for name, upper in added)
+            db.session.execute(text(f"ALTER TABLE weather REORGANIZE PARTITION pmax INTO ({definitions}, PARTITION pmax VALUES LESS THAN MAXVALUE)"))
+        return [name for name, _ in added]
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Error in adding weather partitions: {e}")
+        return e
+
+def weather_partitions():
+    # (name, exclusive upper bound) of the RANGE partitions of weather, oldest first, None bounds pmax
+    rows = db.session.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'weather' AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION")).all()
+    # the bounds are TO_DAYS values, day 366 is 0001-01-01
+    return [(name, None if bound == 'MAXVALUE' else date.fromordinal(int(bound) - 365)) for name, bound in rows]
+
+def db_rebuild_latest_weather():
+    # backfill latest_weather from raw rows, e.g. right after creating the table
+    try:
+        db.session.query(latest_weather).delete()
+        for (city,) in db.session.query(weather.city).distinct().all():
+            latest_refresh_city(city)
+        db.session.commit()
+        return True
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"Error in rebuilding latest weather: {e}")
+        return e
+
+def latest_add_weathers(weathers):
+    # upsert that only replaces older readings, safe against concurrent writers of the same city
+    values = [latest_values(w) for w in weathers]
+    if not values:
+        return
+    table = latest_weather.__table__
+    if db.session.get_bind().dialect.name == 'mysql':
+        statement = mysql.insert(table).values(values)
+        new = statement.inserted
+        newer = latest_newer(table, new)
+        # assignments run left to right and see the columns already updated, so weather_id and
+        # created_at, which the condition reads, come last
+        updates = [(column, func.if_(newer, new[column], table.c[column]))
+                   for column in ('temperature', 'humidity', 'description', 'updated_at', 'weather_id', 'created_at')]
+        db.session.execute(statement.on_duplicate_key_update(updates))
+    else:
+        statement = sqlite.insert(table).values(values)
+        new = statement.excluded
+        db.session.execute(statement.on_conflict_do_update(index_elements=['city'], set_={column: new[column] for column in values[0] if column != 'city'},
+                                                           where=latest_newer(table, new)))
+
+def latest_newer(table, new):
+    return or_(new.created_at > table.c.created_at,
+               and_(new.created_at == table.c.created_at, new.weather_id > table.c.weather_id))
+
+def latest_refresh_city(city):
+    # the latest reading may have been updated or deleted, look it up again
+    db.session.query(latest_weather).filter_by(city=city).delete()
+    w = newest_weather(city)
+    if w is not None:
+        db.session.execute(insert(latest_weather), [latest_values(w)])
+
+def newest_weather(city):
+    # index seek on idx_weather_city_created_at
+    return db.session.execute(weather_rows.where(weather.city == city)
+                              .order_by(weather.created_at.desc(), weather.id.desc()).limit(1)).first()
+
+def latest_values(w):
+    return {
+        'city': w.city,
+        'weather_id': w.id,
+        'temperature': w.temperature,
+        'humidity': w.humidity,
+        'description': w.description,
+        'created_at': w.created_at,
+        'updated_at': w.updated_at
+    }
+
+def rollup_add_weather(w):
+    # incremental upsert, safe against concurrent writers of the same bucket
+    values = {
+        'city': w.city,
+        'bucket_start': hour_bucket(w.created_at),
+        'count': 1,
+        'sum_temperature': w.temperature,
+        'min_temperature': w.temperature,
+        'max_temperature': w.temperature,
+        'sum_humidity': w.humidity,
+        'min_humidity': w.humidity,
+        'max_humidity': w.humidity
+    }
+    table = weather_rollup.__table__
+    if db.session.get_bind().dialect.name == 'mysql':
+        statement = mysql.insert(table).values(**values)
+        new, least, greatest = statement.inserted, func.least, func.greatest
+        db.session.execute(statement.on_duplicate_key_update(**rollup_merge(table, new, least, greatest)))
+    else:
+        statement = sqlite.insert(table).values(**values)
+        new, least, greatest = statement.excluded, func.min, func.max
+        db.session.execute(statement.on_conflict_do_update(index_elements=['city', 'bucket_start'], set_=rollup_merge(table, new, least, greatest)))
+
+def rollup_merge(table, new, least, greatest):
+    return {
+        'count': table.c.count + new.count,
+        'sum_temperature': table.c.sum_temperature + new.sum_temperature,
+        'min_temperature': least(table.c.min_temperature, new.min_temperature),
+        'max_temperature': greatest(table.c.max_temperature, new.max_temperature),
+        'sum_humidity': table.c.sum_humidity + new.sum_humidity,
+        'min_humidity': least(table.c.min_humidity, new.min_humidity),
+        'max_humidity': greatest(table.c.max_humidity, new.max_humidity)
+    }
+
+def rollup_refresh_bucket(city, bucket_start):
+    # min/max cannot be decremented, recompute the whole bucket from its raw rows
+    row = db.session.query(
+        func.count(weather.id),
+        func.sum(weather.temperature), func.min(weather.temperature), func.max(weather.temperature),
+        func.sum(weather.humidity), func.min(weather.humidity), func.max(weather.humidity)
+    ).filter(weather.city == city,
+             weather.created_at >= bucket_start,
+             weather.created_at < bucket_start + timedelta(hours=1)).one()
+    db.session.query(weather_rollup).filter_by(city=city, bucket_start=bucket_start).delete()
+    if row[0]:
+        db.session.add(weather_rollup(city=city, bucket_start=bucket_start, count=row[0],
+                                      sum_temperature=row[1], min_temperature=row[2], max_temperature=row[3],
+                                      sum_humidity=row[4], min_humidity=row[5], max_humidity=row[6]))
+        db.session.flush()
+
+def hour_bucket(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def day_bucket(value):
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def parse_bucket(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+def month_start(value):
+    return value.replace(day=1)
+
+def next_month(value):
+    return (value.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+def time_bucket(column, bucket):
+    # bucket label as 'YYYY-mm-dd HH:00:00', both MySQL and SQLite share the strftime codes used here
+    fmt = '%Y-%m-%d %H:00:00' if bucket == 'hour' else '%Y-%m-%d 00:00:00'
+    if db.session.get_bind().dialect.name == 'mysql':
+        return func.date_format(column, fmt)
+    return func.strftime(fmt, column)
+
+def round_stat(value):
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(Decimal('0.01'))
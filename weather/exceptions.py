@@ -2,4 +2,9 @@ class KeyNotExistException(Exception):
     def __init__(self, key):
         self.key = key
         self.message = f"Invalid key: {key}"
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+class PreconditionFailedException(Exception):
+    def __init__(self, id):
+        self.id = id
+        self.message = f"weather id: {id} was modified since it was read"
+        super().__init__(self.message)
@@ -0,0 +1,15 @@
+import os
+import shutil
+
+# gunicorn loads ./gunicorn.conf.py before the workers import the app, so prometheus_client
+# of every worker writes its samples to the shared directory
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/weather-metrics')
+
+def on_starting(server):
+    # samples of a previous run would be added to this one
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,135 @@
+from flask import current_app as app
+from redis.exceptions import RedisError, ResponseError
+from datetime import datetime
+import json
+import os
+import socket
+import time
+
+from cache import redis
+from db import db_add_weathers
+from config import INGEST_STREAM, INGEST_DEAD_LETTER_STREAM, INGEST_GROUP, INGEST_MAX_PENDING, INGEST_BATCH_SIZE, INGEST_BLOCK_MS, INGEST_MAX_RETRIES, INGEST_CLAIM_IDLE_MS
+
+INGEST_FIELDS = ('city', 'temperature', 'humidity', 'description')
+
+def ingest_weather(reading):
+    # queue a validated reading, returns the stream entry id as token, None when the queue is full
+    if redis.xlen(INGEST_STREAM) >= INGEST_MAX_PENDING:
+        return None
+    entry = {param: reading[param] for param in INGEST_FIELDS}
+    # stamp the reading when it is accepted, not when the consumer gets to it
+    entry['created_at'] = datetime.now().isoformat()
+    return redis.xadd(INGEST_STREAM, {'weather': json.dumps(entry)})
+
+def consumer_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+class IngestConsumer:
+    """
+    Drains the ingest stream into the weather table. Entries are read through a consumer
+    group and written with one multi-row INSERT per batch; an entry is acknowledged and
+    deleted only once its row is committed, so a crashed consumer loses nothing.
+
+    Entries of a failed write stay pending and are claimed again after claim_idle_ms, by
+    this or any other consumer. An entry delivered more than max_retries times, or one that
+    can't be decoded, is moved to the dead-letter stream.
+
+    on_written is called with the ids of the new weather rows after every written batch.
+    """
+    def __init__(self, redis, name, on_written=None, stream=INGEST_STREAM, group=INGEST_GROUP, dead_letter_stream=INGEST_DEAD_LETTER_STREAM, batch_size=INGEST_BATCH_SIZE, block_ms=INGEST_BLOCK_MS, max_retries=INGEST_MAX_RETRIES, claim_idle_ms=INGEST_CLAIM_IDLE_MS):
+        self.redis = redis
+        self.name = name
+        self.on_written = on_written
+        self.stream = stream
+        self.group = group
+        self.dead_letter_stream = dead_letter_stream
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.max_retries = max_retries
+        self.claim_idle_ms = claim_idle_ms
+
+    def ensure_group(self):
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def run(self, should_stop=lambda: False):
+        self.ensure_group()
+        while not should_stop():
+            try:
+                self.process_batch()
+            except RedisError as e:
+                app.logger.error(f"Error in consuming ingested weathers: {e}")
+                time.sleep(1)
+
+    def process_batch(self):
+        # retries first, so failed entries are not starved by a steady flow of new ones
+        entries = self.claim_stale() or self.read_new()
+        if not entries:
+            return 0
+
+        ids, weathers = [], []
+        for entry_id, fields in entries:
+            try:
+                weather = json.loads(fields['weather'])
+                weather['created_at'] = datetime.fromisoformat(weather['created_at'])
+            except (KeyError, TypeError, ValueError):
+                self.dead_letter(entry_id, fields, 'undecodable entry')
+                continue
+            ids.append(entry_id)
+            weathers.append(weather)
+        if not weathers:
+            return 0
+
+        weather_ids = db_add_weathers(weathers, self.batch_size)
+        if isinstance(weather_ids, Exception):
+            # one row per INSERT, so a bad reading doesn't hold back the rest of the batch
+            written_ids, weather_ids = [], []
+            for entry_id, weather in zip(ids, weathers):
+                result = db_add_weathers([weather], 1)
+                if not isinstance(result, Exception):
+                    written_ids.append(entry_id)
+                    weather_ids.extend(result)
+        else:
+            written_ids = ids
+        if not written_ids:
+            return 0
+
+        self.acknowledge(written_ids)
+        if self.on_written is not None:
+            self.on_written(weather_ids)
+        return len(written_ids)
+
+    def read_new(self):
+        response = self.redis.xreadgroup(self.group, self.name, {self.stream: '>'}, count=self.batch_size, block=self.block_ms)
+        return response[0][1] if response else []
+
+    def claim_stale(self):
+        entries = self.redis.xautoclaim(self.stream, self.group, self.name, min_idle_time=self.claim_idle_ms, start_id='0-0', count=self.batch_size)[1]
+        if not entries:
+            return entries
+
+        pending = self.redis.xpending_range(self.stream, self.group, min=entries[0][0], max=entries[-1][0], count=len(entries))
+        deliveries = {p['message_id']: p['times_delivered'] for p in pending}
+        retries = []
+        for entry_id, fields in entries:
+            # the claim itself counts as a delivery
+            if deliveries.get(entry_id, 0) > self.max_retries + 1:
+                self.dead_letter(entry_id, fields, f'failed after {self.max_retries} retries')
+            else:
+                retries.append((entry_id, fields))
+        return retries
+
+    def dead_letter(self, entry_id, fields, error):
+        app.logger.error(f"Ingested weather {entry_id} moved to {self.dead_letter_stream}: {error}")
+        self.redis.xadd(self.dead_letter_stream, dict(fields, id=entry_id, error=error))
+        self.acknowledge([entry_id])
+
+    def acknowledge(self, ids):
+        # delete as well, the stream length is what backpressure is measured on
+        pipe = self.redis.pipeline()
+        pipe.xack(self.stream, self.group, *ids)
+        pipe.xdel(self.stream, *ids)
+        pipe.execute()
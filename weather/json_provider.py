@@ -0,0 +1,69 @@
+from flask.json.provider import DefaultJSONProvider
+from flasgger import LazyString
+import logging
+import re
+
+from config import JSON_BACKEND
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+class JSONProvider(DefaultJSONProvider):
+    # the stdlib provider of Flask, also encoding flasgger's lazy strings
+    @staticmethod
+    def default(o):
+        if isinstance(o, LazyString):
+            return str(o)
+        return DefaultJSONProvider.default(o)
+
+# float exponents, which the stdlib writes as 1e+16 and 1e-05 where orjson writes 1e16 and 0.00001
+_EXPONENT = re.compile(rb'e[-+\d]')
+
+def stdlib_may_differ(out):
+    # separate scans, one regex with alternatives is an order of magnitude slower on large
+    # bodies; a false positive, e.g. in text, only costs a stdlib encoding. null is also how
+    # orjson writes NaN and Infinity
+    return b'null' in out or b'0.0000' in out or _EXPONENT.search(out) is not None
+
+class OrjsonJSONProvider(JSONProvider):
+    """
+    Encodes with orjson where its bytes are identical to the stdlib ones, with the stdlib
+    provider otherwise.
+
+    orjson only writes the compact form of jsonify, so calls asking for the default
+    separators or an indent go to the stdlib, as does anything orjson rejects (non-str keys,
+    integers beyond 64 bits, types only `default` knows). Output with non-ASCII text, which
+    the stdlib escapes, or that `stdlib_may_differ` is encoded again by the stdlib.
+    """
+    def dumps(self, obj, **kwargs):
+        if kwargs == {'separators': (',', ':')}:
+            option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            try:
+                out = orjson.dumps(obj, default=self.default, option=option)
+            except TypeError:
+                out = None
+            if out is not None and (out.isascii() or not self.ensure_ascii) and not stdlib_may_differ(out):
+                return out.decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                # e.g. NaN literals or integers beyond 64 bits, which the stdlib accepts
+                pass
+        return super().loads(s, **kwargs)
+
+def json_provider_class(backend=JSON_BACKEND):
+    if backend in ('auto', 'orjson') and orjson is not None:
+        return OrjsonJSONProvider
+    if backend == 'orjson':
+        logger.warning("JSON_BACKEND is orjson but orjson is not installed, using the stdlib")
+    return JSONProvider
@@ -0,0 +1,110 @@
+from flask import g, has_request_context, request
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from datetime import datetime, timezone
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import uuid
+
+from config import LOG_FILE, LOG_FORMAT, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None)
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # formatted by DroppingQueueHandler.prepare before the record was queued
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class RequestIdFilter(logging.Filter):
+    # runs on the request thread, the listener thread has no request context
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+class SamplingFilter(logging.Filter):
+    # keeps a share of the records of a level, for high volume messages such as cache hits
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelname)
+        return rate is None or random.random() < rate
+
+_exception_formatter = logging.Formatter()
+
+class DroppingQueueHandler(QueueHandler):
+    # never blocks the request thread, records are dropped and counted while the queue is full
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the base class folds the traceback into the message; keep it apart as exc_text,
+        # a string the listener thread can still format, so JSON records carry it as a field
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_queue_handler = None
+
+def queue_handler():
+    """
+    The process wide logging pipeline: a bounded queue filled by the request threads and a
+    listener thread writing it to the rotating LOG_FILE. Built once, every app shares it.
+    """
+    global _queue_handler
+    if _queue_handler is None:
+        file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+        if LOG_FORMAT == 'json':
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'))
+        handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+        handler.addFilter(RequestIdFilter())
+        listener = QueueListener(handler.queue, file_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        handler.listener = listener
+        _queue_handler = handler
+    return _queue_handler
+
+def init_request_ids(app):
+    @app.before_request
+    def assign_request_id():
+        # keep the id of an upstream proxy, so its logs and ours line up
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+    @app.after_request
+    def send_request_id(response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
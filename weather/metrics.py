@@ -0,0 +1,109 @@
+from flask import Response, g, has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import os
+import time
+
+# under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR, see gunicorn.conf.py,
+# and /metrics merges the files of all workers
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+http_requests = Counter('weather_http_requests_total', 'HTTP requests', ['method', 'route', 'status'])
+http_request_duration = Histogram('weather_http_request_duration_seconds', 'HTTP request latency', ['method', 'route'], buckets=LATENCY_BUCKETS)
+http_response_size = Histogram('weather_http_response_size_bytes', 'HTTP response body size', ['method', 'route'], buckets=SIZE_BUCKETS)
+cache_requests = Counter('weather_cache_requests_total', 'Cache lookups by result', ['cache', 'result'])
+db_queries = Histogram('weather_db_queries_per_request', 'DB queries per request', ['route'], buckets=(0, 1, 2, 3, 5, 10, 25, 100))
+db_duration = Histogram('weather_db_duration_seconds_per_request', 'Time spent in DB queries per request', ['route'], buckets=LATENCY_BUCKETS)
+redis_command_duration = Histogram('weather_redis_command_duration_seconds', 'Redis command latency', ['command'], buckets=LATENCY_BUCKETS)
+
+def init_metrics(app):
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.db_queries = 0
+        g.db_duration = 0.0
+        g.redis_commands = 0
+        g.redis_duration = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if request.endpoint == 'metrics' or 'metrics_start' not in g:
+            return response
+        # the url rule, not the path, so ids don't blow up the label values
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_requests.labels(request.method, route, response.status_code).inc()
+        http_request_duration.labels(request.method, route).observe(time.perf_counter() - g.metrics_start)
+        if not response.is_streamed:
+            http_response_size.labels(request.method, route).observe(response.calculate_content_length() or 0)
+        db_queries.labels(route).observe(g.db_queries)
+        db_duration.labels(route).observe(g.db_duration)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
+def render_metrics():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+def count_cache(cache, result, amount=1):
+    cache_requests.labels(cache, result).inc(amount)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start']
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_duration += elapsed
+
+def record_redis(elapsed):
+    # per request redis totals, for the profiling breakdown
+    if has_request_context() and 'redis_commands' in g:
+        g.redis_commands += 1
+        g.redis_duration += elapsed
+
+def instrument_redis(client):
+    # time every command of the client, pipelines are timed as one PIPELINE command
+    execute_command = client.execute_command
+
+    def timed_execute_command(*args, **options):
+        start = time.perf_counter()
+        try:
+            return execute_command(*args, **options)
+        finally:
+            elapsed = time.perf_counter() - start
+            redis_command_duration.labels(str(args[0]).upper()).observe(elapsed)
+            record_redis(elapsed)
+
+    create_pipeline = client.pipeline
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = create_pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def timed_execute(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                redis_command_duration.labels('PIPELINE').observe(elapsed)
+                record_redis(elapsed)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+    return client
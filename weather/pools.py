@@ -0,0 +1,115 @@
+from contextlib import contextmanager
+from redis import BlockingConnectionPool
+from sqlalchemy.pool import QueuePool
+import threading
+import time
+
+from config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_POOL_TIMEOUT, DB_CONNECT_TIMEOUT
+
+class PoolStats:
+    """
+    Connection wait statistics of a pool: how many callers wait right now, how long they
+    waited and how many gave up on a timeout.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @contextmanager
+    def wait(self):
+        with self._lock:
+            self.waiting += 1
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            yield
+        except Exception:
+            timed_out = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.waiting -= 1
+                if timed_out:
+                    self.timeouts += 1
+                else:
+                    self.acquired += 1
+                self.wait_total += elapsed
+                self.wait_max = max(self.wait_max, elapsed)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'waiting': self.waiting,
+                'acquired': self.acquired,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_total, 6),
+                'wait_seconds_max': round(self.wait_max, 6)
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool recording how long checkouts wait for a connection
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        with self.stats.wait():
+            return super()._do_get()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+class InstrumentedBlockingConnectionPool(BlockingConnectionPool):
+    # shared per worker redis pool recording how long commands wait for a connection
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def get_connection(self, *args, **kwargs):
+        with self.stats.wait():
+            return super().get_connection(*args, **kwargs)
+
+def db_engine_options():
+    # engine options of the MySQL pool, shared by the sync and the async engine
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'connect_args': {'connect_timeout': DB_CONNECT_TIMEOUT}
+    }
+
+def db_pool_stats(engine):
+    pool = engine.pool
+    stats = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow()
+        })
+    if hasattr(pool, 'stats'):
+        stats.update(pool.stats.to_dict())
+    return stats
+
+def redis_pool_stats(client):
+    pool = client.connection_pool
+    stats = {'class': type(pool).__name__, 'max_connections': pool.max_connections}
+    if isinstance(pool, BlockingConnectionPool):
+        in_use = len(pool._get_in_use_connections())
+        stats.update({
+            'created': len(pool._connections),
+            'checked_out': in_use
+        })
+    if hasattr(pool, 'stats'):
+        stats.update(pool.stats.to_dict())
+    return stats
@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import cProfile
+import io
+import json
+import logging
+import pstats
+import random
+import time
+
+from config import PROFILING_ENABLED, PROFILE_HEADER, PROFILE_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_TOP_FUNCTIONS, SLOW_QUERY_THRESHOLD_MS
+
+logger = logging.getLogger(__name__)
+
+def timed_json_provider(provider_class):
+    # JSON encoding time of the request, every jsonify goes through dumps
+    class TimedJSONProvider(provider_class):
+        def dumps(self, obj, **kwargs):
+            with timing('json'):
+                return super().dumps(obj, **kwargs)
+    return TimedJSONProvider
+
+def init_profiling(app):
+    """
+    Opt-in per request time breakdown: SQL and Redis time from the metrics hooks, plus the
+    sections timed with `timing` and JSON encoding, sent as a Server-Timing header and logged
+    as one JSON record. A request carrying PROFILE_HEADER, or a PROFILE_SAMPLE_RATE share of
+    them, also runs under cProfile and logs its top functions.
+    """
+    if not PROFILING_ENABLED:
+        return
+    app.json = timed_json_provider(type(app.json))(app)
+
+    @app.before_request
+    def start_profiling():
+        g.timings = {}
+        g.profile_start = time.perf_counter()
+        if profile_requested():
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def report_timings(response):
+        if 'timings' not in g:
+            return response
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+        timings = dict(g.timings, db=g.get('db_duration', 0.0), redis=g.get('redis_duration', 0.0))
+        timings['total'] = time.perf_counter() - g.profile_start
+        descriptions = {
+            'db': f"{g.get('db_queries', 0)} queries",
+            'redis': f"{g.get('redis_commands', 0)} commands"
+        }
+        response.headers['Server-Timing'] = server_timing(timings, descriptions)
+
+        record = {
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'timings_ms': {name: round(seconds * 1000, 3) for name, seconds in timings.items()},
+            'db_queries': g.get('db_queries', 0),
+            'redis_commands': g.get('redis_commands', 0)
+        }
+        if profiler is not None:
+            record['profile'] = top_functions(profiler)
+        current_app.logger.info(f"Request timing {json.dumps(record)}")
+        return response
+
+    @app.teardown_request
+    def stop_profiling(exc):
+        # a request handed over to the Flask app by the ASGI fast path never reaches report_timings
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+def profile_requested():
+    value = request.headers.get(PROFILE_HEADER)
+    if value is not None:
+        return PROFILE_TOKEN is None or value == PROFILE_TOKEN
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+@contextmanager
+def timing(name):
+    # add the time of the block to the breakdown of the current request, if it is profiled
+    if not has_request_context() or 'timings' not in g:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.timings[name] = g.timings.get(name, 0.0) + time.perf_counter() - start
+
+def server_timing(timings, descriptions=None):
+    descriptions = descriptions or {}
+    metrics = []
+    for name, seconds in timings.items():
+        metric = f'{name};dur={seconds * 1000:.3f}'
+        if name in descriptions:
+            metric += f';desc="{descriptions[name]}"'
+        metrics.append(metric)
+    return ', '.join(metrics)
+
+def top_functions(profiler):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    return stream.getvalue()
+
+# slow query log, the start time is recorded by the before_cursor_execute hook of metrics.py
+@event.listens_for(Engine, 'after_cursor_execute')
+def log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    if not SLOW_QUERY_THRESHOLD_MS:
+        return
+    elapsed_ms = (time.perf_counter() - conn.info['query_start']) * 1000
+    if elapsed_ms < SLOW_QUERY_THRESHOLD_MS:
+        return
+    message = f"Slow query ({elapsed_ms:.1f} ms): {' '.join(statement.split())}"
+    if has_request_context():
+        message += f" [{request.method} {request.path}]"
+    (current_app.logger if has_app_context() else logger).warning(message)
@@ -0,0 +1,178 @@
+from contextlib import contextmanager
+from flask import current_app as app, g, has_app_context, request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+import itertools
+import threading
+import time
+
+from config import MYSQL_USER, MYSQL_PASSWORD, MYSQL_PORT, DATABASE_NAME, MYSQL_REPLICA_HOSTS, REPLICA_SELECTION, REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL, READ_YOUR_WRITES_WINDOW
+
+REPLICA_KEY_PREFIX = 'replica'
+LAST_WRITE_COOKIE = 'weather_last_write'
+READ_METHODS = ('GET', 'HEAD')
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+def replica_uris(hosts=MYSQL_REPLICA_HOSTS):
+    uris = []
+    for host in hosts:
+        host, _, port = host.partition(':')
+        uris.append(f'mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{host}:{port or MYSQL_PORT}/{DATABASE_NAME}')
+    return uris
+
+def replication_lag(connection):
+    # seconds the replica is behind its source, None when replication is not running
+    if connection.dialect.name != 'mysql':
+        return 0
+    try:
+        row = connection.execute(text('SHOW REPLICA STATUS')).mappings().first()
+    except DBAPIError:
+        # MySQL before 8.0.22
+        row = connection.execute(text('SHOW SLAVE STATUS')).mappings().first()
+    if row is None:
+        return None
+    return row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+
+class ReplicaState:
+    def __init__(self):
+        self.healthy = True
+        self.latency = None
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+
+    def to_dict(self):
+        return {
+            'healthy': self.healthy,
+            'latency_ms': None if self.latency is None else round(self.latency * 1000, 3),
+            'lag_seconds': self.lag,
+            'error': self.error
+        }
+
+class ReplicaRouter:
+    """
+    Chooses the engine serving the reads of a request. GET and HEAD requests read from a
+    healthy replica, unless the client wrote within the read-your-writes window; everything
+    else stays on the primary.
+
+    Replicas are probed at most every check_interval seconds. A replica that can't be
+    reached, stops replicating or lags more than max_lag seconds is skipped until a later
+    probe finds it healthy again; with no healthy replica reads fall back to the primary.
+    """
+    def __init__(self, selection=REPLICA_SELECTION, max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL, window=READ_YOUR_WRITES_WINDOW):
+        self.selection = selection
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.window = window
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._states = {}
+
+    def init_app(self, app):
+        # one engine per REPLICA_DATABASE_URIS entry, with the same options as the primary
+        engine_options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        engines = {}
+        for i, uri in enumerate(app.config.get('REPLICA_DATABASE_URIS', [])):
+            key = f'{REPLICA_KEY_PREFIX}{i}'
+            engines[key] = create_engine(uri, **engine_options)
+            event.listen(engines[key], 'handle_error', self._on_error(key))
+        app.extensions['replicas'] = engines
+
+        @app.before_request
+        def route_reads():
+            g.read_replica = request.method in READ_METHODS and not self.recently_written()
+
+        @app.after_request
+        def remember_write(response):
+            # the client reads its own writes from the primary for the next few seconds
+            if request.method in WRITE_METHODS and response.status_code < 400:
+                response.set_cookie(LAST_WRITE_COOKIE, f'{time.time():.3f}', max_age=self.window, httponly=True)
+            return response
+
+    def recently_written(self):
+        try:
+            return time.time() - float(request.cookies.get(LAST_WRITE_COOKIE, 0)) < self.window
+        except ValueError:
+            return False
+
+    def engine_for_reads(self):
+        # the replica engine for this request, None for the primary
+        if not has_app_context() or not g.get('read_replica', False):
+            return None
+        engines = app.extensions.get('replicas')
+        if not engines:
+            return None
+        # stick to one replica per request
+        if 'replica_key' not in g:
+            g.replica_key = self.choose(engines)
+        return None if g.replica_key is None else engines[g.replica_key]
+
+    def choose(self, engines):
+        healthy = [key for key in sorted(engines) if self.check(key, engines[key])]
+        if not healthy:
+            return None
+        if self.selection == 'least_latency':
+            return min(healthy, key=lambda key: self._states[key].latency)
+        return healthy[next(self._counter) % len(healthy)]
+
+    def check(self, key, engine):
+        with self._lock:
+            state = self._states.setdefault(key, ReplicaState())
+            now = time.monotonic()
+            if state.checked_at is not None and now - state.checked_at < self.check_interval:
+                return state.healthy
+            # claim the probe, concurrent requests go on with the last result
+            state.checked_at = now
+
+        try:
+            start = time.perf_counter()
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+                latency = time.perf_counter() - start
+                lag = replication_lag(connection)
+        except DBAPIError as e:
+            # connection failures were already recorded by the handle_error listener
+            if state.healthy:
+                self.mark_down(key, e)
+            return False
+
+        with self._lock:
+            # moving average, so one slow probe doesn't flip least_latency selection
+            state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+            state.lag = lag
+            state.healthy = lag is not None and lag <= self.max_lag
+            state.error = None if state.healthy else 'replication stopped' if lag is None else 'replication lag'
+        if not state.healthy:
+            app.logger.warning(f"Replica {key} skipped: {state.error} ({lag})")
+        return state.healthy
+
+    def mark_down(self, key, error):
+        with self._lock:
+            state = self._states.setdefault(key, ReplicaState())
+            state.healthy = False
+            state.error = str(error.orig if isinstance(error, DBAPIError) else error)
+            state.checked_at = time.monotonic()
+        app.logger.error(f"Replica {key} is down: {state.error}")
+
+    def _on_error(self, key):
+        def handle_error(context):
+            # only connection failures take the replica out, not failing statements
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+                self.mark_down(key, context.original_exception)
+        return handle_error
+
+    def stats(self):
+        with self._lock:
+            return {key: state.to_dict() for key, state in sorted(self._states.items())}
+
+@contextmanager
+def primary_reads():
+    # reads in this block go to the primary, e.g. to fill a cache shared by every client
+    read_replica = g.get('read_replica', False)
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = read_replica
+
+replica_router = ReplicaRouter()
@@ -1,11 +1,24 @@
-from flask import Blueprint, abort, json, jsonify, request
-from db import db_add_weather, db_get_all_weathers, db_get_all_weathers_paging, db_get_weather, db_update_weather, db_delete_weather
-from exceptions import KeyNotExistException
-from cache import redis
+from flask import Blueprint, Response, abort, json, jsonify, request, stream_with_context
+from db import SORTABLE_COLUMNS, UPDATABLE_COLUMNS, STRING_LENGTHS, DECIMAL_LIMITS, weather_row_to_dict, db_add_weather, db_get_weather_stats, db_get_latest_weathers, db_get_latest_weather, db_add_weathers, db_get_all_weathers, db_iter_weathers, db_query_weathers, db_get_all_weathers_paging, db_get_all_weathers_by_cursor, db_count_weathers, db_get_weather, db_get_weathers, db_update_weather, db_update_weathers, db_delete_weather, db_delete_weathers
+from exceptions import KeyNotExistException, PreconditionFailedException
+from cache import redis, local_cache, gzip_etag, CachedResponse, SingleFlightCache
+from replicas import primary_reads
+from ingest import ingest_weather
+from metrics import count_cache
+from profiling import timing
+from config import WEATHER_CACHE_TTL, WEATHER_NEGATIVE_CACHE_TTL, ALL_WEATHERS_SOFT_TTL, ALL_WEATHERS_HARD_TTL, CACHE_TTL_JITTER, CACHE_LOCK_TTL, CACHE_LOCK_WAIT, FILTERED_WEATHERS_CACHE_TTL, STATS_CACHE_TTL, CURSOR_PAGE_DEFAULT_LIMIT, CURSOR_PAGE_MAX_LIMIT, WEATHER_COUNT_CACHE_TTL, STREAM_BATCH_SIZE, BULK_INSERT_BATCH_SIZE, BULK_MAX_ITEMS, BATCH_MAX_IDS, READ_YOUR_WRITES_WINDOW, WRITE_BEHIND_ENABLED, INGEST_RETRY_AFTER
 from flask import current_app as app
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+import base64
+import hashlib
+import time
 
 weather_bp = Blueprint('weather', __name__, url_prefix='/weather')
 
+all_weathers_cache = SingleFlightCache(redis.raw, ALL_WEATHERS_SOFT_TTL, ALL_WEATHERS_HARD_TTL, CACHE_TTL_JITTER, CACHE_LOCK_TTL, CACHE_LOCK_WAIT)
+
 @weather_bp.route('/', methods=['POST'])
 def create_weather():
     """
@@ -50,6 +63,15 @@ def create_weather():
                         type: string
                     weather:
                         $ref: '#/definitions/weather'
+        202:
+            description: weather queued for writing, in write-behind mode
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+                    token:
+                        type: string
         400:
             description: weather creation failed
             schema:
@@ -61,18 +83,302 @@ def create_weather():
                         type: array
                         items:
                             type: string
+        503:
+            description: too many weathers waiting to be written, in write-behind mode
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
     """
     missing_params = validate_required_creation_params(request.json)
     if missing_params:
         resp = validation_failed_resp(missing_params)
         return jsonify(resp), 200
 
+    # write-behind: queue the reading, `flask weather consume-ingest` writes it
+    if WRITE_BEHIND_ENABLED:
+        error = validate_bulk_item(request.json)
+        if error:
+            return jsonify(error), 400
+        token = ingest_weather(request.json)
+        if token is None:
+            return jsonify({'message': 'Too many weathers waiting to be written, retry later'}), 503, {'Retry-After': str(INGEST_RETRY_AFTER)}
+        resp = {
+            'message': 'weather accepted',
+            'token': token
+        }
+        return jsonify(resp), 202
+
     weather = db_add_weather(request.json['city'], request.json['temperature'], request.json['humidity'], request.json['description'])
     resp = create_response("weather successfully created!", weather)
     
-    # delete cache to refresh
-    redis.delete('all_weathers')
+    # delete cache to refresh, including a negative entry for the new id
+    invalidate_weathers_cache()
+    redis.delete(weather_cache_key(weather.id))
+    
+    return jsonify(resp), 200
+
+@weather_bp.route('/bulk', methods=['POST'])
+def create_weathers_bulk():
+    """
+    Create weathers in bulk
+    Accepts a JSON array or an NDJSON body, validates every item and inserts the valid ones in batches inside one transaction.
+    ---
+    tags:
+        - weather
+    consumes:
+        - application/json
+        - application/x-ndjson
+    produces:
+        - application/json
+    parameters:
+        - name: body
+          in: body
+          schema:
+            type: array
+            items:
+                $ref: '#/definitions/weather'
+    responses:
+        200:
+            description: weathers successfully created, with per-item errors
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+                    created:
+                        type: integer
+                    errors:
+                        type: array
+                        items:
+                            type: object
+        400:
+            description: body is not an array or NDJSON
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+        413:
+            description: too many items
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+        500:
+            description: Something went wrong
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+    """
+    items = parse_bulk_body()
+    if items is None:
+        return jsonify({'message': 'Body must be a JSON array or NDJSON'}), 400
+    if len(items) > BULK_MAX_ITEMS:
+        return jsonify({'message': f'Too many items, max is {BULK_MAX_ITEMS}'}), 413
+
+    valid_weathers = []
+    errors = []
+    for index, item in enumerate(items):
+        error = validate_bulk_item(item)
+        if error:
+            error['index'] = index
+            errors.append(error)
+            continue
+        valid_weathers.append({param: item[param] for param in ('city', 'temperature', 'humidity', 'description')})
+
+    created = 0
+    if valid_weathers:
+        created_ids = db_add_weathers(valid_weathers, BULK_INSERT_BATCH_SIZE)
+        if isinstance(created_ids, Exception):
+            app.logger.error(f"Error in bulk creating weathers: {created_ids}")
+            return jsonify({'message': 'Something went wrong!'}), 500
+
+        # delete cache to refresh, once for the whole batch
+        invalidate_weathers_cache()
+        uncache_weathers(created_ids)
+        created = len(created_ids)
+
+    resp = {
+        'message': 'weathers successfully created!',
+        'created': created,
+        'errors': errors
+    }
+    return jsonify(resp), 200
+
+@weather_bp.route('/bulk', methods=['PATCH'])
+def update_weathers_bulk():
+    """
+    Update weathers in bulk
+    Applies the same change to the weathers of a list of ids or matching a filter, with one UPDATE inside one transaction.
+    ---
+    tags:
+        - weather
+    produces:
+        - application/json
+    parameters:
+        - name: body
+          in: body
+          required: true
+          schema:
+            id: bulk_update
+            required:
+                - set
+            properties:
+                ids:
+                    type: array
+                    items:
+                        type: integer
+                filter:
+                    type: object
+                    description: Same parameters as the filters of GET /weather/, at least one
+                set:
+                    $ref: '#/definitions/weather'
+    responses:
+        200:
+            description: weathers successfully updated
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+                    updated:
+                        type: integer
+        400:
+            description: Invalid ids, filter or key
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+        413:
+            description: too many ids
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+        500:
+            description: Something went wrong
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'message': 'Body must be a JSON object'}), 400
+    try:
+        ids, filters = parse_bulk_selection(body)
+        values = parse_bulk_update_values(body.get('set'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if ids is not None and len(ids) > BULK_MAX_ITEMS:
+        return jsonify({'message': f'Too many ids, max is {BULK_MAX_ITEMS}'}), 413
+    
+    result = db_update_weathers(values, ids, filters)
+    if isinstance(result, Exception):
+        app.logger.error(f"Error in bulk updating weathers: {result}")
+        return jsonify({'message': 'Something went wrong!'}), 500
+    updated, updated_ids = result
+    
+    # delete cache to refresh, once for the whole batch
+    if updated_ids:
+        invalidate_weathers_cache()
+        uncache_weathers(updated_ids)
     
+    resp = {
+        'message': 'weathers successfully updated!',
+        'updated': updated
+    }
+    return jsonify(resp), 200
+
+@weather_bp.route('/bulk', methods=['DELETE'])
+def delete_weathers_bulk():
+    """
+    Delete weathers in bulk
+    Deletes the weathers of a list of ids or matching a filter, with one DELETE inside one transaction.
+    ---
+    tags:
+        - weather
+    produces:
+        - application/json
+    parameters:
+        - name: body
+          in: body
+          required: true
+          schema:
+            id: bulk_delete
+            properties:
+                ids:
+                    type: array
+                    items:
+                        type: integer
+                filter:
+                    type: object
+                    description: Same parameters as the filters of GET /weather/, at least one
+    responses:
+        200:
+            description: weathers successfully removed
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+                    deleted:
+                        type: integer
+        400:
+            description: Invalid ids or filter
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+        413:
+            description: too many ids
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+        500:
+            description: Something went wrong
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'message': 'Body must be a JSON object'}), 400
+    try:
+        ids, filters = parse_bulk_selection(body)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if ids is not None and len(ids) > BULK_MAX_ITEMS:
+        return jsonify({'message': f'Too many ids, max is {BULK_MAX_ITEMS}'}), 413
+    
+    result = db_delete_weathers(ids, filters)
+    if isinstance(result, Exception):
+        app.logger.error(f"Error in bulk deleting weathers: {result}")
+        return jsonify({'message': 'Something went wrong!'}), 500
+    deleted, deleted_ids = result
+    
+    # delete cache to refresh, once for the whole batch
+    if deleted_ids:
+        invalidate_weathers_cache()
+        uncache_weathers(deleted_ids)
+    
+    resp = {
+        'message': 'weathers successfully removed!',
+        'deleted': deleted
+    }
     return jsonify(resp), 200
 
 @weather_bp.route('/', methods=['GET'])
@@ -84,6 +390,57 @@ def get_all_weathers():
         - weather
     produces:
         - application/json
+        - application/x-ndjson
+    parameters:
+        - name: stream
+          in: query
+          type: string
+          enum: [ndjson, json]
+          required: false
+          description: Stream rows in server-side batches as NDJSON or as a chunked JSON document, bypassing the cache
+        - name: city
+          in: query
+          type: string
+          required: false
+          description: Only weathers of this city
+        - name: from
+          in: query
+          type: string
+          format: date-time
+          required: false
+          description: Only weathers created at or after this time
+        - name: to
+          in: query
+          type: string
+          format: date-time
+          required: false
+          description: Only weathers created at or before this time
+        - name: min_temperature
+          in: query
+          type: number
+          required: false
+        - name: max_temperature
+          in: query
+          type: number
+          required: false
+        - name: min_humidity
+          in: query
+          type: number
+          required: false
+        - name: max_humidity
+          in: query
+          type: number
+          required: false
+        - name: sort
+          in: query
+          type: string
+          required: false
+          description: Comma separated sort keys, prefixed by - for descending, e.g. -created_at,city
+        - name: limit
+          in: query
+          type: integer
+          required: false
+          description: Maximum number of weathers
     responses:
         200:
             description: All weathers
@@ -94,23 +451,62 @@ def get_all_weathers():
                         type: array
                         items:
                             $ref: '#/definitions/weather'
+        400:
+            description: Invalid filter, sort or limit
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
     """
+    try:
+        filters = parse_weather_filters(request.args)
+        sort = parse_weather_sort(request.args.get('sort'))
+        limit = parse_positive_int('limit', request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     
-    # Get cache at first
-    cached_weathers = redis.get('all_weathers')
-    if cached_weathers:
-        app.logger.info("Hit cache in getting all weathers")
-        weathers_result = json.loads(cached_weathers)
-    else:
-        app.logger.info("Miss cache in getting all weathers")
-        weathers = db_get_all_weathers()
-        weathers_result = [weather.to_dict() for weather in weathers]
-        redis.set('all_weathers', json.dumps(weathers_result))
+    stream = request.args.get('stream')
+    if stream is None and request.accept_mimetypes.best == 'application/x-ndjson':
+        stream = 'ndjson'
+    if stream in ('ndjson', 'json'):
+        app.logger.info(f"Stream all weathers as {stream}")
+        return stream_weathers(stream, filters, sort, limit)
     
-    resp = {
-        'weathers': weathers_result
-    }
-    return jsonify(resp), 200
+    if filters or sort or limit:
+        return get_filtered_weathers(filters, sort, limit)
+    
+    # Get the serialized response from the worker memory at first
+    cached_response = local_cache.get('all_weathers')
+    if cached_response is not None:
+        app.logger.info("Hit local cache in getting all weathers")
+        count_cache('all_weathers', 'local_hit')
+        if not_modified(cached_response.response_etag(), cached_response.last_modified):
+            return not_modified_response(cached_response.response_etag(), cached_response.last_modified)
+        return cached_response.to_response(), 200
+    # an invalidation handled while redis is read must not be undone by the local set below
+    local_version = local_cache.version('all_weathers')
+    
+    # revalidate against the collection version, skipping the db and the cached body
+    if request.if_none_match or request.if_modified_since:
+        generation, modified = all_weathers_cache.version('all_weathers')
+        etag = all_weathers_etag(generation)
+        last_modified = datetime.fromtimestamp(modified, timezone.utc)
+        # without the body it is unknown whether the gzip variant is served, either ETag is current
+        etags = [etag, gzip_etag(etag)] if 'gzip' in request.accept_encodings else [etag]
+        for etag in etags:
+            if not_modified(etag, last_modified):
+                app.logger.info("Not modified in getting all weathers")
+                return not_modified_response(etag, last_modified)
+    
+    # then from redis, a single worker rebuilds it while the others serve the stale value
+    cached_weathers, status = all_weathers_cache.get_or_compute('all_weathers', render_all_weathers)
+    app.logger.info(f"{status.capitalize()} cache in getting all weathers")
+    count_cache('all_weathers', status)
+    cached_response = CachedResponse.from_bytes(cached_weathers)
+    if status != 'stale':
+        local_cache.set('all_weathers', cached_response, local_version)
+    return cached_response.to_response(), 200
 
 @weather_bp.route('/<int:page>/<int:limit>', methods=['GET'])
 def get_all_weathers_by_paging(page, limit):
@@ -151,7 +547,7 @@ def get_all_weathers_by_paging(page, limit):
                         type: integer
     """
     paginated_weathers = db_get_all_weathers_paging(page, limit)
-    weathers = [weathers.to_dict() for weathers in paginated_weathers.items]
+    weathers = [weather_row_to_dict(row) for row in paginated_weathers.items]
     resp = {
         'weathers': weathers,
         'total': paginated_weathers.total,
@@ -160,6 +556,335 @@ def get_all_weathers_by_paging(page, limit):
     }
     return jsonify(resp), 200
 
+@weather_bp.route('/cursor', methods=['GET'])
+def get_all_weathers_by_cursor():
+    """
+    Get All weathers by Cursor
+    Keyset pagination: every page seeks from the cursor of the previous one, so latency stays flat however deep the client pages.
+    ---
+    tags:
+        - weather
+    produces:
+        - application/json
+    parameters:
+        - name: cursor
+          in: query
+          type: string
+          required: false
+          description: Opaque cursor returned as next_cursor by the previous page
+        - name: limit
+          in: query
+          type: integer
+          required: false
+          description: Number of weathers per page
+        - name: order
+          in: query
+          type: string
+          enum: [id, created_at]
+          required: false
+          description: Sort key of the listing
+        - name: total
+          in: query
+          type: boolean
+          required: false
+          description: Include the (cached) total number of weathers
+    responses:
+        200:
+            description: All weathers with cursor
+            schema:
+                id: weathers
+                properties:
+                    weathers:
+                        type: array
+                        items:
+                            $ref: '#/definitions/weather'
+                    next_cursor:
+                        type: string
+                    limit:
+                        type: integer
+                    total:
+                        type: integer
+        400:
+            description: Invalid cursor or order
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+    """
+    order = request.args.get('order', 'id')
+    if order not in ('id', 'created_at'):
+        return jsonify({'message': f'Invalid order: {order}'}), 400
+    limit = request.args.get('limit', CURSOR_PAGE_DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, CURSOR_PAGE_MAX_LIMIT))
+
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_cursor(cursor, order)
+        except ValueError:
+            return jsonify({'message': 'Invalid cursor'}), 400
+
+    weathers, has_more = db_get_all_weathers_by_cursor(limit, order, after)
+    resp = {
+        'weathers': [weather_row_to_dict(row) for row in weathers],
+        'next_cursor': encode_cursor(weathers[-1], order) if has_more else None,
+        'limit': limit
+    }
+    if request.args.get('total', 'false').lower() in ('1', 'true'):
+        resp['total'] = get_weathers_count()
+    return jsonify(resp), 200
+
+@weather_bp.route('/stats', methods=['GET'])
+def get_weather_stats():
+    """
+    Get weather statistics
+    Per-city min/max/avg temperature and humidity computed by the database, optionally per hour or day.
+    ---
+    tags:
+        - weather
+    produces:
+        - application/json
+    parameters:
+        - name: city
+          in: query
+          type: string
+          required: false
+        - name: from
+          in: query
+          type: string
+          format: date-time
+          required: false
+        - name: to
+          in: query
+          type: string
+          format: date-time
+          required: false
+        - name: bucket
+          in: query
+          type: string
+          enum: [hour, day]
+          required: false
+          description: Also group by hour or day of created_at
+    responses:
+        200:
+            description: weather statistics
+            schema:
+                id: stats
+                properties:
+                    stats:
+                        type: array
+                        items:
+                            type: object
+                            properties:
+                                city:
+                                    type: string
+                                bucket:
+                                    type: string
+                                count:
+                                    type: integer
+                                min_temperature:
+                                    type: number
+                                max_temperature:
+                                    type: number
+                                avg_temperature:
+                                    type: number
+                                min_humidity:
+                                    type: number
+                                max_humidity:
+                                    type: number
+                                avg_humidity:
+                                    type: number
+        400:
+            description: Invalid filter or bucket
+            schema:
+                id: stats
+                properties:
+                    message:
+                        type: string
+    """
+    bucket = request.args.get('bucket')
+    if bucket not in (None, 'hour', 'day'):
+        return jsonify({'message': f'Invalid bucket: {bucket}'}), 400
+    try:
+        filters = parse_weather_filters(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    def render():
+        return {
+            'stats': db_get_weather_stats(filters, bucket)
+        }
+    params = {'filters': filters, 'bucket': bucket}
+    return get_versioned_response('weather stats', 'stats', params, render, STATS_CACHE_TTL)
+
+@weather_bp.route('/latest', methods=['GET'])
+def get_latest_weathers():
+    """
+    Get the latest weather of every city
+    Served from the latest_weather table, one row per city, without touching the weather table.
+    ---
+    tags:
+        - weather
+    produces:
+        - application/json
+    responses:
+        200:
+            description: latest weather per city, ordered by city
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+                    weather:
+                        type: array
+                        items:
+                            $ref: '#/definitions/weather'
+    """
+    resp = create_response("latest weather per city", db_get_latest_weathers())
+    return jsonify(resp), 200
+
+@weather_bp.route('/latest/<string:city>', methods=['GET'])
+def get_latest_weather(city):
+    """
+    Get the latest weather of a city
+    A primary key lookup in the latest_weather table.
+    ---
+    tags:
+        - weather
+    produces:
+        - application/json
+    parameters:
+        - name: city
+          in: path
+          type: string
+          required: true
+          description: weather of city
+    responses:
+        200:
+            description: latest weather of the city
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+                    weather:
+                        type: array
+                        items:
+                            $ref: '#/definitions/weather'
+        304:
+            description: not modified since the ETag or date sent
+        404:
+            description: no weather of the city
+            schema:
+                id: weather
+                properties:
+                    message:
+                        type: string
+    """
+    weather = db_get_latest_weather(city)
+    if weather is None:
+        return jsonify({'message': f'No weather Found in city: {city}'}), 404
+    # same validators as GET /weather/<id> of the reading
+    etag, last_modified = weather_etag(weather), weather_last_modified(weather)
+    if not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    resp = create_response("latest weather of city", weather)
+    return with_validators(jsonify(resp), etag, last_modified), 200
+
+@weather_bp.route('/batch', methods=['GET', 'POST'])
+def get_weathers_batch():
+    """
+    Get weathers by Ids
+    Resolves many ids at once: one MGET of the per-id cache, then one IN query for the cache misses.
+    ---
+    tags:
+        - weather
+    produces:
+        - application/json
+    parameters:
+        - name: ids
+          in: query
+          type: string
+          required: false
+          description: Comma separated weather ids, for GET
+        - name: body
+          in: body
+          required: false
+          description: Weather ids, for POST
+          schema:
+            properties:
+                ids:
+                    type: array
+                    items:
+                        type: integer
+    responses:
+        200:
+            description: weathers in the order of the ids, null for the ids not found
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+                    weather:
+                        type: array
+                        items:
+                            $ref: '#/definitions/weather'
+                    missing:
+                        type: array
+                        items:
+                            type: integer
+        400:
+            description: Invalid or too many ids
+            schema:
+                id: weathers
+                properties:
+                    message:
+                        type: string
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        values = body.get('ids') if isinstance(body, dict) else None
+        if not isinstance(values, list):
+            return jsonify({'message': 'Body must be an object with an ids array'}), 400
+    else:
+        values = request.args.get('ids', '').split(',') if request.args.get('ids') else []
+    try:
+        ids = [parse_weather_id(value) for value in values]
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if not ids:
+        return jsonify({'message': 'No ids'}), 400
+    if len(ids) > BATCH_MAX_IDS:
+        return jsonify({'message': f'Too many ids, at most {BATCH_MAX_IDS}'}), 400
+    
+    unique_ids = list(dict.fromkeys(ids))
+    weathers = {}
+    misses = []
+    for id, cached_weather in zip(unique_ids, redis.mget([weather_cache_key(id) for id in unique_ids])):
+        if cached_weather is None:
+            misses.append(id)
+        elif cached_weather != WEATHER_NOT_FOUND:
+            weathers[id] = json.loads(cached_weather)['weather']
+    app.logger.info(f"Batch weathers: {len(unique_ids) - len(misses)} cache hits, {len(misses)} misses")
+    count_cache('weather', 'hit', len(unique_ids) - len(misses))
+    count_cache('weather', 'miss', len(misses))
+    
+    if misses:
+        generation, modified = all_weathers_cache.version('all_weathers')
+        with cache_fill_reads(modified):
+            found = db_get_weathers(misses)
+        cache_weathers(generation, misses, found)
+        weathers.update((weather.id, weather.to_dict()) for weather in found)
+    
+    resp = {
+        'message': 'weather details by ids',
+        'weather': [weathers.get(id) for id in ids],
+        'missing': [id for id in unique_ids if id not in weathers]
+    }
+    return jsonify(resp), 200
+
 @weather_bp.route('/<int:id>', methods=['GET'])
 def get_weather(id):
     """
@@ -191,13 +916,23 @@ def get_weather(id):
                     message:
                         type: string
     """
-    weather = db_get_weather(id)
-    if weather:
-        resp = create_response("weather details by id", weather)
-        return jsonify(resp), 200
+    # Get cache at first
+    cached_weather = redis.get(weather_cache_key(id))
+    if cached_weather is not None:
+        app.logger.info(f"Hit cache in getting weather {id}")
+        count_cache('weather', 'hit')
+        return cached_weather_response(id, cached_weather)
     
-    # if not found
-    return jsonify({'message': f'No weather Found in id: {id}'}), 404
+    app.logger.info(f"Miss cache in getting weather {id}")
+    count_cache('weather', 'miss')
+    generation, modified = all_weathers_cache.version('all_weathers')
+    with cache_fill_reads(modified):
+        weather = db_get_weather(id)
+    # if not found, remember it for a short while
+    cache_weathers(generation, [id], [weather] if weather else [])
+    if weather:
+        return weather_response(weather)
+    return weather_not_found_response(id)
 
 @weather_bp.route('/<int:id>', methods=['PATCH'])
 def update_weather(id):
@@ -215,6 +950,11 @@ def update_weather(id):
           type: integer
           required: true
           description: weather id
+        - name: If-Match
+          in: header
+          type: string
+          required: false
+          description: ETag of the version the update applies to
         - name: body
           in: body
           required: true
@@ -259,6 +999,13 @@ def update_weather(id):
                 properties:
                     message:
                         type: string
+        412:
+            description: weather modified since the version named by If-Match
+            schema:
+                id: weather
+                properties:
+                    message:
+                        type: string
         500:
             description: Something went wrong
             schema:
@@ -267,7 +1014,16 @@ def update_weather(id):
                     message:
                         type: string
     """
-    updated_weather = db_update_weather(id, **request.json)
+    # optimistic concurrency: with If-Match the update only applies to the version it names
+    expected_updated_at = None
+    if request.if_match and not request.if_match.star_tag:
+        expected_updated_at = [updated_at for updated_at in (etag_updated_at(id, etag) for etag in request.if_match) if updated_at]
+        if not expected_updated_at:
+            return jsonify({'message': PreconditionFailedException(id).message}), 412
+    
+    updated_weather = db_update_weather(id, request.json, expected_updated_at)
+    if isinstance(updated_weather, PreconditionFailedException):
+        return jsonify({'message': updated_weather.message}), 412
     if isinstance(updated_weather, KeyNotExistException):
         app.logger.debug(f"Invalid key in updating weather: {updated_weather.key}")
         return jsonify({'message': updated_weather.message}), 400
@@ -277,10 +1033,11 @@ def update_weather(id):
     if updated_weather:
         resp = create_response("weather successfully updated!", updated_weather)
         
-        # delete cache to refresh
-        redis.delete('all_weathers')
+        # delete cache to refresh, write through the updated weather
+        invalidate_weathers_cache()
+        cache_weather(id, updated_weather)
         
-        return jsonify(resp), 200
+        return with_validators(jsonify(resp), weather_etag(updated_weather), weather_last_modified(updated_weather)), 200
     
     return jsonify({'message': f'weather id: {id} not found!'}), 404
 
@@ -321,8 +1078,9 @@ def delete_weather(id):
             'message': 'weather successfully removed!'
         }
         
-        # delete cache to refresh
-        redis.delete('all_weathers')
+        # delete cache to refresh, the id is now known to be missing
+        invalidate_weathers_cache()
+        cache_weather(id, None)
         
         return jsonify(resp), 200
     resp = {
@@ -335,7 +1093,7 @@ def create_response(message, weathers):
     if not isinstance(weathers, list):
         weathers = [weathers]
         
-    weathers_dict = [weather.to_dict() for weather in weathers]
+    weathers_dict = [weather if isinstance(weather, dict) else weather.to_dict() for weather in weathers]
     
     response = {
         'message': message,
@@ -344,11 +1102,372 @@ def create_response(message, weathers):
     
     return response
 
+# stream all weathers row by row so memory stays flat whatever the table size
+def stream_weathers(stream_format, filters=None, sort=None, limit=None):
+    # compact, the form the orjson backend encodes
+    def generate_ndjson():
+        for row in db_iter_weathers(STREAM_BATCH_SIZE, filters, sort, limit):
+            yield json.dumps(weather_row_to_dict(row), separators=(',', ':')) + '\n'
+
+    def generate_json():
+        yield '{"weathers":['
+        separator = ''
+        for row in db_iter_weathers(STREAM_BATCH_SIZE, filters, sort, limit):
+            yield separator + json.dumps(weather_row_to_dict(row), separators=(',', ':'))
+            separator = ','
+        yield ']}\n'
+
+    if stream_format == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
+
+# serialize the all weathers response once, it is cached as final bytes
+def render_all_weathers(generation):
+    # read the version before the rows, so Last-Modified never claims more than the body holds
+    _, modified = all_weathers_cache.version('all_weathers')
+    with cache_fill_reads(modified), timing('fetch'):
+        weathers = db_get_all_weathers()
+    with timing('to_dict'):
+        resp = {
+            'weathers': [weather_row_to_dict(row) for row in weathers]
+        }
+    body = jsonify(resp).get_data()
+    last_modified = datetime.fromtimestamp(modified, timezone.utc)
+    return CachedResponse.build(body, etag=all_weathers_etag(generation), last_modified=last_modified).to_bytes()
+
+def all_weathers_etag(generation):
+    return f'all_weathers-{generation}'
+
+def get_filtered_weathers(filters, sort, limit):
+    def render():
+        with timing('fetch'):
+            weathers = db_query_weathers(filters, sort, limit)
+        with timing('to_dict'):
+            return {
+                'weathers': [weather_row_to_dict(row) for row in weathers]
+            }
+    params = {'filters': filters, 'sort': sort, 'limit': limit}
+    return get_versioned_response('filtered weathers', 'q', params, render, FILTERED_WEATHERS_CACHE_TTL)
+
+# responses derived from the collection (filtered listings, stats) are cached per query and
+# per collection generation, a write moves every query to a new key and the old ones expire
+def get_versioned_response(name, prefix, params, render, ttl):
+    generation, modified = all_weathers_cache.version('all_weathers')
+    key = versioned_cache_key(prefix, generation, params)
+    cached = redis.raw.get(key)
+    if cached is not None:
+        app.logger.info(f"Hit cache in getting {name}")
+        count_cache(name.replace(' ', '_'), 'hit')
+        cached_response = CachedResponse.from_bytes(cached)
+    else:
+        app.logger.info(f"Miss cache in getting {name}")
+        count_cache(name.replace(' ', '_'), 'miss')
+        last_modified = datetime.fromtimestamp(modified, timezone.utc)
+        with cache_fill_reads(modified):
+            resp = render()
+        cached_response = CachedResponse.build(jsonify(resp).get_data(), last_modified=last_modified)
+        redis.raw.set(key, cached_response.to_bytes(), ex=ttl)
+    
+    if not_modified(cached_response.response_etag(), cached_response.last_modified):
+        return not_modified_response(cached_response.response_etag(), cached_response.last_modified)
+    return cached_response.to_response(), 200
+
+def versioned_cache_key(prefix, generation, params):
+    query = json.dumps(params, sort_keys=True, default=str)
+    return f'weathers:{prefix}:{generation}:{hashlib.sha1(query.encode()).hexdigest()}'
+
+# cache entries are shared by every client, right after a write they are filled from the
+# primary so a lagging replica can't pin rows older than the write into the cache
+def cache_fill_reads(modified):
+    if time.time() - modified < READ_YOUR_WRITES_WINDOW:
+        return primary_reads()
+    return nullcontext()
+
+# invalidate every cached view of the weathers collection
+def invalidate_weathers_cache():
+    all_weathers_cache.invalidate('all_weathers')
+    local_cache.invalidate('all_weathers')
+    redis.delete('weather_count')
+
+# per-id cache, holding either the weather dict or a negative entry
+WEATHER_NOT_FOUND = 'not_found'
+
+def weather_cache_key(id):
+    return f'weather:{id}'
+
+def cache_weather(id, weather):
+    # write-through of a write, read fills go through cache_weathers
+    if weather is None:
+        redis.set(weather_cache_key(id), WEATHER_NOT_FOUND, ex=WEATHER_NEGATIVE_CACHE_TTL)
+    else:
+        redis.set(weather_cache_key(id), weather_cache_entry(weather), ex=WEATHER_CACHE_TTL)
+
+def cache_weathers(generation, ids, weathers):
+    # read-through fill of the ids queried at `generation`, negative entries for the ids not found;
+    # never overwrites an entry, and is dropped once a write invalidated the weathers since the read
+    return all_weathers_cache.store_if_current('all_weathers', generation, weather_cache_entries(ids, weathers))
+
+def weather_cache_entries(ids, weathers):
+    found = {weather.id: weather for weather in weathers}
+    return {weather_cache_key(id): (weather_cache_entry(found[id]), WEATHER_CACHE_TTL) if id in found else (WEATHER_NOT_FOUND, WEATHER_NEGATIVE_CACHE_TTL)
+            for id in ids}
+
+def uncache_weathers(ids, chunk_size=1000):
+    # drop the per-id entries, a few DELs of many keys each
+    keys = [weather_cache_key(id) for id in ids]
+    pipe = redis.pipeline(transaction=False)
+    for start in range(0, len(keys), chunk_size):
+        pipe.delete(*keys[start:start + chunk_size])
+    pipe.execute()
+
+def weather_cache_entry(weather):
+    cached_weather = {
+        'weather': weather.to_dict(),
+        'etag': weather_etag(weather),
+        'last_modified': weather_last_modified(weather).timestamp()
+    }
+    # compact, the form the orjson backend encodes
+    return json.dumps(cached_weather, separators=(',', ':'))
+
+# responses of GET /weather/<id>, shared with the ASGI app
+def cached_weather_response(id, cached_weather):
+    if cached_weather == WEATHER_NOT_FOUND:
+        return weather_not_found_response(id)
+    cached_weather = json.loads(cached_weather)
+    etag = cached_weather['etag']
+    last_modified = datetime.fromtimestamp(cached_weather['last_modified'], timezone.utc)
+    if not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    resp = create_response("weather details by id", cached_weather['weather'])
+    return with_validators(jsonify(resp), etag, last_modified), 200
+
+def weather_response(weather):
+    etag, last_modified = weather_etag(weather), weather_last_modified(weather)
+    if not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    resp = create_response("weather details by id", weather)
+    return with_validators(jsonify(resp), etag, last_modified), 200
+
+def weather_not_found_response(id):
+    return jsonify({'message': f'No weather Found in id: {id}'}), 404
+
+# validators of a single weather, derived from its id and updated_at
+def weather_etag(weather):
+    return f"{weather.id}-{weather.updated_at.strftime('%Y%m%d%H%M%S%f')}"
+
+def etag_updated_at(id, etag):
+    # inverse of weather_etag, None for an ETag of another weather or another format
+    prefix = f'{id}-'
+    if not etag.startswith(prefix):
+        return None
+    try:
+        return datetime.strptime(etag[len(prefix):], '%Y%m%d%H%M%S%f')
+    except ValueError:
+        return None
+
+def weather_last_modified(weather):
+    # updated_at is naive server local time (datetime.now), converted rather than labelled as UTC
+    return weather.updated_at.astimezone(timezone.utc)
+
+# conditional requests: If-None-Match wins over If-Modified-Since
+def not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        # weak comparison, proxies weaken the ETags of the bodies they compress
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        # HTTP dates have a one second resolution
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def not_modified_response(etag, last_modified=None):
+    return with_validators(Response(status=304), etag, last_modified)
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+# total number of weathers, cached to avoid a COUNT(*) per page
+def get_weathers_count():
+    cached_count = redis.get('weather_count')
+    if cached_count is not None:
+        return int(cached_count)
+    _, modified = all_weathers_cache.version('all_weathers')
+    with cache_fill_reads(modified):
+        count = db_count_weathers()
+    redis.set('weather_count', count, ex=WEATHER_COUNT_CACHE_TTL)
+    return count
+
+# opaque cursor holding the sort key of the last row of a page
+def encode_cursor(weather, order):
+    if order == 'created_at':
+        key = {'o': order, 'c': weather.created_at.isoformat(), 'id': weather.id}
+    else:
+        key = {'o': order, 'id': weather.id}
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, order):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if key['o'] != order:
+            raise ValueError(f"Cursor order {key['o']} does not match {order}")
+        if order == 'created_at':
+            return datetime.fromisoformat(key['c']), int(key['id'])
+        return int(key['id'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+# listing filters, pushed down to SQL by db_query_weathers
+FILTER_PARAMS = ('city', 'from', 'to', 'min_temperature', 'max_temperature', 'min_humidity', 'max_humidity')
+
+def parse_weather_filters(args):
+    filters = {}
+    for param in FILTER_PARAMS:
+        value = args.get(param)
+        if value is None:
+            continue
+        if param == 'city':
+            filters[param] = value
+        elif param in ('from', 'to'):
+            filters[param] = parse_datetime(param, value)
+        else:
+            filters[param] = parse_decimal(param, value)
+    return filters
+
+def parse_weather_sort(value):
+    if not value:
+        return []
+    sort = []
+    for key in value.split(','):
+        column = key.strip().lstrip('-')
+        if column not in SORTABLE_COLUMNS:
+            raise ValueError(f'Invalid sort: {key}')
+        sort.append((column, key.strip().startswith('-')))
+    return sort
+
+def parse_datetime(param, value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid {param}: {value}')
+    if parsed.tzinfo is not None:
+        # stored timestamps are naive server local time
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+def parse_decimal(param, value):
+    try:
+        parsed = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'Invalid {param}: {value}')
+    if not parsed.is_finite():
+        raise ValueError(f'Invalid {param}: {value}')
+    return parsed
+
+def parse_positive_int(param, value):
+    if value is None:
+        return None
+    try:
+        parsed = int(value)
+    except ValueError:
+        raise ValueError(f'Invalid {param}: {value}')
+    if parsed < 1:
+        raise ValueError(f'Invalid {param}: {value}')
+    return parsed
+
+def parse_weather_id(value):
+    # ids of a query string arrive as strings, those of a JSON body as numbers
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'Invalid id: {value}')
+    return parse_positive_int('id', value.strip() if isinstance(value, str) else value)
+
+# target of a bulk update or delete: either ids or a non empty filter, never the whole table by accident
+def parse_bulk_selection(body):
+    ids, filter = body.get('ids'), body.get('filter')
+    if (ids is None) == (filter is None):
+        raise ValueError('Either ids or filter is required')
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise ValueError('ids must be a non empty array')
+        return [parse_weather_id(id) for id in ids], None
+    if not isinstance(filter, dict):
+        raise ValueError('filter must be an object')
+    for param, value in filter.items():
+        if param not in FILTER_PARAMS:
+            raise ValueError(f'Invalid filter: {param}')
+        if isinstance(value, (dict, list, bool)) or value is None:
+            raise ValueError(f'Invalid {param}: {value}')
+    filters = parse_weather_filters({param: str(value) for param, value in filter.items()})
+    if not filters:
+        raise ValueError('filter must have at least one parameter')
+    return None, filters
+
+def parse_bulk_update_values(values):
+    if not isinstance(values, dict) or not values:
+        raise ValueError('set must be a non empty object')
+    parsed = {}
+    for key, value in values.items():
+        if key not in UPDATABLE_COLUMNS:
+            raise ValueError(KeyNotExistException(key).message)
+        if key in ('temperature', 'humidity'):
+            parsed[key] = parse_decimal(key, str(value))
+        elif isinstance(value, str):
+            parsed[key] = value
+        else:
+            raise ValueError(f'Invalid {key}: {value}')
+    return parsed
+
 def validate_required_creation_params(params):
     required_params = ['city', 'temperature', 'humidity', 'description']
     missing_params = [param for param in required_params if param not in params]
     return missing_params
 
+# bulk body is either a JSON array or one JSON object per line (NDJSON)
+_INVALID_JSON = object()
+
+def parse_bulk_body():
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(_INVALID_JSON)
+        return items
+    items = request.get_json(silent=True)
+    return items if isinstance(items, list) else None
+
+def validate_bulk_item(item):
+    if item is _INVALID_JSON:
+        return {'message': 'Invalid JSON'}
+    if not isinstance(item, dict):
+        return {'message': 'Item must be an object'}
+    missing_params = validate_required_creation_params(item)
+    if missing_params:
+        return validation_failed_resp(missing_params)
+    invalid_params = []
+    for param, length in STRING_LENGTHS.items():
+        if param in item and not (isinstance(item[param], str) and len(item[param]) <= length):
+            invalid_params.append(param)
+    for param, (scale, bound) in DECIMAL_LIMITS.items():
+        if param not in item:
+            continue
+        try:
+            if isinstance(item[param], (bool, dict, list)) or item[param] is None:
+                raise InvalidOperation
+            # rounded to the scale the column stores, e.g. 999.995 doesn't fit DECIMAL(5,2)
+            if not abs(Decimal(str(item[param])).quantize(Decimal(1).scaleb(-scale))) < bound:
+                raise InvalidOperation
+        except InvalidOperation:
+            invalid_params.append(param)
+    if invalid_params:
+        return {'message': 'weather creation failed!', 'invalid': invalid_params}
+    return None
+
 # verify creation parameters
 def validation_failed_resp(params):
     response = {